@@ -3,11 +3,17 @@ import xarray as xr
 import numpy as np
 import sys
 import xesmf
+from smc_io import prefetch, BackgroundWriter
+from smc_grid import extract_lat_lon_init_SM_region
 
+# usage: SMC_to_stress.py initial_SMC glm_dump SMstress_outfile glm_start_dump [initial_SMC_2 SMstress_outfile_2 ...]
+# extra (initial SMC, outfile) pairs, e.g. further dates on the same grid, reuse the soil properties.
+# The next SMC file is read and the previous SM stress written in the background while the current date is converted.
 initial_SMC_filename = sys.argv[1]
 glm_dump_filename = sys.argv[2]
 SMstress_outfile = sys.argv[3]
 glm_start_dump_filename = sys.argv[4]
+extra_dates = sys.argv[5:]
 
 def find_nearest_index(array, value):
     array = np.asarray(array)
@@ -23,37 +29,55 @@ def load_dump_file(dumpfile,stash_code):
     cube = xr_cube.to_iris()
     return cube
 
-def extract_lat_lon_init_SM_region(cube,SM_init_cube):
-    return cube.extract(iris.Constraint(latitude=lambda cell: np.min(SM_init_cube.coord('latitude').points) <= cell <= np.max(SM_init_cube.coord('latitude').points))).extract(iris.Constraint(longitude=lambda cell: np.min(SM_init_cube.coord('longitude').points) <= cell <= np.max(SM_init_cube.coord('longitude').points)))
+def load_SMC(SMC_filename):
+    ''' load SMC and read its data, so the read happens on the prefetch thread'''
+    cube = iris.load_cube(SMC_filename)
+    cube.data
+    return cube
 
 save_directory = '/work/n02/n02/jostal/prescribed_SM_files/initial_MO_SMC_v2/'
 
 rho_water = 997.77
 
-SM_init = iris.load_cube(initial_SMC_filename)
+if len(extra_dates) % 2 != 0:
+    sys.exit('usage: SMC_to_stress.py initial_SMC glm_dump SMstress_outfile glm_start_dump [initial_SMC SMstress_outfile ...]')
+SMC_dates = list(zip([initial_SMC_filename] + extra_dates[0::2], [SMstress_outfile] + extra_dates[1::2]))
+
 SM_wilt = load_dump_file(glm_dump_filename,'m01s00i040')
 SM_crit = load_dump_file(glm_dump_filename,'m01s00i041')
 SM_sat = load_dump_file(glm_dump_filename,'m01s00i043')
 SM_init_4km = iris.load_cube(glm_start_dump_filename,'moisture_content_of_soil_layer') # for depths
 
+# read soil properties now, rather than lazily while the next date is being prefetched
+for cube in [SM_wilt,SM_crit,SM_sat]:
+    cube.data
+
+# background reads only start here, after the soil properties have been read
+SMC_inputs = prefetch(lambda date: load_SMC(date[0]), SMC_dates)
+(_, SMstress_outfile), SM_init = next(SMC_inputs)
+
 # ensure spatial extent is same as initial SM file - i.e. Warner's domain.
 SM_wilt = extract_lat_lon_init_SM_region(SM_wilt,SM_init)
 SM_crit = extract_lat_lon_init_SM_region(SM_crit,SM_init)
 SM_sat = extract_lat_lon_init_SM_region(SM_sat,SM_init)
 
-# convert to SMC VOLUME and SMC stress.
-# copy n1280 initial SM cube
-SM_volume = SM_init.copy()
-SM_stress = SM_init.copy()
-
 # work out SM depths, i.e. 0.1-0.0, 0.35-0.1
 SM_depths = SM_init_4km.coord('depth').bounds[:,1]-SM_init_4km.coord('depth').bounds[:,0]
 
-# loop through each layer. Work out SM volume (SMC/(depth*rho_water)), work out SM stress ((SMV-SMwilt)/(SMcrit-SMwilt))
-for depth_i in np.arange(SM_init_4km.coord('depth').shape[0]):
-    SM_volume.data[depth_i] = SM_init.data[depth_i]/(SM_depths[depth_i]*rho_water)
-    SM_stress.data[depth_i] = (SM_volume.data[depth_i]-SM_wilt.data)/(SM_crit.data-SM_wilt.data)
+def SMC_to_stress(SM_init):
+    # convert to SMC VOLUME and SMC stress.
+    # copy n1280 initial SM cube
+    SM_volume = SM_init.copy()
+    SM_stress = SM_init.copy()
 
-# save SM stress
-iris.save(SM_stress,SMstress_outfile)
+    # loop through each layer. Work out SM volume (SMC/(depth*rho_water)), work out SM stress ((SMV-SMwilt)/(SMcrit-SMwilt))
+    for depth_i in np.arange(SM_init_4km.coord('depth').shape[0]):
+        SM_volume.data[depth_i] = SM_init.data[depth_i]/(SM_depths[depth_i]*rho_water)
+        SM_stress.data[depth_i] = (SM_volume.data[depth_i]-SM_wilt.data)/(SM_crit.data-SM_wilt.data)
+    return SM_stress
 
+# save SM stress, all dates sharing the soil properties above
+with BackgroundWriter() as writer:
+    writer.submit(iris.save,SMC_to_stress(SM_init),SMstress_outfile)
+    for (_, SMstress_outfile), SM_init in SMC_inputs:
+        writer.submit(iris.save,SMC_to_stress(SM_init),SMstress_outfile)
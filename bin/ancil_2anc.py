@@ -36,6 +36,12 @@ determined from the content of the `source_file`.
 You will often need to specify the grid staggering as this usually can not be
 inferred from the metadata in input files.
 
+With ``--stream``, the source is never loaded whole: the ancillary is written
+one 2D field at a time from the lazy source (see
+:mod:`ancil_utils.ancilfile`), so that memory use stays constant for large
+time varying sources, and the NetCDF file is only written (itself streamed
+from the lazy source) when ``--netcdf`` is also given.
+
 See Also
 --------
 
@@ -45,6 +51,7 @@ See Also
 """
 import warnings
 
+import ancil_utils.ancilfile
 import ants
 import iris
 
@@ -58,7 +65,7 @@ def load_data(source):
     return cubes
 
 
-def main(source_path, output_path, grid_staggering=None):
+def main(source_path, output_path, grid_staggering=None, stream=False, netcdf=False):
     """
     Convert specified source file to an ancillary.
 
@@ -67,9 +74,14 @@ def main(source_path, output_path, grid_staggering=None):
     source_path : str
         Source data file path to be converted to an ancillary.
     output_path : str
-        Output ancillary file path.  A NetCDF will also be written.
+        Output ancillary file path.  A NetCDF will also be written, unless
+        streaming without `netcdf`.
     grid_staggering : int, optional
         Grid staggering lookup, see UM F03 - FLH(9).
+    stream : bool, optional
+        Write the ancillary one field at a time from the lazy source.
+    netcdf : bool, optional
+        Whether to also write the NetCDF file when streaming.
 
     Returns
     -------
@@ -82,7 +94,13 @@ def main(source_path, output_path, grid_staggering=None):
     if grid_staggering is not None:
         for source_cube in source_cubes:
             source_cube.attributes["grid_staggering"] = grid_staggering
-    ants.save(source_cubes, output_path)
+    if not stream:
+        ants.save(source_cubes, output_path)
+        return source_cubes
+
+    ancil_utils.ancilfile.save(source_cubes, output_path)
+    if netcdf:
+        iris.save(source_cubes, output_path + ".nc")
     return source_cubes
 
 
@@ -96,9 +114,26 @@ def _get_parser():
         "staggerings is not provided."
     )
     parser.add_argument("--grid-staggering", "-g", type=int, help=help_text)
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Write the ancillary one field at a time, without loading the "
+        "source whole.",
+    )
+    parser.add_argument(
+        "--netcdf",
+        action="store_true",
+        help="Also write the NetCDF file when streaming.",
+    )
     return parser
 
 
 if __name__ == "__main__":
     args = _get_parser().parse_args()
-    main(args.sources, args.output, args.grid_staggering)
+    main(
+        args.sources,
+        args.output,
+        args.grid_staggering,
+        stream=args.stream,
+        netcdf=args.netcdf,
+    )
@@ -16,13 +16,21 @@ are the steps taken:
 - Sets mask points as ocean where the corresponding vegetation fraction point
   is resolved lake.
 
+On the same lat-lon grids, rather than regridding the CCI data, the nearest
+CCI point of each mask point is looked up in an index map (cached on disk per
+pair of grids, see :mod:`ancil_utils.cache`), and only the CCI points used are
+read and compared to the resolved lake flag, the result being gathered as a
+boolean array.
+
 Fields returned:
 
 - Land sea mask 'm01s00i030'
 
 """
+import ancil_utils.cache
 import ants
 import iris
+import numpy as np
 
 
 def load_data(source_path, vegetation_fraction_path):
@@ -40,6 +48,107 @@ def _get_resolved_lake_value(vegetation_fraction):
     return resolved_lake_value
 
 
+def _coord_points(cube, axis):
+    coord = cube.coord(axis=axis, dim_coords=True)
+    return coord.units.convert(coord.points, "degrees"), coord
+
+
+def nearest_indices(source_points, target_points, circular=False):
+    """
+    Return the index of the nearest source point of each target point.
+
+    As :class:`iris.analysis.Nearest`, targets beyond the source take the
+    nearest edge point (unless circular) and ties take the lower point.
+
+    Parameters
+    ----------
+    source_points : :class:`numpy.ndarray`
+        Monotonic source coordinate points.
+    target_points : :class:`numpy.ndarray`
+    circular : bool, optional
+        Whether the source points are longitudes, wrapping modulo 360.
+
+    Returns
+    -------
+    : :class:`numpy.ndarray`
+
+    """
+    order = np.argsort(source_points, kind="stable")
+    points = source_points[order]
+    targets = np.asarray(target_points, dtype=np.float64)
+    if circular:
+        targets = points[0] + (targets - points[0]) % 360.0
+        points = np.append(points, points[0] + 360.0)
+        order = np.append(order, order[0])
+    upper = np.clip(np.searchsorted(points, targets, side="right"), 1, points.size - 1)
+    lower = upper - 1
+    nearest = np.where(targets - points[lower] <= points[upper] - targets, lower, upper)
+    return order[nearest]
+
+
+def nearest_index_map(source, target):
+    """
+    Return the rows and columns of the nearest source point of each target.
+
+    Cached on disk per pair of grids.
+
+    Parameters
+    ----------
+    source : :class:`iris.cube.Cube`
+    target : :class:`iris.cube.Cube`
+
+    Returns
+    -------
+    : tuple(:class:`numpy.ndarray`, :class:`numpy.ndarray`)
+        Source row of each target row and source column of each target
+        column.
+
+    """
+    keys = (ancil_utils.cache.grid_hash(source), ancil_utils.cache.grid_hash(target))
+    cached = ancil_utils.cache.load("nearest_index", *keys)
+    if cached is not None:
+        return cached["rows"], cached["columns"]
+    source_y, _ = _coord_points(source, "y")
+    source_x, x_coord = _coord_points(source, "x")
+    target_y, _ = _coord_points(target, "y")
+    target_x, _ = _coord_points(target, "x")
+    rows = nearest_indices(source_y, target_y)
+    columns = nearest_indices(source_x, target_x, circular=bool(x_coord.circular))
+    ancil_utils.cache.save("nearest_index", *keys, rows=rows, columns=columns)
+    return rows, columns
+
+
+def _is_2d_lat_lon(cube):
+    y_coord = cube.coord(axis="y", dim_coords=True)
+    x_coord = cube.coord(axis="x", dim_coords=True)
+    return (
+        cube.ndim == 2
+        and cube.coord_dims(y_coord) == (0,)
+        and not isinstance(x_coord.coord_system, iris.coord_systems.RotatedGeogCS)
+    )
+
+
+def _same_lat_lon(source, target):
+    # Both 2D (y, x) lat-lon grids on the same coordinate system (or both
+    # without one), so that their points are comparable.
+    source_crs = source.coord(axis="x", dim_coords=True).coord_system
+    target_crs = target.coord(axis="x", dim_coords=True).coord_system
+    return (
+        _is_2d_lat_lon(source) and _is_2d_lat_lon(target) and source_crs == target_crs
+    )
+
+
+def _resolved_lake(source, vegetation_fraction, resolved_lake_value):
+    # Resolved lake at the nearest vegetation fraction point of each source
+    # point, reading only the vegetation fraction points used.
+    rows, columns = nearest_index_map(vegetation_fraction, source)
+    used_rows, row_index = np.unique(rows, return_inverse=True)
+    used_columns, column_index = np.unique(columns, return_inverse=True)
+    data = vegetation_fraction.core_data()[used_rows][:, used_columns]
+    lake = np.ma.filled(np.asanyarray(data) == resolved_lake_value, False)
+    return lake[np.ix_(row_index, column_index)]
+
+
 def _add_lakes(source, vegetation_fraction, resolved_lake_value):
     """
     Return land and sea masks where OSTIA lakes have been added.
@@ -58,6 +167,11 @@ def _add_lakes(source, vegetation_fraction, resolved_lake_value):
 
     """
 
+    if _same_lat_lon(vegetation_fraction, source):
+        lake = _resolved_lake(source, vegetation_fraction, resolved_lake_value)
+        source.data[lake] = 0
+        return source
+
     regridded_vegetation_fraction = vegetation_fraction.regrid(
         source, scheme=iris.analysis.Nearest()
     )
@@ -20,6 +20,7 @@ for a nearest neighbour fill of missing data for land only or ocean only
 fields after the regrid has been done.
 
 """
+import ancil_utils.fill
 import ants
 import ants.decomposition as decomp
 import ants.fileformats._ugrid
@@ -80,6 +81,8 @@ def main(
     land_fraction_threshold=None,
     begin=None,
     end=None,
+    fill_engine="spiral",
+    fill_map=None,
 ):
     """
     General regrid application top level call function.
@@ -118,6 +121,11 @@ def main(
     end : datetime, optional
         If provided, all source data after this year is discarded.  Default is to
         include all source data.
+    fill_engine : str, optional
+        Either "spiral" (:func:`ants.analysis.make_consistent_with_lsm`) or
+        "kdtree" (:func:`ancil_utils.fill.make_consistent_with_lsm`).
+    fill_map : str, optional
+        File to reuse, and save, the "kdtree" fill index maps.
     Returns
     -------
     : :class:`~iris.cube.Cube`
@@ -129,15 +137,24 @@ def main(
     )
     source_cube = source_cubes[0]
 
-    target_cube.coord('latitude').coord_system = None
-    target_cube.coord('longitude').coord_system = None
-    source_cube.coord('latitude').coord_system = None
-    source_cube.coord('longitude').coord_system = None
-    source_cube.coord('latitude').var_name = None
-    source_cube.coord('longitude').var_name = None
-
-    ants.analysis.make_consistent_with_lsm(
-            source_cube, target_cube,invert_mask)
+    # Regular lat/lon sources written by xarray carry no coordinate system, so
+    # it is removed from both to force a match.  Rotated pole coordinates are
+    # copied from the target lsm upstream and so already match.
+    for cube in [target_cube, source_cube]:
+        for axis in ["x", "y"]:
+            coord = cube.coord(axis=axis, dim_coords=True)
+            if not isinstance(coord.coord_system, iris.coord_systems.RotatedGeogCS):
+                coord.coord_system = None
+            if cube is source_cube:
+                coord.var_name = None
+
+    if fill_engine == "kdtree":
+        ancil_utils.fill.make_consistent_with_lsm(
+            source_cube, target_cube, invert_mask, cache_file=fill_map
+        )
+    else:
+        ants.analysis.make_consistent_with_lsm(
+                source_cube, target_cube,invert_mask)
     ants.save(source_cube, output_path)
 
     return source_cube
@@ -155,6 +172,19 @@ def _get_parser():
     parser.add_argument(
         "--invert-mask", action="store_false", help=invmask_help, required=False,
     )
+    engine_help = (
+        "Missing data fill engine.  'spiral' (default) uses the ANTS spiral "
+        "search, 'kdtree' resolves all missing points with one nearest "
+        "neighbour query (see ancil_utils.fill)."
+    )
+    parser.add_argument(
+        "--fill-engine", choices=["spiral", "kdtree"], default="spiral",
+        help=engine_help,
+    )
+    parser.add_argument(
+        "--fill-map", type=str, required=False,
+        help="File to reuse, and save, the kdtree fill index maps.",
+    )
     return parser
 
 
@@ -172,6 +202,8 @@ def _run_app():
         args.land_threshold,
         args.begin,
         args.end,
+        args.fill_engine,
+        args.fill_map,
     )
 
 
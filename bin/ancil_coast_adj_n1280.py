@@ -20,6 +20,7 @@ for a nearest neighbour fill of missing data for land only or ocean only
 fields after the regrid has been done.
 
 """
+import ancil_utils.fill
 import ants
 import ants.decomposition as decomp
 import ants.fileformats._ugrid
@@ -28,10 +29,64 @@ from ants.config import CONFIG
 from ants.utils.cube import create_time_constrained_cubes
 import iris
 import numpy as np
-import xarray as xr
 
-def extract_lat_lon_init_SM_region(cube,SM_init_cube):
-    return cube.extract(iris.Constraint(latitude=lambda cell: np.min(SM_init_cube.coord('latitude').points) <= cell <= np.max(SM_init_cube.coord('latitude').points))).extract(iris.Constraint(longitude=lambda cell: np.min(SM_init_cube.coord('longitude').points) <= cell <= np.max(SM_init_cube.coord('longitude').points)))
+
+def crop_to_source_region(target_cube, source_cube):
+    """
+    Return the part of the target covering the source region.
+
+    The row and column windows are found on the original target coordinates
+    and only those are sliced out, so the global target is never copied as a
+    whole.  Longitudes are wrapped to the same range as the source.  Where the
+    source region runs past the end of the target longitudes (e.g. a 0 to 360
+    target and a region spanning the Greenwich meridian) the two slices either
+    side of the seam are concatenated.
+
+    Parameters
+    ----------
+    target_cube : :class:`~iris.cube.Cube`
+        Target (e.g. global landsea mask) cube.
+    source_cube : :class:`~iris.cube.Cube`
+        Regional source cube.
+
+    Returns
+    -------
+    : :class:`~iris.cube.Cube`
+        Target cube cropped to the source latitudes and longitudes (inclusive).
+
+    """
+    src_lat = source_cube.coord("latitude").points
+    src_lon = source_cube.coord("longitude").points
+    lat = target_cube.coord("latitude").points
+    rows = np.flatnonzero((lat >= src_lat.min()) & (lat <= src_lat.max()))
+
+    lon_coord = target_cube.coord("longitude")
+    lon_min = src_lon.min()
+    # Longitude east of the start of the source region, in [0, 360).
+    offset = (lon_coord.points - lon_min) % 360.0
+    cols = np.flatnonzero(offset <= src_lon.max() - lon_min)
+    if rows.size == 0 or cols.size == 0:
+        raise ValueError("Target does not cover the source region.")
+    cols = cols[np.argsort(offset[cols], kind="stable")]
+
+    y_dim = target_cube.coord_dims("latitude")[0]
+    x_dim = target_cube.coord_dims("longitude")[0]
+    pieces = iris.cube.CubeList()
+    for piece in np.split(cols, np.flatnonzero(np.diff(cols) != 1) + 1):
+        keys = [slice(None)] * target_cube.ndim
+        keys[y_dim] = slice(rows[0], rows[-1] + 1)
+        keys[x_dim] = slice(piece[0], piece[-1] + 1)
+        cube = target_cube[tuple(keys)]
+        coord = cube.coord("longitude")
+        shift = lon_min + offset[piece] - coord.points
+        if coord.has_bounds():
+            coord.bounds = coord.bounds + shift[:, np.newaxis]
+        coord.points = coord.points + shift
+        pieces.append(cube)
+    if len(pieces) == 1:
+        return pieces[0]
+    return pieces.concatenate_cube()
+
 
 def load_data(
     source,
@@ -80,6 +135,8 @@ def main(
     land_fraction_threshold=None,
     begin=None,
     end=None,
+    fill_engine="spiral",
+    fill_map=None,
 ):
     """
     General regrid application top level call function.
@@ -118,6 +175,11 @@ def main(
     end : datetime, optional
         If provided, all source data after this year is discarded.  Default is to
         include all source data.
+    fill_engine : str, optional
+        Either "spiral" (:func:`ants.analysis.make_consistent_with_lsm`) or
+        "kdtree" (:func:`ancil_utils.fill.make_consistent_with_lsm`).
+    fill_map : str, optional
+        File to reuse, and save, the "kdtree" fill index maps.
     Returns
     -------
     : :class:`~iris.cube.Cube`
@@ -128,14 +190,8 @@ def main(
         source_path, target_path, target_lsm_path, land_fraction_threshold, begin, end,
     )
     source_cube = source_cubes[0]
-  
-    # change target cube longitude coordinates
-    xr_cube = xr.DataArray.from_iris(target_cube)
-    xr_cube = xr_cube.assign_coords(longitude=(((xr_cube.longitude + 180.0) % 360.0) - 180.0))
-    xr_cube = xr_cube.sortby([xr_cube.longitude])
-    target_cube = xr_cube.to_iris()
 
-    target_cube = extract_lat_lon_init_SM_region(target_cube,source_cube)
+    target_cube = crop_to_source_region(target_cube, source_cube)
 
     target_cube.coord('latitude').coord_system = None
     target_cube.coord('longitude').coord_system = None
@@ -144,19 +200,13 @@ def main(
     source_cube.coord('latitude').var_name = None
     source_cube.coord('longitude').var_name = None
 
-    print (target_cube.coord('latitude'))
-    print (source_cube.coord('latitude'))
-    print (target_cube.coord('longitude'))
-    print (source_cube.coord('longitude'))
-
-    print (source_cube)
-    print (target_cube)
-
-   
-
-
-    ants.analysis.make_consistent_with_lsm(
-            source_cube, target_cube,invert_mask)
+    if fill_engine == "kdtree":
+        ancil_utils.fill.make_consistent_with_lsm(
+            source_cube, target_cube, invert_mask, cache_file=fill_map
+        )
+    else:
+        ants.analysis.make_consistent_with_lsm(
+                source_cube, target_cube,invert_mask)
     ants.save(source_cube, output_path)
 
     return source_cube
@@ -174,6 +224,19 @@ def _get_parser():
     parser.add_argument(
         "--invert-mask", action="store_false", help=invmask_help, required=False,
     )
+    engine_help = (
+        "Missing data fill engine.  'spiral' (default) uses the ANTS spiral "
+        "search, 'kdtree' resolves all missing points with one nearest "
+        "neighbour query (see ancil_utils.fill)."
+    )
+    parser.add_argument(
+        "--fill-engine", choices=["spiral", "kdtree"], default="spiral",
+        help=engine_help,
+    )
+    parser.add_argument(
+        "--fill-map", type=str, required=False,
+        help="File to reuse, and save, the kdtree fill index maps.",
+    )
     return parser
 
 
@@ -191,6 +254,8 @@ def _run_app():
         args.land_threshold,
         args.begin,
         args.end,
+        args.fill_engine,
+        args.fill_map,
     )
 
 
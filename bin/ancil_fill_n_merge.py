@@ -16,10 +16,18 @@ the primary.  See :func:`ants.analysis.merge` for further details.  In the case
 of multiple phenomena within two source files, primary and alternate cubes are
 sorted to ensure that the correct phenomena are paired for merging
 (see :func:`ants.utils.cube.group_cubes`).
+On lat-lon grids, the validity polygon is rasterised once to a mask on the
+primary grid (cached on disk, see :mod:`ancil_utils.raster`) and the primary
+is masked outside it, so that the merge is a masked select rather than a
+point in polygon test of every grid cell.
 Filling of missing data is perfomed as a final step which can optionally
-account for a landseamask.
+account for a landseamask.  With ``--fill-engine kdtree`` the fill index maps
+are shared, through the on-disk cache, with every other application filling
+against the same landseamask (see :mod:`ancil_utils.fill`).
 
 """
+import ancil_utils.fill
+import ancil_utils.raster
 import ants
 import cartopy
 from ants.utils.cube import create_time_constrained_cubes
@@ -102,6 +110,7 @@ def main(
     land_fraction_threshold=None,
     begin=None,
     end=None,
+    fill_engine="spiral",
 ):
     """
     Perform merge and fill operation on the provided sources.
@@ -135,6 +144,10 @@ def main(
     end : datetime, optional
         If provided, all source data after this year is discarded.  Default is to
         include all source data.
+    fill_engine : str, optional
+        Engine making the result consistent with the target mask, "spiral"
+        (:func:`ants.analysis.make_consistent_with_lsm`) or "kdtree"
+        (:func:`ancil_utils.fill.make_consistent_with_lsm`).
     Returns
     -------
     : :class:`~iris.cube.CubeList`
@@ -153,9 +166,19 @@ def main(
 
     result = primary_cubes
     if alternate_cubes is not None:
+        if validity_polygon is not None and all(
+            ancil_utils.raster.is_lat_lon(cube) for cube in primary_cubes
+        ):
+            ancil_utils.raster.mask_outside(
+                primary_cubes, validity_polygon, validity_polygon_filepath
+            )
+            validity_polygon = None
         result = ants.analysis.merge(primary_cubes, alternate_cubes, validity_polygon)
     if target_mask_filepath:
-        ants.analysis.make_consistent_with_lsm(result, lbm, invert_mask)
+        if fill_engine == "kdtree":
+            ancil_utils.fill.make_consistent_with_lsm(result, lbm, invert_mask)
+        else:
+            ants.analysis.make_consistent_with_lsm(result, lbm, invert_mask)
     ants.save(result, output)
     return result
 
@@ -199,6 +222,15 @@ def _get_parser():
     parser.add_argument(
         "--invert-mask", action="store_false", help=invmask_help, required=False,
     )
+    engine_help = (
+        "Missing data fill engine.  'spiral' (default) uses the ANTS spiral "
+        "search, 'kdtree' resolves all missing points with one nearest "
+        "neighbour query (see ancil_utils.fill)."
+    )
+    parser.add_argument(
+        "--fill-engine", choices=["spiral", "kdtree"], default="spiral",
+        help=engine_help,
+    )
     return parser
 
 
@@ -222,4 +254,5 @@ if __name__ == "__main__":
         land_fraction_threshold=args.land_threshold,
         begin=args.begin,
         end=args.end,
+        fill_engine=args.fill_engine,
     )
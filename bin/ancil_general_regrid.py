@@ -20,13 +20,20 @@ for a nearest neighbour fill of missing data for land only or ocean only
 fields after the regrid has been done.
 
 """
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import ancil_utils.decomposition as decomp
 import ants
-import ants.decomposition as decomp
 import ants.fileformats._ugrid
 import ants.utils
 from ants.config import CONFIG
 from ants.utils.cube import create_time_constrained_cubes
 
+_LOGGER = logging.getLogger(__name__)
+
 
 def load_data(
     source,
@@ -48,9 +55,39 @@ def load_data(
     return source_cubes, target_cube
 
 
-def regrid(sources, target, ugrid_target=False):
+def _grid_coords(cube):
+    return [cube.coords(axis=axis, dim_coords=True) for axis in "xyz"]
+
+
+def regrid(sources, target, ugrid_target=False, max_workers=None):
+    """
+    Regrid each of the sources to the target.
+
+    Sources sharing a grid share one regridder, so the regrid weights are
+    computed once for each source/target grid pair rather than once per cube.
+    The cubes are then regridded concurrently, each realising its (possibly
+    lazily loaded) data first, one at a time, as the netCDF library is not
+    thread safe.
+
+    Parameters
+    ----------
+    sources : :class:`~iris.cube.Cube` or :class:`~iris.cube.CubeList`
+        Source cube(s) to regrid.
+    target : :class:`~iris.cube.Cube`
+        Cube defining the target grid.
+    ugrid_target : bool, optional
+        Whether the target is a UGrid.
+    max_workers : int, optional
+        Number of cubes regridded at once.  Defaults to the number of CPUs.
+        UGrid regridding is always done serially, as ESMPy is not thread safe.
+
+    Returns
+    -------
+    : list of :class:`~iris.cube.Cube`
+        Regridded cubes, in the order of the sources.
+
+    """
     sources = ants.utils.cube.as_cubelist(sources)
-    results = []
     scheme = ants.regrid.GeneralRegridScheme(horizontal_scheme=ants.regrid.rectilinear.Linear(extrapolation_mode='linear'))
     if ugrid_target:
         scheme = ants.regrid.GeneralRegridScheme(
@@ -59,12 +96,40 @@ def regrid(sources, target, ugrid_target=False):
         # Current configuration of ESMPy for UGrid (i.e. Conservative
         # regridding) requires bounds.  This restriction may be relaxed later.
         ants.utils.cube.guess_horizontal_bounds(sources)
+        max_workers = 1
+
+    grids = []
+    regridders = []
     for source in sources:
-        print (source)
-        print (target)
-        results.append(source.regrid(target, scheme))
-        print (results)
-    return results
+        grid = _grid_coords(source)
+        if grid not in grids:
+            grids.append(grid)
+            regridders.append(scheme.regridder(source, target))
+    _LOGGER.info(
+        "Regridding %d cube(s) on %d source grid(s)", len(sources), len(grids)
+    )
+
+    read_lock = threading.Lock()
+
+    def _regrid(source):
+        if source.has_lazy_data():
+            with read_lock:
+                source.data
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug(
+                "Regridding %s to %s",
+                source.summary(shorten=True),
+                target.summary(shorten=True),
+            )
+        return regridders[grids.index(_grid_coords(source))](source)
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, len(sources)))
+    if max_workers == 1:
+        return [_regrid(source) for source in sources]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(_regrid, sources))
 
 
 def main(
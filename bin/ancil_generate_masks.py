@@ -21,6 +21,8 @@ Here are the steps taken:
 - Derives the sea mask (qrparm.mask_sea) from the land cover type fraction
   field, where any point with land_frac < 1 is set as sea (i.e. data value of
   0) in the qrparm.mask file.
+- Both masks are derived in a single pass and the three files are written
+  one after the other (see :mod:`ancil_utils.masks`).
 
 Fields returned:
 
@@ -33,42 +35,10 @@ be written, rather than the paths for the individual masks.
 
 """
 
-import os
-
+import ancil_utils.decomposition
+import ancil_utils.masks
 import ants
-import ants.decomposition
 import iris
-import numpy as np
-
-
-def _prepare_mask_cube(cube):
-    """
-    Sets the attributes needed for mask files, and converts datatype to integer.
-
-    Operates in place.
-
-    Attributes 'valid_min' and 'valid_max' are set to ensure netCDF result is
-    correct for boolean data.
-
-    STASH code is set to m01s00i030.
-
-    Data type is set to integer.
-
-    Parameters
-    ----------
-    cube : :class:`iris.cube.Cube`
-        Mask cube to prepare.
-
-    Returns
-    -------
-    : None
-    Operates in place.
-
-    """
-    cube.attributes["valid_min"] = 0
-    cube.attributes["valid_max"] = 1
-    cube.attributes["STASH"] = iris.fileformats.pp.STASH.from_msi("m01s00i030")
-    cube.data = cube.data.astype("int8")
 
 
 def load_data(source_path,):
@@ -77,62 +47,15 @@ def load_data(source_path,):
     return source
 
 
-def _derive_masks(land_fraction):
-    """
-    Return land and sea masks derived from land fraction.
-
-    For the land mask, any land fraction values > 0 are interpreted as land.
-    For the sea mask, any land fraction value < 1 are interpreted as sea.
-
-    Parameters
-    ----------
-    land_fraction : :class:`iris.cube.Cube`
-        Land cover fraction cube
-
-    Returns
-    -------
-    : tuple(:class:`iris.cube.Cube`, :class:`iris.cube.Cube`)
-        The land mask and sea mask cubes, in that order.
-
-    """
-    # Coastal points (i.e. where land fraction is between 0 and 1) are classed
-    # as land for the land mask and sea for the sea mask.  So we use a default
-    # land mask value of 0 i.e. sea:
-    land_mask = land_fraction.copy(data=np.zeros_like(land_fraction.data))
-    # And where there's any land in the cell, we set the land mask to land:
-    land_mask.data[land_fraction.data > 0] = 1
-
-    # Similarly, default sea mask value is 1 i.e. land:
-    sea_mask = land_fraction.copy(data=np.ones_like(land_fraction.data))
-    # And where there's any sea in the cell, we set the sea mask to sea:
-    sea_mask.data[land_fraction.data < 1] = 0
-
-    land_mask.rename("land_binary_mask")
-    sea_mask.rename("land_binary_mask")
-
-    land_mask.attributes["STASH"] = iris.fileformats.pp.STASH.from_msi("m01s00i030")
-    sea_mask.attributes["STASH"] = iris.fileformats.pp.STASH.from_msi("m01s00i030")
-
-    return land_mask, sea_mask
-
-
 def main(
     source_path, output_filepath,
 ):
     land_fraction = load_data(source_path)
 
-    land_mask, sea_mask = ants.decomposition.decompose(_derive_masks, land_fraction)
-
-    ants.config.dirpath_writeable(output_filepath)
-    _prepare_mask_cube(land_mask)
-    _prepare_mask_cube(sea_mask)
-    ants.save(
-        land_mask, os.path.join(output_filepath, "qrparm.mask"), fill_value=-1,
-    )
-    ants.save(
-        sea_mask, os.path.join(output_filepath, "qrparm.mask_sea"), fill_value=-1,
+    land_mask, sea_mask = ancil_utils.decomposition.decompose(
+        ancil_utils.masks.derive_masks, land_fraction
     )
-    ants.save(land_fraction, os.path.join(output_filepath, "qrparm.landfrac"))
+    ancil_utils.masks.save_masks(output_filepath, land_mask, sea_mask, land_fraction)
     return land_fraction, land_mask, sea_mask
 
 
@@ -38,16 +38,23 @@ Here are the steps taken:
       (--landseamask-out), a threshold of >= 50% ocean is to mean ocean and
       differences are redistributed amongst non-zero land type fraction fields.
 
+The transformation and regrid steps can alternatively be performed by a
+lookup table engine (--engine lookup), which aggregates all target classes in
+a single pass over the source (see :mod:`ancil_utils.landcover`).  Similarly,
+non-glacial ice can be removed by labelling all ice regions in a single pass
+(--ice-engine label), wrapping regions across the longitude seam of global
+grids.
+
 Fields returned:
 - JULES land cover type fraction ancillary fields ('m01s00i216').
 - Land sea mask ('m01s00i030')
 - Land area fractions ('m01s00i505')
 
 """
-import os
-
+import ancil_utils.decomposition as decomp
+import ancil_utils.landcover
+import ancil_utils.masks
 import ants
-import ants.decomposition as decomp
 import ants.fileformats.cover_mapping as cover_mapping
 import ants.utils
 import iris
@@ -90,36 +97,6 @@ def _load_ostia(ostia):
     return ostia_lsm
 
 
-def _prepare_mask_cube(cube):
-    """
-    Sets the attributes needed for mask files, and converts datatype to integer.
-
-    Operates in place.
-
-    Attributes 'valid_min' and 'valid_max' are set to ensure netCDF result is
-    correct for boolean data.
-
-    STASH code is set to m01s00i030.
-
-    Data type is set to integer.
-
-    Parameters
-    ----------
-    cube : :class:`iris.cube.Cube`
-        Mask cube to prepare.
-
-    Returns
-    -------
-    : None
-    Operates in place.
-
-    """
-    cube.attributes["valid_min"] = 0
-    cube.attributes["valid_max"] = 1
-    cube.attributes["STASH"] = iris.fileformats.pp.STASH.from_msi("m01s00i030")
-    cube.data = cube.data.astype("int8")
-
-
 def load_data(
     source_path,
     transform_path,
@@ -141,8 +118,13 @@ def load_data(
     return source, target_cube, trans
 
 
-def gen_lct(src_cube, grid_cube, transform, min_frac=0.5):
-    operation = ants.analysis.SCTTransformer(transform)
+def gen_lct(
+    src_cube, grid_cube, transform, min_frac=0.5, engine="sct", ice_engine="search"
+):
+    if engine == "lookup":
+        operation = ancil_utils.landcover.LookupTransformer(transform)
+    else:
+        operation = ants.analysis.SCTTransformer(transform)
     lct_cube = decomp.decompose(operation, src_cube, grid_cube)
     lct_cube.attributes["STASH"] = iris.fileformats.pp.STASH.from_msi("m01s00i216")
     lct_cube.rename("vegetation_area_fraction")
@@ -164,7 +146,10 @@ def gen_lct(src_cube, grid_cube, transform, min_frac=0.5):
     land_fraction_cube.rename("land_area_fraction")
 
     lct.set_whole_fraction_ice(lct_cube)
-    lct.remove_non_glacial_ice(lct_cube)
+    if ice_engine == "label":
+        ancil_utils.landcover.remove_non_glacial_ice(lct_cube)
+    else:
+        lct.remove_non_glacial_ice(lct_cube)
     # Exclude the ocean level - All land fractions must add up to 1 which means
     # that points must be 100% land or 100% ocean.  The array is masked as a
     # result (representing this ocean).
@@ -175,16 +160,13 @@ def gen_lct(src_cube, grid_cube, transform, min_frac=0.5):
     land_mask_cube.remove_coord("pseudo_level")
     # Ensure land_mask_cube is appropriately masked
     ants.utils.cube.fix_mask(land_mask_cube)
-    land_mask_cube.data = np.logical_not(land_mask_cube.data.mask).astype(
-        "int8", copy=False
-    )
+    land_mask_cube.data = np.logical_not(land_mask_cube.data.mask).view(np.int8)
     nan_values = np.isnan(lct_cube.data[0])
     # Inherit unknown values from the lct in the form of a mask.
     if nan_values.any():
         land_mask_cube.data = np.ma.array(land_mask_cube.data, mask=nan_values)
 
-    _prepare_mask_cube(land_mask_cube)
-    land_mask_cube.rename("land_binary_mask")
+    ancil_utils.masks.prepare_mask_cube(land_mask_cube)
     lsm_cubes = iris.cube.CubeList([land_mask_cube, land_fraction_cube])
     return lct_cube, lsm_cubes
 
@@ -197,6 +179,8 @@ def main(
     landseamask_in=None,
     landseamask_out_root=None,
     land_fraction_threshold=None,
+    engine="sct",
+    ice_engine="search",
 ):
     source, grid, src_trans, = load_data(
         source_path,
@@ -211,29 +195,23 @@ def main(
     if landseamask_in:
         min_frac = 0.0
 
-    lct_cube, lsm_cubes = gen_lct(source, grid, src_trans, min_frac=min_frac)
+    lct_cube, lsm_cubes = gen_lct(
+        source,
+        grid,
+        src_trans,
+        min_frac=min_frac,
+        engine=engine,
+        ice_engine=ice_engine,
+    )
 
     if landseamask_out_root:
-        ants.config.dirpath_writeable(landseamask_out_root)
-        _prepare_mask_cube(lsm_cubes[0])
-        ants.save(
-            lsm_cubes[0],
-            os.path.join(landseamask_out_root, "qrparm.mask"),
-            fill_value=-1,
+        # The land mask is derived from the land cover type fractions, while
+        # the sea mask is derived from the land fraction.
+        land_mask, sea_mask = ancil_utils.masks.derive_masks(
+            lsm_cubes[1], land_mask=lsm_cubes[0]
         )
-
-        land_fraction = lsm_cubes[1]
-        ants.save(land_fraction, os.path.join(landseamask_out_root, "qrparm.landfrac"))
-        ocean_data = np.ones_like(land_fraction.data)
-        ocean_data[land_fraction.data < 1] = 0
-        ocean_mask = land_fraction.copy(ocean_data)
-        ocean_mask.standard_name = "land_binary_mask"
-        _prepare_mask_cube(ocean_mask)
-
-        ants.save(
-            ocean_mask,
-            os.path.join(landseamask_out_root, "qrparm.mask_sea"),
-            fill_value=-1,
+        ancil_utils.masks.save_masks(
+            landseamask_out_root, land_mask, sea_mask, lsm_cubes[1]
         )
 
     if landseamask_in:
@@ -252,6 +230,21 @@ def _get_parser():
         "fraction field."
     )
     parser.add_argument("--landseamask-output-root", type=str, help=msg, required=False)
+    parser.add_argument(
+        "--engine",
+        choices=["sct", "lookup"],
+        default="sct",
+        help="Engine transforming the source classes to the target grid: "
+        "ants.analysis.SCTTransformer (sct) or a single pass crosswalk lookup "
+        "(lookup).",
+    )
+    parser.add_argument(
+        "--ice-engine",
+        choices=["search", "label"],
+        default="search",
+        help="Engine removing non-glacial ice: neighbour search from seed points "
+        "(search) or connected component labelling (label).",
+    )
     return parser
 
 
@@ -272,4 +265,6 @@ if __name__ == "__main__":
         args.target_lsm,
         args.landseamask_output_root,
         args.land_threshold,
+        args.engine,
+        args.ice_engine,
     )
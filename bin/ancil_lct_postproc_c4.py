@@ -15,9 +15,22 @@ Land cover type fraction post-processor for C4 Still dataset injection
     where the input `vegfrac_C3_grass` represents the combined C3 and C4
     grass fraction to be split.
 
+- On regular lat-lon grids the C4 source is regridded with cached area
+  weights (see :mod:`ancil_utils.weights`), and with ``--fill-engine edt``
+  the fill index of its missing points is cached too (see
+  :mod:`ancil_utils.fill`).
+- The percentage scaling, the check for pre-existing C4 grass and the split
+  are a single kernel writing into the land cover type fractions in place
+  (see :func:`split_c3_c4`).
+
 """
+import functools
+
+import ancil_utils.decomposition as decomp
+import ancil_utils.fill
+import ancil_utils.landcover
+import ancil_utils.weights
 import ants
-import ants.decomposition as decomp
 import iris
 import numpy as np
 
@@ -29,7 +42,51 @@ def load(lct, c4_source):
     return lct_cube, c4_cube
 
 
-def derive_c4_contributing(c4_source, lct):
+def split_c3_c4(lct_data, c3_level, c4_level, c4_percentage):
+    """
+    Split the C3 grass fraction into C3 and C4 grass, in place.
+
+    Parameters
+    ----------
+    lct_data : :class:`numpy.ma.MaskedArray`
+        Land cover type fractions, with a leading pseudo level dimension,
+        where the C3 grass fraction represents the combined C3 and C4 grass
+        fraction to be split.
+    c3_level, c4_level : int
+        Indices of the C3 and C4 grass fractions along the leading dimension,
+        see :func:`ancil_utils.landcover.pseudo_level_index`.
+    c4_percentage : :class:`numpy.ma.MaskedArray`
+        C4 grass percentage, on the grid of the land cover type fractions.
+
+    """
+    # Check there isn't any pre-existing C4 grass
+    if np.ma.any(lct_data[c4_level]):
+        msg = (
+            "There appears to be some pre-existing C4 grass fraction "
+            "present, perhaps you don't need to inject the C4 grass from "
+            "the Still or perhaps you have done so already?"
+        )
+        raise ValueError(msg)
+
+    lct_data.mask = np.ma.getmaskarray(lct_data)
+    values = np.ma.getdata(lct_data)
+    c3_values, c4_values = values[c3_level], values[c4_level]
+    c3_mask, c4_mask = lct_data.mask[c3_level], lct_data.mask[c4_level]
+    # The results are written through these views of the fractions.
+    views = [c3_values, c4_values, c3_mask, c4_mask]
+    bases = [values, values, lct_data.mask, lct_data.mask]
+    if not all(map(np.shares_memory, views, bases)):
+        raise ValueError("Expecting the pseudo levels to index views.")
+
+    # Convert percentage to fraction and split, masked where either is.
+    np.divide(np.ma.getdata(c4_percentage), 100.0, out=c4_values)
+    np.minimum(c4_values, c3_values, out=c4_values)
+    np.subtract(c3_values, c4_values, out=c3_values)
+    np.logical_or(c3_mask, np.ma.getmaskarray(c4_percentage), out=c3_mask)
+    c4_mask[...] = c3_mask
+
+
+def derive_c4_contributing(c4_source, lct, fill_engine="spiral"):
     """
     Inject C4 data into the land cover type fraction dataset.
 
@@ -48,6 +105,8 @@ def derive_c4_contributing(c4_source, lct):
     c4_source : :class:`~iris.cube.Cube`
         c4 Still etc al. source data used to distinguish between C3/C4 JULES
         classes.
+    fill_engine : str, optional
+        Engine filling missing C4 data, "spiral" or "edt".
 
     Returns
     -------
@@ -55,37 +114,31 @@ def derive_c4_contributing(c4_source, lct):
         Vegetation fraction with C3/C4 distinction.
 
     """
-    c4_source = ants.analysis.mean(c4_source, lct)
-    # Convert percentage to fraction
-    c4_source.data = c4_source.data / 100.0
+    if all(ancil_utils.weights.is_lat_lon(cube) for cube in [c4_source, lct]):
+        c4_source = ancil_utils.weights.area_weighted_mean(c4_source, lct)
+    else:
+        c4_source = ants.analysis.mean(c4_source, lct)
 
     # Make sure the C4 still has data consistent with the CCI mask (ocean).
     mask = lct[0].copy(np.ma.getmaskarray(lct[0].data))
-    filler = ants.analysis.FillMissingPoints(c4_source, target_mask=mask)
+    filler = ancil_utils.fill.missing_point_filler(
+        c4_source, target_mask=mask, engine=fill_engine
+    )
     filler(c4_source)
 
-    c3_slice = ants.analysis.cover_mapping.fetch_lct_slices(lct, 3)
-    c4_slice = ants.analysis.cover_mapping.fetch_lct_slices(lct, 4)
-
-    # Check there isn't any pre-existing C4 grass
-    if lct.data[c4_slice].any():
-        msg = (
-            "There appears to be some pre-existing C4 grass fraction "
-            "present, perhaps you don't need to inject the C4 grass from "
-            "the Still or perhaps you have done so already?"
-        )
-        raise ValueError(msg)
-
-    # Handle mask difference with lct
-    lct.data[c4_slice] = np.minimum(c4_source.data, lct.data[c3_slice])
-    lct.data[c3_slice] = lct.data[c3_slice] - lct.data[c4_slice]
+    c3_level = ancil_utils.landcover.pseudo_level_index(lct, 3)
+    c4_level = ancil_utils.landcover.pseudo_level_index(lct, 4)
+    data = np.ma.array(lct.data, copy=False)
+    split_c3_c4(data, c3_level, c4_level, c4_source.data)
+    lct.data = data
     lct.rename("vegetation_area_fraction")
     return lct
 
 
-def main(lct, c4_source, output):
+def main(lct, c4_source, output, fill_engine="spiral"):
     lct, c4_source = load(lct, c4_source)
-    lct = decomp.decompose(derive_c4_contributing, c4_source, lct)
+    operation = functools.partial(derive_c4_contributing, fill_engine=fill_engine)
+    lct = decomp.decompose(operation, c4_source, lct)
     ants.save(lct, output)
     return lct
 
@@ -98,9 +151,16 @@ def _get_parser():
         "https://daac.ornl.gov/ISLSCP_II/guides/c4_percent_1deg.html"
     )
     parser.add_argument("--islscpiic4", type=str, help=c4_help, required=True)
+    parser.add_argument(
+        "--fill-engine",
+        choices=["spiral", "edt"],
+        default="spiral",
+        help="Engine filling missing data: the ANTS spiral search (spiral) or "
+        "a Euclidean distance transform (edt).",
+    )
     return parser
 
 
 if __name__ == "__main__":
     args = _get_parser().parse_args()
-    main(args.sources, args.islscpiic4, args.output)
+    main(args.sources, args.islscpiic4, args.output, args.fill_engine)
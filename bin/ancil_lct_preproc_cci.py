@@ -16,20 +16,61 @@ The following steps are taken:
 
 2. Merge the raw IGBP dataset over the Antarctic region (this region is
    invalid in the CCI dataset as the ice does not extend beyond the coast).
-3. Fill missing data using the spiral search.
+3. Fill missing data using the spiral search (or a distance transform, with
+   ``--fill-engine edt``).
 4. Set Aral sea and lake Victoria as ocean (rather than in-land water).
    The motivation to be more closely aligned to the ocean landsea mask.
+5. Set the largest lakes in OSTIA as 'resolved lake' type.
+
+The lakes of steps 4 and 5 are flood filled one at a time by default.  With
+``--lake-engine label``, all lakes of a step are filled in one batch by
+connected component labelling instead (see :mod:`ancil_utils.lakes`).
+
+With ``--band-rows``, the CCI is processed out-of-core in bands of rows
+rather than held in memory whole.  Each band is merged with the IGBP and
+filled with ``--halo-rows`` of the neighbouring bands either side (so that
+points near the band edges can be filled from them), then written to a
+temporary memory mapped file next to the output.  Where missing data in a
+band may lie nearer to valid data beyond its halo (e.g. a band with no valid
+data), the halo of that band is grown, with a warning, so that the band is
+filled as it would be in memory.  The lakes are then filled with the
+labelling engine band by band, joining lakes across band boundaries with a
+global pass over the band labels, and the result is streamed to the output.
+Peak memory is that of a band with its halos, while the temporary file holds
+the whole CCI.
+
+With ``--merge-missing-tiles``, the IGBP is merged only into the tiles of the
+CCI with missing data, fully valid tiles being skipped through a missing data
+tile index computed in one streaming pass and cached on disk (see
+:mod:`ancil_utils.tiles`).
 
 """
+import os
 import warnings
 
+import ancil_utils.fill
+import ancil_utils.lakes
+import ancil_utils.tiles
 import ants
 import ants.utils.cube
+import dask.array as da
+import numpy as np
 import proc_ants.lct_preproc_cci as lct_preproc_cci
 from proc_ants.lakes import fill_lakes
 
+# Number of columns checked at a time for missing data beyond the halo, to
+# bound the memory of the distance arrays.
+_COLUMNS_PER_BLOCK = 1024
 
-def fill_nemo_mask_lakes(cci_cube, nemo_flag):
+
+def _warn_unfilled(lakes, flag):
+    for lake in lakes:
+        warnings.warn(f"Lake {lake} already has type {flag}")
+
+
+def fill_nemo_mask_lakes(
+    cci_cube, nemo_flag, engine="floodfill", data=None, band_rows=None
+):
     """
     Identify lakes as ocean as per nemo mask.
 
@@ -38,6 +79,9 @@ def fill_nemo_mask_lakes(cci_cube, nemo_flag):
     Erie).  Note that Caspian sea and Black sea is already defined as
     "sea_ocean_water", so remains unaltered by this processing.
 
+    The `data` and `band_rows` arguments apply to the "label" engine only, see
+    :func:`ancil_utils.lakes.fill_lakes`.
+
     """
     lakes = [
         ("victoria", (-1.1, 32.9)),
@@ -49,6 +93,19 @@ def fill_nemo_mask_lakes(cci_cube, nemo_flag):
         ("erie", (42.25, -81.16)),
         ("north aral sea", (46.3, 61.0)),
     ]
+    if engine == "label":
+        _warn_unfilled(
+            ancil_utils.lakes.fill_lakes(
+                cci_cube,
+                lakes,
+                "water_bodies",
+                nemo_flag,
+                data=data,
+                band_rows=band_rows,
+            ),
+            nemo_flag,
+        )
+        return cci_cube
     for lake, seed in lakes:
         try:
             cci_cube = fill_lakes(
@@ -59,7 +116,7 @@ def fill_nemo_mask_lakes(cci_cube, nemo_flag):
     return cci_cube
 
 
-def fill_ostia_lakes(cci_cube, ostia_flag):
+def fill_ostia_lakes(cci_cube, ostia_flag, engine="floodfill", data=None):
     """
     Identify water bodies in the CCI that are to be set as 'resolved lake' type
 
@@ -70,6 +127,9 @@ def fill_ostia_lakes(cci_cube, ostia_flag):
     minimum area size defined.  Those chosen have instead a polygon area greater
     than the area min of the smallest lake of above, yathkyed (1449km2).
 
+    The `data` argument applies to the "label" engine only, see
+    :func:`ancil_utils.lakes.fill_lakes`.
+
     """
     # Lakes/reservoirs ordered by decreasing area minimum km2 (high->low) or
     # decreasing area polygon where there is no area minimum available.
@@ -191,6 +251,19 @@ def fill_ostia_lakes(cci_cube, ostia_flag):
         #        ("saimmaa", (61.39, 28.20)),  # area_min:--km2; area_poly:1466.10km2
     ]
 
+    if engine == "label":
+        _warn_unfilled(
+            ancil_utils.lakes.fill_lakes(
+                cci_cube,
+                lakes,
+                ["water_bodies", "sea_ocean_water"],
+                ostia_flag,
+                constrain=True,
+                data=data,
+            ),
+            ostia_flag,
+        )
+        return cci_cube
     for lake in lakes:
         try:
             lake_name, seed, use_geom = lake
@@ -237,7 +310,178 @@ def load_data(cci_filepath, igbp_filepath):
     return cci_cube, igbp_cube
 
 
-def main(source_filepath, igbp_filepath, output_filepath, nemo_flag, ostia_flag):
+def _merge_igbp(cci_cube, igbp_cube, tile_index=None, rows=None):
+    """
+    Merge the IGBP into the CCI, only into tiles with missing data if indexed.
+
+    `rows` are the rows of the indexed CCI grid which `cci_cube` covers.
+
+    """
+    if tile_index is None:
+        return lct_preproc_cci.merge_igbp(cci_cube, igbp_cube)
+    return ancil_utils.tiles.merge_missing_tiles(
+        cci_cube,
+        igbp_cube,
+        lct_preproc_cci.merge_igbp,
+        tile_index,
+        ancil_utils.tiles.TILE_SHAPE,
+        rows=rows,
+    )
+
+
+def _reaches_valid_data(missing, rows, open_top, open_bottom):
+    """
+    Whether every missing point of the rows has valid data near enough.
+
+    That is, a valid point in its column no further from it than the open
+    edges (those inside the CCI grid) of the band.  This distance bounds that
+    to its nearest valid point, which then lies within the band, so that the
+    point is filled as if from the whole CCI.
+
+    """
+    nrows = missing.shape[0]
+    row = np.arange(nrows)[:, None]
+    limit = np.full((nrows, 1), nrows)
+    if open_top:
+        limit = np.minimum(limit, row)
+    if open_bottom:
+        limit = np.minimum(limit, nrows - 1 - row)
+    for start in range(0, missing.shape[1], _COLUMNS_PER_BLOCK):
+        block = missing[:, start : start + _COLUMNS_PER_BLOCK]
+        above = np.maximum.accumulate(np.where(block, -2 * nrows, row), axis=0)
+        flipped = np.where(block, 3 * nrows, row)[::-1]
+        below = np.minimum.accumulate(flipped, axis=0)[::-1]
+        distance = np.minimum(row - above, below - row)
+        if np.any(block[rows] & (distance[rows] > limit[rows])):
+            return False
+    return True
+
+
+def _merge_and_fill_band(
+    cci_cube, igbp_cube, rows, halo_rows, fill_engine, tile_index=None
+):
+    """
+    Return a band of rows of the CCI merged with the IGBP and filled.
+
+    The band is processed along with `halo_rows` rows either side of it.
+    Where a missing point of the band may be nearer to valid data outside
+    these rows than inside them (including where the band has no valid data
+    at all), the halo is doubled until it is not, so that the band is filled
+    as it would be from the whole CCI.
+
+    """
+    nrows = cci_cube.shape[0]
+    while True:
+        start = max(rows.start - halo_rows, 0)
+        stop = min(rows.stop + halo_rows, nrows)
+        band = _merge_igbp(
+            cci_cube[start:stop], igbp_cube, tile_index, rows=slice(start, stop)
+        )
+        core = slice(rows.start - start, rows.stop - start)
+        missing = np.ma.getmaskarray(band.data)
+        if (start == 0 and stop == nrows) or _reaches_valid_data(
+            missing, core, start > 0, stop < nrows
+        ):
+            break
+        halo_rows = max(2 * halo_rows, 1)
+        warnings.warn(
+            f"Missing data in rows {rows.start}-{rows.stop} may be filled from "
+            f"beyond the halo, growing it to {halo_rows} rows."
+        )
+    filler = ancil_utils.fill.missing_point_filler(band, engine=fill_engine)
+    filler(band)
+    return np.ma.getdata(band.data[core])
+
+
+def main_tiled(
+    source_filepath,
+    igbp_filepath,
+    output_filepath,
+    nemo_flag,
+    ostia_flag,
+    band_rows,
+    halo_rows=512,
+    fill_engine="spiral",
+    merge_missing_tiles=False,
+):
+    """
+    Pre-process the ESA CCI out-of-core, in bands of rows.
+
+    See :func:`main` for the parameters not described here.
+
+    Parameters
+    ----------
+    band_rows : int
+        Number of rows of the CCI processed at a time.
+    halo_rows : int, optional
+        Number of rows either side of each band used to fill it, grown where
+        missing data may be nearer to valid data beyond them.
+
+    Returns
+    -------
+    : :class:`~iris.cube.Cube`
+        Pre-processed ESA CCI source, with data lazily read from the output.
+
+    """
+    cci_cube, igbp_cube = load_data(source_filepath, igbp_filepath)
+    lct_preproc_cci.update_cci_metadata(cci_cube)
+    if cci_cube.coord_dims(cci_cube.coord(axis="y"))[0] != 0:
+        raise ValueError("Expecting the CCI 'y' dimension to be the first.")
+    print("load and metadata update completed")
+    tile_index = None
+    if merge_missing_tiles:
+        tile_index = ancil_utils.tiles.missing_tile_index(
+            cci_cube, source_filepath=source_filepath
+        )
+        print("missing data tile index completed")
+
+    tiles_filepath = output_filepath + ".tiles.npy"
+    tiles = None
+    nrows = cci_cube.shape[0]
+    try:
+        for start in range(0, nrows, band_rows):
+            rows = slice(start, min(start + band_rows, nrows))
+            values = _merge_and_fill_band(
+                cci_cube, igbp_cube, rows, halo_rows, fill_engine, tile_index
+            )
+            if tiles is None:
+                tiles = np.lib.format.open_memmap(
+                    tiles_filepath, mode="w+", dtype=values.dtype, shape=cci_cube.shape
+                )
+            tiles[rows] = values
+            print(f"merge with igbp and spiral completed to row {rows.stop}/{nrows}")
+
+        fill_nemo_mask_lakes(
+            cci_cube, nemo_flag, "label", data=tiles, band_rows=band_rows
+        )
+        print("Marking lakes as ocean completed")
+        fill_ostia_lakes(cci_cube, ostia_flag, "label", data=tiles)
+        print("Re-classification of lakes as 'resolved lakes' completed")
+        tiles.flush()
+
+        cci_cube = cci_cube.copy(
+            data=da.from_array(tiles, chunks=(band_rows, tiles.shape[1]))
+        )
+        ants.save(cci_cube, output_filepath)
+    finally:
+        del tiles
+        if os.path.exists(tiles_filepath):
+            os.remove(tiles_filepath)
+    return ants.load_cube(output_filepath)
+
+
+def main(
+    source_filepath,
+    igbp_filepath,
+    output_filepath,
+    nemo_flag,
+    ostia_flag,
+    lake_engine="floodfill",
+    band_rows=None,
+    halo_rows=512,
+    fill_engine="spiral",
+    merge_missing_tiles=False,
+):
     """
     Pre-processing ESA CCI top level call function.
 
@@ -255,6 +499,22 @@ def main(source_filepath, igbp_filepath, output_filepath, nemo_flag, ostia_flag)
         specifically Antarctica).
     output_filepath : str
         Output file path for the resulting ancillary.
+    nemo_flag : str
+        Flag to assign for NEMO lakes.
+    ostia_flag : str
+        Flag to assign for OSTIA lakes.
+    lake_engine : str, optional
+        Engine filling the lakes, "floodfill" or "label".
+    band_rows : int, optional
+        If provided, process the CCI out-of-core in bands of this many rows
+        (see :func:`main_tiled`), filling the lakes with the "label" engine.
+    halo_rows : int, optional
+        Number of rows either side of each band used to fill it, grown where
+        missing data may be nearer to valid data beyond them.
+    fill_engine : str, optional
+        Engine filling missing data, "spiral" or "edt".
+    merge_missing_tiles : bool, optional
+        Merge the IGBP only into tiles of the CCI with missing data.
 
     Returns
     -------
@@ -262,23 +522,40 @@ def main(source_filepath, igbp_filepath, output_filepath, nemo_flag, ostia_flag)
         Pre-processed ESA CCI source.
 
     """
+    if band_rows:
+        return main_tiled(
+            source_filepath,
+            igbp_filepath,
+            output_filepath,
+            nemo_flag,
+            ostia_flag,
+            band_rows,
+            halo_rows,
+            fill_engine,
+            merge_missing_tiles,
+        )
     cci_cube, igbp_cube = load_data(source_filepath, igbp_filepath)
     print("load completed")
     lct_preproc_cci.update_cci_metadata(cci_cube)
     print("metadata update completed")
-    cci_cube = lct_preproc_cci.merge_igbp(cci_cube, igbp_cube)
+    tile_index = None
+    if merge_missing_tiles:
+        tile_index = ancil_utils.tiles.missing_tile_index(
+            cci_cube, source_filepath=source_filepath
+        )
+    cci_cube = _merge_igbp(cci_cube, igbp_cube, tile_index)
     print("merge with igbp completed")
 
     cci_cube.data
     print("data touch completed")
-    filler = ants.analysis.FillMissingPoints(cci_cube)
+    filler = ancil_utils.fill.missing_point_filler(cci_cube, engine=fill_engine)
     filler(cci_cube)
     print("spiral completed")
 
-    cci_cube = fill_nemo_mask_lakes(cci_cube, nemo_flag)
+    cci_cube = fill_nemo_mask_lakes(cci_cube, nemo_flag, lake_engine)
     print("Marking lakes as ocean completed")
 
-    cci_cube = fill_ostia_lakes(cci_cube, ostia_flag)
+    cci_cube = fill_ostia_lakes(cci_cube, ostia_flag, lake_engine)
     print("Re-classification of lakes as 'resolved lakes' completed")
 
     ants.save(cci_cube, output_filepath)
@@ -305,9 +582,54 @@ def _get_parser():
         help='Flag to assign for OSTIA lakes (defaults to "resolved_lake").',
         default="resolved_lake",
     )
+    parser.add_argument(
+        "--lake-engine",
+        choices=["floodfill", "label"],
+        default="floodfill",
+        help="Engine filling the NEMO and OSTIA lakes: a flood fill per lake "
+        "(floodfill) or one connected component labelling per batch of lakes "
+        "(label).",
+    )
+    parser.add_argument(
+        "--band-rows",
+        type=int,
+        help="Process the CCI out-of-core in bands of this many rows, rather "
+        "than in memory.  Implies the label lake engine.",
+        required=False,
+    )
+    parser.add_argument(
+        "--halo-rows",
+        type=int,
+        help="Number of rows either side of each band used when filling "
+        "missing data in the band (defaults to 512).",
+        default=512,
+    )
+    parser.add_argument(
+        "--fill-engine",
+        choices=["spiral", "edt"],
+        default="spiral",
+        help="Engine filling missing data: the ANTS spiral search (spiral) or "
+        "a Euclidean distance transform (edt).",
+    )
+    parser.add_argument(
+        "--merge-missing-tiles",
+        action="store_true",
+        help="Merge the IGBP only into tiles of the CCI with missing data.",
+    )
     return parser
 
 
 if __name__ == "__main__":
     args = _get_parser().parse_args()
-    main(args.sources, args.igbp_source, args.output, args.nemo_flag, args.ostia_flag)
+    main(
+        args.sources,
+        args.igbp_source,
+        args.output,
+        args.nemo_flag,
+        args.ostia_flag,
+        args.lake_engine,
+        args.band_rows,
+        args.halo_rows,
+        args.fill_engine,
+        args.merge_missing_tiles,
+    )
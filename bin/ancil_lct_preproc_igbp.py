@@ -20,7 +20,8 @@ The following steps are taken:
     - Populate missing coordinate system (WGS84).
     - Provide a suitable long_name (IGBP land classification).
 
- 3. Fill missing data using the spiral search.
+ 3. Fill missing data using the spiral search (or a distance transform, with
+    ``--fill-engine edt``).
 
 .. warning::
 
@@ -30,6 +31,7 @@ The following steps are taken:
     accuracy, number of classification types etc.).
 
 """
+import ancil_utils.fill
 import ants
 import ants.config
 import ants.utils
@@ -43,11 +45,11 @@ def load_data(igbp_filepath, bats_filepath):
     return igbp_cube, bats_cube
 
 
-def main(igbp_filepath, bats_filepath, output_filepath):
+def main(igbp_filepath, bats_filepath, output_filepath, fill_engine="spiral"):
     igbp_cube, bats_cube = load_data(igbp_filepath, bats_filepath)
     lct_preproc_igbp.pre_process(igbp_cube, bats_cube)
 
-    filler = ants.analysis.FillMissingPoints(igbp_cube)
+    filler = ancil_utils.fill.missing_point_filler(igbp_cube, engine=fill_engine)
     filler(igbp_cube)
 
     ants.save(igbp_cube, output_filepath, fill_value=100)
@@ -65,9 +67,16 @@ def _get_parser():
         ),
         required=True,
     )
+    parser.add_argument(
+        "--fill-engine",
+        choices=["spiral", "edt"],
+        default="spiral",
+        help="Engine filling missing data: the ANTS spiral search (spiral) or "
+        "a Euclidean distance transform (edt).",
+    )
     return parser
 
 
 if __name__ == "__main__":
     args = _get_parser().parse_args()
-    main(args.sources, args.bats_source, args.output)
+    main(args.sources, args.bats_source, args.output, args.fill_engine)
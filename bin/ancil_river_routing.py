@@ -12,9 +12,12 @@ Derive the river routing sequence and direction ancillaries.
 The following steps are taken:
 
 * Landcover fraction field (LCF) is regridded to the river routing field
-  using an area weighted regrid.
+  using an area weighted regrid.  For regular lat-lon grids the area weights
+  are cached between runs (see :mod:`ancil_utils.weights`).
 * Regridded LCF is used to identify points which are ocean and those which
-  are also surrounded by ocean.
+  are also surrounded by ocean.  The latter is found with a single 3x3
+  minimum filter over the ocean points, wrapping in longitude for global
+  grids.  Neighbours beyond the edges of a non-global grid are ignored.
 * At points that are entirely ocean and whose neighbours are entirely
   ocean, the river direction and sequence is set to missing data.
 * At points that are entirely ocean, but whose neighbours are not entirely
@@ -25,12 +28,14 @@ The following steps are taken:
   the UM grid definition.
 
 """
+import ancil_utils.weights
 import ants
 import ants.config
 import ants.decomposition as decomp
 import ants.utils
 import iris
 import numpy as np
+from scipy import ndimage
 
 POUR_POINT_INDICATOR = 9
 
@@ -44,24 +49,45 @@ def load_data(source, land_cover_fraction):
     return sequence_cube, direction_cube, lcf_cube
 
 
+def _surrounded(condition, wrap_x):
+    # Whether each point and all of its Moore neighbours satisfy the condition.
+    padded = np.pad(condition, ((1, 1), (0, 0)), mode="edge")
+    padded = np.pad(padded, ((0, 0), (1, 1)), mode="wrap" if wrap_x else "edge")
+    return ndimage.minimum_filter(padded, size=3)[1:-1, 1:-1]
+
+
 def river_routing(sequence_cube, direction_cube, land_cover_fraction_cube):
     # Regrid the land cover fraction to the river trip routing source grid.
-    lcf_cube = decomp.decompose(
-        ants.analysis.mean, land_cover_fraction_cube, direction_cube
-    )
+    if ancil_utils.weights.is_lat_lon(
+        land_cover_fraction_cube
+    ) and ancil_utils.weights.is_lat_lon(direction_cube):
+        lcf_cube = ancil_utils.weights.area_weighted_mean(
+            land_cover_fraction_cube, direction_cube
+        )
+    else:
+        lcf_cube = decomp.decompose(
+            ants.analysis.mean, land_cover_fraction_cube, direction_cube
+        )
 
-    neighbours = ants.analysis.MooreNeighbourhood(lcf_cube)
     ocean_indicator = 0
-    sea_only = lcf_cube.data == ocean_indicator
-    sea_only_neighbours = neighbours.all_equal_value(ocean_indicator)
-
-    # Set pour point where its next to the coast.
-    direction_cube.data[sea_only] = POUR_POINT_INDICATOR
-    # Mask direction where points AND their neighbours are ocean.
-    mask = sea_only_neighbours * sea_only
-    for cube in [direction_cube, sequence_cube]:
-        cube.data = np.ma.array(cube.data, copy=False)
-        cube.data[mask] = np.ma.masked
+    sea_only = np.ma.filled(lcf_cube.data == ocean_indicator, False)
+    wrap_x = bool(lcf_cube.coord(axis="x", dim_coords=True).circular)
+    # Points which AND whose neighbours are ocean.
+    mask = _surrounded(sea_only, wrap_x)
+
+    # Set pour point where its next to the coast and mask direction and
+    # sequence where points AND their neighbours are ocean, in one write each.
+    # Pour points are set (so unmasked) even where the source is masked.
+    direction = direction_cube.data
+    values = np.where(sea_only, POUR_POINT_INDICATOR, np.ma.getdata(direction))
+    direction_cube.data = np.ma.array(
+        values.astype(direction.dtype, copy=False),
+        mask=(np.ma.getmaskarray(direction) & ~sea_only) | mask,
+    )
+    sequence = sequence_cube.data
+    sequence_cube.data = np.ma.array(
+        np.ma.getdata(sequence), mask=np.ma.getmaskarray(sequence) | mask
+    )
 
     return sequence_cube, direction_cube
 
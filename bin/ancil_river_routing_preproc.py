@@ -14,9 +14,18 @@ The following changes are applied:
 * Modify the source time points so that they do not exceed 30 days in a
   month which would otherwise be invalid for a 360-day model calendar.
 
+With ``--header-only``, only the PP headers are corrected and the output is a
+PP file, with the field data copied byte for byte rather than decoded and
+encoded again (see :mod:`ancil_utils.ppfile`).  The long names, which PP
+cannot hold, are not set.
+
+The river fields are found from the lookup index of the source (see
+:func:`ancil_utils.ppfile.index`), so that only they are read.
+
 """
 import warnings
 
+import ancil_utils.ppfile
 import ants
 import ants.config
 import ants.fileformats.pp as pp
@@ -34,18 +43,29 @@ RIVER_DIRECTION = {
 
 
 def load_data(filename):
-    fields = list(pp.load_ppfields(filename))
+    # Only the river fields are read, found from the index of the file.
+    stash_codes = [RIVER_DIRECTION["stash"], RIVER_SEQUENCE["stash"]]
+    with ancil_utils.ppfile.subset(filename, stash_codes) as subset:
+        fields = list(pp.load_ppfields(subset))
+        for field in fields:
+            # Realise the data before the subset file is removed.
+            field.data
 
     direction = pp.field_filter_strict(fields, RIVER_DIRECTION["stash"])
     sequence = pp.field_filter_strict(fields, RIVER_SEQUENCE["stash"])
     return direction, sequence
 
 
-def correct_metadata(direction, sequence):
-    """Correct pp field metadata and return Iris cubes."""
+def _correction_required(direction):
     if not (direction.lbdatd == 31 and direction.lbtim == 2):
         warnings.warn("Pre-processing metadata correction stage not required")
-    else:
+        return False
+    return True
+
+
+def correct_metadata(direction, sequence):
+    """Correct pp field metadata and return Iris cubes."""
+    if _correction_required(direction):
         sequence.lbdatd = 30
         direction.lbdatd = 30
 
@@ -57,7 +77,40 @@ def correct_metadata(direction, sequence):
     return iris.cube.CubeList([sequence_cube, direction_cube])
 
 
-def main(source_filepath, output_filepath):
+def correct_headers(source_filepath, output_filepath):
+    """
+    Correct the PP headers only, copying the field data byte for byte.
+
+    Returns
+    -------
+    : list of :class:`ancil_utils.ppfile.PPHeader`
+        The corrected headers of the fields written.
+
+    """
+    stash_codes = [RIVER_SEQUENCE["stash"], RIVER_DIRECTION["stash"]]
+
+    def is_river(header):
+        return header.stash in stash_codes
+
+    (direction,) = [
+        header
+        for header in ancil_utils.ppfile.headers(source_filepath)
+        if header.stash == RIVER_DIRECTION["stash"]
+    ]
+    required = _correction_required(direction)
+
+    def correct(header):
+        if required:
+            header.lbdatd = 30
+
+    return ancil_utils.ppfile.rewrite(
+        source_filepath, output_filepath, patch=correct, select=is_river
+    )
+
+
+def main(source_filepath, output_filepath, header_only=False):
+    if header_only:
+        return correct_headers(source_filepath, output_filepath)
     direction_field, sequence_field = load_data(source_filepath)
     cubes = correct_metadata(direction_field, sequence_field)
     ants.save(cubes, output_filepath)
@@ -66,9 +119,15 @@ def main(source_filepath, output_filepath):
 
 def _get_parser():
     parser = ants.AntsArgParser()
+    parser.add_argument(
+        "--header-only",
+        action="store_true",
+        help="Only correct the PP headers, writing a PP file without decoding "
+        "the data.",
+    )
     return parser
 
 
 if __name__ == "__main__":
     args = _get_parser().parse_args()
-    main(args.sources, args.output)
+    main(args.sources, args.output, args.header_only)
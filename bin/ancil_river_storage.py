@@ -13,13 +13,15 @@ direction data.
 The following steps are required in the derivation:
 
 * The river storage source is first regridded via area weighted mean
-  to the same grid as the direction ancillary.
+  to the same grid as the direction ancillary.  For regular lat-lon grids the
+  area weights are computed once (or read from the cache) and applied to all
+  months at once (see :mod:`ancil_utils.weights`).
 * Mask status of elements of the direction cube are applied to the storage
   cube.
 
 """
+import ancil_utils.weights
 import ants
-import ants.utils
 import iris
 import numpy as np
 
@@ -33,11 +35,20 @@ def load_data(source_path):
 
 
 def river_storage(direction_cube, storage_source):
-    storage_cube = ants.analysis.mean(storage_source, direction_cube)
-    storage_cube.data = np.ma.array(storage_cube.data, copy=False)
-    # Ensure direction_cube has a mask
-    ants.utils.cube.fix_mask(direction_cube)
-    storage_cube.data[:, direction_cube.data.mask] = np.ma.masked
+    if ancil_utils.weights.is_lat_lon(
+        storage_source
+    ) and ancil_utils.weights.is_lat_lon(direction_cube):
+        storage_cube = ancil_utils.weights.area_weighted_mean(
+            storage_source, direction_cube
+        )
+    else:
+        storage_cube = ants.analysis.mean(storage_source, direction_cube)
+    # Mask every month where the direction is masked.
+    data = storage_cube.data
+    storage_cube.data = np.ma.array(
+        np.ma.getdata(data),
+        mask=np.ma.getmaskarray(data) | np.ma.getmaskarray(direction_cube.data),
+    )
     return storage_cube
 
 
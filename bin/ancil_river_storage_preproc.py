@@ -15,9 +15,18 @@ The following changes are applied:
 * Modify the source to represent a monthly mean, ensuring that a periodic
   timeseries can be recognised in the final ancillary.
 
+With ``--header-only``, only the PP headers are corrected (including the
+STASH code) and the output is a PP file, with the field data copied byte for
+byte rather than decoded and encoded again (see :mod:`ancil_utils.ppfile`).
+The long name and representative period, which PP cannot hold, are not set.
+
+The storage fields are found from the lookup index of the source (see
+:func:`ancil_utils.ppfile.index`), so that only they are read.
+
 """
 import warnings
 
+import ancil_utils.ppfile
 import ants
 import ants.config
 import ants.fileformats.pp as pp
@@ -31,43 +40,54 @@ STORAGE = {
 }
 
 
+def as_periodic_time_series(field):
+    """
+    Updates the field to make it look like a monthly mean.
+
+    This then carries through to the final ancillary, setting it as
+    periodic if source is a full 12 months (otherwise, identifies as time
+    series).
+
+    """
+    field.lbtim.ia = 0
+    field.lbtim.ib = 2
+    field.lbtim.ic = 2
+    field.lbdatd = 1
+    # The data is representative of the 1950 - 2000 period.
+    field.lbyr = 1950
+    field.lbyrd = 1950
+    if field.lbmond < 12:
+        field.lbmond += 1
+    else:
+        field.lbmond = 1
+        field.lbyrd += 1
+    field.lbmin = 0
+    field.lbmind = 0
+    try:
+        field.lbsec = 0
+        field.lbsecd = 0
+    except AttributeError:
+        pass
+
+
+def _correction_required(field):
+    if not (field.lbdatd == 0 and field.lbtim.ib == 0):
+        warnings.warn("Pre-processing metadata correction stage not required")
+        return False
+    return True
+
+
 def correct_metadata(filename):
     """Load the source data, correct the metadata and return Iris cubes."""
-    fields = list(pp.load_ppfields(filename))
+    # Only the storage fields are read, found from the index of the file.
+    with ancil_utils.ppfile.subset(filename, [STORAGE["stash_in"]]) as subset:
+        fields = list(pp.load_ppfields(subset))
+        for field in fields:
+            # Realise the data before the subset file is removed.
+            field.data
     fields = pp.field_filter(fields, STORAGE["stash_in"])
 
-    def as_periodic_time_series(field):
-        """
-        Updates the field to make it look like a monthly mean.
-
-        This then carries through to the final ancillary, setting it as
-        periodic if source is a full 12 months (otherwise, identifies as time
-        series).
-
-        """
-        field.lbtim.ia = 0
-        field.lbtim.ib = 2
-        field.lbtim.ic = 2
-        field.lbdatd = 1
-        # The data is representative of the 1950 - 2000 period.
-        field.lbyr = 1950
-        field.lbyrd = 1950
-        if field.lbmond < 12:
-            field.lbmond += 1
-        else:
-            field.lbmond = 1
-            field.lbyrd += 1
-        field.lbmin = 0
-        field.lbmind = 0
-        try:
-            field.lbsec = 0
-            field.lbsecd = 0
-        except AttributeError:
-            pass
-
-    if not (fields[0].lbdatd == 0 and fields[0].lbtim.ib == 0):
-        warnings.warn("Pre-processing metadata correction stage not required")
-    else:
+    if _correction_required(fields[0]):
         for field in fields:
             as_periodic_time_series(field)
 
@@ -79,7 +99,44 @@ def correct_metadata(filename):
     return storage_cube
 
 
-def main(source_filepath, output_filepath):
+def correct_headers(source_filepath, output_filepath):
+    """
+    Correct the PP headers only, copying the field data byte for byte.
+
+    Returns
+    -------
+    : list of :class:`ancil_utils.ppfile.PPHeader`
+        The corrected headers of the fields written.
+
+    """
+
+    def is_storage(header):
+        return header.stash == STORAGE["stash_in"]
+
+    headers = [
+        header
+        for header in ancil_utils.ppfile.headers(source_filepath)
+        if is_storage(header)
+    ]
+    required = _correction_required(headers[0])
+    stash = STORAGE["stash_out"]
+
+    def correct(header):
+        if required:
+            as_periodic_time_series(header)
+        lbuser = list(header.lbuser)
+        lbuser[3] = stash.section * 1000 + stash.item
+        lbuser[6] = stash.model
+        header.lbuser = lbuser
+
+    return ancil_utils.ppfile.rewrite(
+        source_filepath, output_filepath, patch=correct, select=is_storage
+    )
+
+
+def main(source_filepath, output_filepath, header_only=False):
+    if header_only:
+        return correct_headers(source_filepath, output_filepath)
     cube = correct_metadata(source_filepath)
     ants.save(cube, output_filepath)
     return cube
@@ -87,9 +144,15 @@ def main(source_filepath, output_filepath):
 
 def _get_parser():
     parser = ants.AntsArgParser()
+    parser.add_argument(
+        "--header-only",
+        action="store_true",
+        help="Only correct the PP headers, writing a PP file without decoding "
+        "the data.",
+    )
     return parser
 
 
 if __name__ == "__main__":
     args = _get_parser().parse_args()
-    main(args.sources, args.output)
+    main(args.sources, args.output, args.header_only)
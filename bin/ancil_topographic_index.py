@@ -15,13 +15,16 @@ The following steps are taken:
 * Area weighted regrid the source to the grid specified by the
   land-sea-mask, see :func:`ants.analysis.mean`.
 * Derive the standard deviation field by using the mean field just derived,
-  see :func:`ants.analysis.stdev`.
+  see :func:`ants.analysis.stdev`.  For regular lat-lon grids, both are
+  derived together in a single pass over the source with cached area weights
+  (see :meth:`ancil_utils.weights.AreaWeights.moments`).
 * Update the mean and standard deviation field data so that they are consistent
   with the provided land cover type fraction fields (landsea mask and ice
   fraction fields).
 
   - Fill all non-ice locations with non-zero topographic index values using
-    :func:`ants.analysis.FillMissingPoints`.
+    :func:`ants.analysis.FillMissingPoints` (or a distance transform, with
+    ``--fill-engine edt``).
   - Set topographic index values to 0 for locations where there is ice.
 
 .. note::
@@ -30,16 +33,28 @@ The following steps are taken:
   was based on a Moore neighbourhood fill.
 
 """
+import ancil_utils.decomposition as decomp
+import ancil_utils.fill
+import ancil_utils.weights
 import ants
 import ants.config
-import ants.decomposition as decomp
 import iris
 import numpy as np
 
 
 def mean_stdev(source, target):
-    mean_cube = ants.analysis.mean(source, target)
-    stdev_cube = ants.analysis.stdev(source, mean_cube)
+    if not (
+        ancil_utils.weights.is_lat_lon(source)
+        and ancil_utils.weights.is_lat_lon(target)
+    ):
+        mean_cube = ants.analysis.mean(source, target)
+        stdev_cube = ants.analysis.stdev(source, mean_cube)
+        return mean_cube, stdev_cube
+
+    weights = ancil_utils.weights.AreaWeights(source, target)
+    mean_cube, stdev_cube = weights.moments(source)
+    mean_cube.rename("mean {}".format(source.name()))
+    stdev_cube.rename("standard deviation {}".format(source.name()))
     return mean_cube, stdev_cube
 
 
@@ -51,7 +66,7 @@ def load_data(source, lct):
     return src_cube, lct_cube
 
 
-def topographic_index(src_cube, lct_cube):
+def topographic_index(src_cube, lct_cube, fill_engine="spiral"):
     ice_id = 9
     ice_level = ants.analysis.cover_mapping.fetch_lct_slices(lct_cube, ice_id)
     ice_level_cube = lct_cube[ice_level]
@@ -69,7 +84,9 @@ def topographic_index(src_cube, lct_cube):
 
     ice = (ice_level_cube.data.data > 0) & (~np.ma.getmaskarray(ice_level_cube.data))
     target_mask_noice = mean_cube.copy(ice + target_mask.data)
-    filler = ants.analysis.FillMissingPoints(mean_cube, target_mask=target_mask_noice)
+    filler = ancil_utils.fill.missing_point_filler(
+        mean_cube, target_mask=target_mask_noice, engine=fill_engine
+    )
     filler(mean_cube)
     stdev_cube = result.extract_strict("standard deviation topographic index")
     stdev_cube.attributes["STASH"] = iris.fileformats.pp.STASH.from_msi("m01s00i275")
@@ -83,7 +100,7 @@ def topographic_index(src_cube, lct_cube):
     return cubes
 
 
-def main(source_path, lct_path, output_filepath):
+def main(source_path, lct_path, output_filepath, fill_engine="spiral"):
     """
     Topographic index application top level call function.
 
@@ -99,6 +116,8 @@ def main(source_path, lct_path, output_filepath):
         File path to the land cover type fraction ancillary.
     output_filepath : str
         Output file path for the topographic index ancillary.
+    fill_engine : str, optional
+        Engine filling missing data, "spiral" or "edt".
 
     Returns
     -------
@@ -107,7 +126,7 @@ def main(source_path, lct_path, output_filepath):
 
     """
     source, lct = load_data(source_path, lct_path)
-    cubes = topographic_index(source, lct)
+    cubes = topographic_index(source, lct, fill_engine)
     ants.save(cubes, output_filepath)
     return cubes
 
@@ -120,9 +139,16 @@ def _get_parser():
         "the landsea mask."
     )
     parser.add_argument("--lct-ancillary", type=str, help=lct_help, required=True)
+    parser.add_argument(
+        "--fill-engine",
+        choices=["spiral", "edt"],
+        default="spiral",
+        help="Engine filling missing data: the ANTS spiral search (spiral) or "
+        "a Euclidean distance transform (edt).",
+    )
     return parser
 
 
 if __name__ == "__main__":
     args = _get_parser().parse_args()
-    main(args.sources, args.lct_ancillary, args.output)
+    main(args.sources, args.lct_ancillary, args.output, args.fill_engine)
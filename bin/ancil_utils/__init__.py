@@ -0,0 +1,13 @@
+# (C) Crown Copyright, Met Office. All rights reserved.
+#
+# This file is part of ANTS and is released under the BSD 3-Clause license.
+# See LICENSE.txt in the root of the repository for full licensing details.
+"""
+Shared helpers for the ancillary applications
+*********************************************
+
+Performance helpers used by more than one application in this directory.
+The applications import these directly, as the directory of the running
+application is on the python path.
+
+"""
@@ -0,0 +1,249 @@
+# (C) Crown Copyright, Met Office. All rights reserved.
+#
+# This file is part of ANTS and is released under the BSD 3-Clause license.
+# See LICENSE.txt in the root of the repository for full licensing details.
+"""
+Streaming ancillary writer
+**************************
+
+Writes cubes to a UM ancillary file one 2D field at a time, so that memory
+use is that of a single field whatever the size of the source.
+
+The lookup of each field is derived with the PP save rules of iris
+(:func:`iris.fileformats.pp.save_pairs_from_cube`), the UM fieldsfile lookup
+sharing its layout with the PP header, and each field is given a data
+provider holding its lazy 2D slice.  :mod:`mule` then realises, fills and
+writes each field in turn, as in ``stress_to_SMC.py``.
+
+The file headers are derived from the grid of the first cube and the times of
+the fields:
+
+- FLH(4) horizontal grid type: global, limited area, or rotated limited area.
+- FLH(8) calendar, FLH(9) grid staggering (the 'grid_staggering' attribute).
+- FLH(10) time series indicator, FLH(21-41) first and last validity times and
+  the interval between them, for more than one time.  The interval is in
+  years and months where a whole number of months (e.g. monthly), otherwise
+  in days, hours, minutes and seconds (e.g. daily).  Unevenly spaced times
+  are an error.  Climatological time coordinates are written as periodic.
+- The dimensions, spacing, origin and pole of the grid.
+
+"""
+import cftime
+import iris
+import mule
+import numpy as np
+
+# FLH(5) dataset type.
+_ANCILLARY = 4
+# FLH(4) horizontal grid types.
+_GLOBAL = 0
+_LIMITED_AREA = 3
+_ROTATED = 100
+# FLH(8) calendars.
+_CALENDARS = {"gregorian": 1, "standard": 1, "proleptic_gregorian": 1, "360_day": 2}
+# FLH(10) time series indicators.
+_SINGLE_TIME = 0
+_TIME_SERIES = 1
+_PERIODIC = 2
+# LBUSER1 data types.
+_INTEGER = 2
+_INTEGER_MDI = -32768
+# Fixed length header time elements, of t1 (first), t2 (last) and t3
+# (interval).
+_TIME_NAMES = ["year", "month", "day", "hour", "minute", "second", "year_day"]
+
+
+class _LazyFieldProvider(object):
+    """mule data provider for one 2D field, realised as the field is written."""
+
+    def __init__(self, data, mdi):
+        self.data = data
+        self.mdi = mdi
+
+    def _data_array(self):
+        return np.ma.filled(np.asanyarray(self.data[...]), self.mdi)
+
+
+def _lookup_values(pp_field):
+    # Flatten the PP header to (name, value) pairs named as mule names them.
+    for name, offsets in pp_field.HEADER_DEFN:
+        value = getattr(pp_field, name)
+        if len(offsets) == 1:
+            yield name, value
+        else:
+            for index, item in enumerate(value, 1):
+                yield "{}{}".format(name, index), item
+
+
+def _field(pp_field, data):
+    field = mule.Field3.empty()
+    for name, value in _lookup_values(pp_field):
+        if hasattr(field, name):
+            setattr(field, name, value)
+    field.lbrel = 3
+    field.lbpack = 0
+    field.lbext = 0
+    if field.lbuser1 == _INTEGER:
+        mdi = _INTEGER_MDI
+    else:
+        mdi = field.bmdi
+    field.set_data_provider(_LazyFieldProvider(data, mdi))
+    return field
+
+
+def fields(cube):
+    """
+    Yield a lazy :class:`mule.Field3` for each 2D field of the cube.
+
+    Parameters
+    ----------
+    cube : :class:`~iris.cube.Cube`
+        Cube with the horizontal grid as its last two dimensions.
+
+    """
+    data = cube.core_data()
+    indices = np.ndindex(cube.shape[:-2])
+    for index, (_, pp_field) in zip(
+        indices, iris.fileformats.pp.save_pairs_from_cube(cube)
+    ):
+        # The PP field may hold realised data, which is not kept.
+        yield _field(pp_field, data[index])
+
+
+def _validity(field):
+    return [
+        field.lbyr,
+        field.lbmon,
+        field.lbdat,
+        field.lbhr,
+        field.lbmin,
+        field.lbsec,
+        0,
+    ]
+
+
+def _interval(times, calendar):
+    # Interval between evenly spaced validity times, in years and months
+    # where a whole number of months (the day within the month may vary, e.g.
+    # for mid-month times), otherwise in days, hours, minutes and seconds.
+    pairs = list(zip(times, times[1:]))
+    months = {
+        (second[0] - first[0]) * 12 + second[1] - first[1] for first, second in pairs
+    }
+    if len(months) == 1 and min(months) > 0:
+        months = months.pop()
+        return [months // 12, months % 12, 0, 0, 0, 0, 0]
+    deltas = sorted(
+        {
+            cftime.datetime(*second[:6], calendar=calendar)
+            - cftime.datetime(*first[:6], calendar=calendar)
+            for first, second in pairs
+        }
+    )
+    if len(deltas) != 1:
+        raise ValueError(
+            "The fields of an ancillary time series must be evenly spaced in "
+            "time, got intervals of {} and {}.".format(deltas[0], deltas[-1])
+        )
+    hours, seconds = divmod(deltas[0].seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return [0, 0, deltas[0].days, hours, minutes, seconds, 0]
+
+
+def _grid_type(cube):
+    x_coord = cube.coord(axis="x", dim_coords=True)
+    y_coord = cube.coord(axis="y", dim_coords=True)
+    if isinstance(x_coord.coord_system, iris.coord_systems.RotatedGeogCS):
+        return _LIMITED_AREA + _ROTATED
+    y_points = y_coord.units.convert(y_coord.points, "degrees")
+    if x_coord.circular and np.isclose(np.ptp(y_points), 180.0):
+        return _GLOBAL
+    return _LIMITED_AREA
+
+
+def _template(cube, grid_staggering):
+    x_coord = cube.coord(axis="x", dim_coords=True)
+    y_coord = cube.coord(axis="y", dim_coords=True)
+    x_points = x_coord.units.convert(x_coord.points, "degrees")
+    y_points = y_coord.units.convert(y_coord.points, "degrees")
+    calendar = 1
+    if cube.coords("time"):
+        calendar = _CALENDARS.get(cube.coord("time").units.calendar, 1)
+    north_pole_lat, north_pole_lon = 90.0, 0.0
+    if isinstance(x_coord.coord_system, iris.coord_systems.RotatedGeogCS):
+        north_pole_lat = x_coord.coord_system.grid_north_pole_latitude
+        north_pole_lon = x_coord.coord_system.grid_north_pole_longitude
+    return {
+        "fixed_length_header": {
+            "data_set_format_version": 20,
+            "sub_model": 1,
+            "vert_coord_type": 1,
+            "horiz_grid_type": _grid_type(cube),
+            "dataset_type": _ANCILLARY,
+            "calendar": calendar,
+            "grid_staggering": grid_staggering,
+        },
+        "integer_constants": {
+            "num_cols": x_points.size,
+            "num_rows": y_points.size,
+        },
+        "real_constants": {
+            "col_spacing": float(np.diff(x_points).mean()) if x_points.size > 1 else 0,
+            "row_spacing": float(np.diff(y_points).mean()) if y_points.size > 1 else 0,
+            "start_lat": float(y_points[0]),
+            "start_lon": float(x_points[0]),
+            "north_pole_lat": north_pole_lat,
+            "north_pole_lon": north_pole_lon,
+        },
+    }
+
+
+def save(cubes, filepath):
+    """
+    Write the cubes to a UM ancillary file, one 2D field at a time.
+
+    Parameters
+    ----------
+    cubes : :class:`~iris.cube.CubeList`
+        Cubes on the same horizontal grid, with the grid as their last two
+        dimensions and a 'grid_staggering' attribute.  Lazy data is only
+        realised a field at a time, as it is written.
+    filepath : str
+        Ancillary file path.
+
+    """
+    grid_staggering = cubes[0].attributes.get("grid_staggering")
+    if grid_staggering is None:
+        raise ValueError(
+            "The grid staggering is needed to write an ancillary, see "
+            "'--grid-staggering'."
+        )
+    ancil = mule.AncilFile.from_template(_template(cubes[0], grid_staggering))
+    for cube in cubes:
+        ancil.fields.extend(fields(cube))
+
+    times = sorted({tuple(_validity(field)) for field in ancil.fields})
+    stash_codes = [field.lbuser4 for field in ancil.fields]
+    levels = {stash: stash_codes.count(stash) for stash in stash_codes}
+    ancil.integer_constants.num_times = len(times)
+    ancil.integer_constants.num_field_types = len(levels)
+    ancil.integer_constants.num_levels = max(levels.values()) // len(times)
+
+    header = ancil.fixed_length_header
+    header.time_type = _SINGLE_TIME
+    for name, value in zip(_TIME_NAMES, times[0]):
+        setattr(header, "t1_" + name, value)
+    for name, value in zip(_TIME_NAMES, times[-1]):
+        setattr(header, "t2_" + name, value)
+    if len(times) > 1:
+        climatological = any(
+            getattr(cube.coord("time"), "climatological", False)
+            for cube in cubes
+            if cube.coords("time")
+        )
+        header.time_type = _PERIODIC if climatological else _TIME_SERIES
+        calendar = cubes[0].coord("time").units.calendar
+        interval = _interval(times, calendar)
+        for name, value in zip(_TIME_NAMES, interval):
+            setattr(header, "t3_" + name, value)
+    ancil.to_file(filepath)
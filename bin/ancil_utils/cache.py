@@ -0,0 +1,128 @@
+# (C) Crown Copyright, Met Office. All rights reserved.
+#
+# This file is part of ANTS and is released under the BSD 3-Clause license.
+# See LICENSE.txt in the root of the repository for full licensing details.
+"""
+On-disk cache
+*************
+
+Persistent cache of numpy arrays shared by the ancillary applications, for
+derived quantities which only depend on their inputs' grids, masks or files
+(e.g. rasterised polygons or fill index maps).
+
+Entries are ``.npz`` files named by a key built from hashes of those inputs.
+The cache lives in the directory given by the ``ANCIL_CACHE_DIR`` environment
+variable, defaulting to ``~/.cache/ancil``.  It can be deleted at any time.
+
+"""
+import hashlib
+import os
+
+import numpy as np
+
+
+def cache_directory():
+    return os.environ.get(
+        "ANCIL_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "ancil")
+    )
+
+
+def grid_hash(cube):
+    """
+    Return a hash identifying the horizontal grid of a cube.
+
+    Parameters
+    ----------
+    cube : :class:`~iris.cube.Cube`
+
+    Returns
+    -------
+    : str
+
+    """
+    key = hashlib.sha1()
+    for axis in ["y", "x"]:
+        coord = cube.coord(axis=axis, dim_coords=True)
+        key.update(np.ascontiguousarray(coord.points, dtype="f8").tobytes())
+        key.update(repr(coord.coord_system).encode())
+    return key.hexdigest()[:16]
+
+
+def array_hash(*arrays):
+    """Return a hash of the shapes and contents of the arrays."""
+    key = hashlib.sha1()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        key.update(repr(array.shape).encode())
+        if array.dtype == bool:
+            array = np.packbits(array)
+        key.update(array.tobytes())
+    return key.hexdigest()[:16]
+
+
+def file_hash(filepath, chunk_size=2 ** 20):
+    """Return a hash of the contents of a file."""
+    key = hashlib.sha1()
+    with open(filepath, "rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            key.update(chunk)
+    return key.hexdigest()[:16]
+
+
+def file_stamp(filepath):
+    """
+    Return a hash of the path, size and modification time of a file.
+
+    A cheap alternative to :func:`file_hash` for large files, which is
+    invalidated by the file being rewritten.
+
+    """
+    status = os.stat(filepath)
+    key = hashlib.sha1()
+    key.update(os.path.abspath(filepath).encode())
+    key.update(repr((status.st_size, status.st_mtime_ns)).encode())
+    return key.hexdigest()[:16]
+
+
+def _path(name, *keys):
+    return os.path.join(cache_directory(), "_".join((name,) + keys) + ".npz")
+
+
+def load(name, *keys):
+    """
+    Return the arrays cached under the name and keys, or None.
+
+    Parameters
+    ----------
+    name : str
+        Kind of cached data, e.g. "polygon_mask".
+    *keys : str
+        Hashes of the inputs the cached data depends on.
+
+    Returns
+    -------
+    : dict or None
+        The cached arrays by name, or None if not cached.
+
+    """
+    path = _path(name, *keys)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as cached:
+        return {array_name: cached[array_name] for array_name in cached.files}
+
+
+def save(name, *keys, **arrays):
+    """
+    Cache arrays under the name and keys, see :func:`load`.
+
+    The file is written then renamed, so concurrent applications never read a
+    partial entry.
+
+    """
+    path = _path(name, *keys)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, "wb") as fh:
+        np.savez(fh, **arrays)
+    os.replace(tmp_path, path)
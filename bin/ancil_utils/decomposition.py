@@ -0,0 +1,184 @@
+# (C) Crown Copyright, Met Office. All rights reserved.
+#
+# This file is part of ANTS and is released under the BSD 3-Clause license.
+# See LICENSE.txt in the root of the repository for full licensing details.
+"""
+Memory driven decomposition
+***************************
+
+Drop-in replacement for :func:`ants.decomposition.decompose` which chooses
+the decomposition from a memory model rather than the static split in the
+ANTS configuration.
+
+The memory needed by the operation is estimated from the shapes and dtypes of
+the cubes it is applied to, scaled by an overhead factor for copies and
+temporaries.  The number of chunks is the smallest which brings each chunk
+within the memory budget.  The budget is, in order of preference:
+
+- The `budget` argument.
+- The ``ANCIL_MEMORY_BUDGET`` environment variable (e.g. "64G" or "500M").
+- The cgroup memory limit of the job (e.g. the SLURM allocation).
+- The physical memory of the node.
+
+Only a fraction (`headroom`) of the budget is planned for.  The chosen plan
+is logged.
+
+"""
+import contextlib
+import logging
+import math
+import os
+
+import ants.decomposition
+import iris
+import numpy as np
+from ants.config import CONFIG
+
+_LOGGER = logging.getLogger(__name__)
+
+_UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+_CGROUP_LIMIT_FILES = [
+    # cgroup v2
+    "/sys/fs/cgroup/memory.max",
+    # cgroup v1
+    "/sys/fs/cgroup/memory/memory.limit_in_bytes",
+]
+
+
+def _parse_bytes(value):
+    value = str(value).strip().upper().rstrip("B")
+    if value[-1:] in _UNITS:
+        return int(float(value[:-1]) * _UNITS[value[-1]])
+    return int(float(value))
+
+
+def _cgroup_limit():
+    for filepath in _CGROUP_LIMIT_FILES:
+        try:
+            with open(filepath) as fh:
+                limit = fh.read().strip()
+        except OSError:
+            continue
+        # Unlimited cgroups report 'max' (v2) or a huge sentinel (v1).
+        if limit.isdigit() and int(limit) < 2 ** 60:
+            return int(limit)
+    return None
+
+
+def memory_budget():
+    """
+    Return the memory available to this job in bytes.
+
+    Returns
+    -------
+    : int
+        The ``ANCIL_MEMORY_BUDGET`` environment variable if set, otherwise the
+        cgroup memory limit, otherwise the physical memory.
+
+    """
+    if os.environ.get("ANCIL_MEMORY_BUDGET"):
+        return _parse_bytes(os.environ["ANCIL_MEMORY_BUDGET"])
+    limit = _cgroup_limit()
+    if limit is None:
+        limit = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    return limit
+
+
+def _nbytes(cube):
+    return int(np.prod(cube.shape, dtype=np.int64)) * np.dtype(cube.dtype).itemsize
+
+
+def _flatten(cubes):
+    for item in cubes:
+        if isinstance(item, iris.cube.Cube):
+            yield item
+        else:
+            yield from item
+
+
+def plan(cubes, budget=None, overhead=4.0, headroom=0.8):
+    """
+    Return the (x_split, y_split) which fits the cubes within a memory budget.
+
+    Parameters
+    ----------
+    cubes : iterable of :class:`~iris.cube.Cube` or :class:`~iris.cube.CubeList`
+        Cubes the operation is applied to.  The last cube defines the grid
+        being decomposed.
+    budget : int, optional
+        Memory budget in bytes.  Defaults to :func:`memory_budget`.
+    overhead : float, optional
+        Peak memory of the operation as a multiple of the size of its inputs.
+    headroom : float, optional
+        Fraction of the budget available to the operation.
+
+    Returns
+    -------
+    : tuple(int, int)
+        Number of chunks along x and y respectively.
+
+    """
+    cubes = list(_flatten(cubes))
+    if budget is None:
+        budget = memory_budget()
+    required = overhead * sum(_nbytes(cube) for cube in cubes)
+    nchunks = max(1, math.ceil(required / (headroom * budget)))
+
+    grid = cubes[-1]
+    ny = grid.coord(axis="y").shape[0]
+    nx = grid.coord(axis="x").shape[0]
+    # Split y first (keeping rows contiguous), then x if y alone is not enough.
+    y_split = min(nchunks, ny)
+    x_split = min(math.ceil(nchunks / y_split), nx)
+
+    _LOGGER.info(
+        "Decomposition plan: %.2f GiB required, %.2f GiB budget, "
+        "x_split=%d, y_split=%d (%.2f GiB per chunk)",
+        required / _UNITS["G"],
+        budget / _UNITS["G"],
+        x_split,
+        y_split,
+        required / (x_split * y_split) / _UNITS["G"],
+    )
+    return x_split, y_split
+
+
+@contextlib.contextmanager
+def _split(x_split, y_split):
+    section = CONFIG["ants_decomposition"]
+    original = {key: section[key] for key in ("x_split", "y_split")}
+    section["x_split"] = x_split
+    section["y_split"] = y_split
+    try:
+        yield
+    finally:
+        section.update(original)
+
+
+def decompose(operation, *cubes, budget=None, overhead=4.0, **kwargs):
+    """
+    Decompose an operation, choosing the split to fit the memory budget.
+
+    A drop-in replacement for :func:`ants.decomposition.decompose`.
+
+    Parameters
+    ----------
+    operation : callable
+        Operation to apply to each chunk.
+    *cubes : :class:`~iris.cube.Cube`
+        Cubes passed on to :func:`ants.decomposition.decompose`.
+    budget : int, optional
+        Memory budget in bytes, see :func:`plan`.
+    overhead : float, optional
+        Peak memory of the operation as a multiple of its inputs, see
+        :func:`plan`.
+
+    Returns
+    -------
+    The result of :func:`ants.decomposition.decompose`.
+
+    """
+    x_split, y_split = plan(cubes, budget, overhead=overhead)
+    with _split(x_split, y_split):
+        return ants.decomposition.decompose(operation, *cubes, **kwargs)
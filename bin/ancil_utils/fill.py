@@ -0,0 +1,407 @@
+# (C) Crown Copyright, Met Office. All rights reserved.
+#
+# This file is part of ANTS and is released under the BSD 3-Clause license.
+# See LICENSE.txt in the root of the repository for full licensing details.
+"""
+Nearest valid point fill
+************************
+
+An alternative engine to the spiral search behind
+:func:`ants.analysis.make_consistent_with_lsm`.
+
+Rather than searching outward from every missing point in turn, one spatial
+index (:class:`scipy.spatial.cKDTree`) is built over the valid source points
+and all missing points are resolved with a single batched nearest neighbour
+query.  The result is a map from missing point indices to valid point
+indices, which can be saved and reused for any field with the same missing
+data mask and landsea mask.
+
+Equivalence with the spiral search:
+
+- Distances are great circle distances, through the chord distance between
+  points on the unit sphere, which increases monotonically with it.
+- Only points unmasked by the landsea mask are filled, and only points
+  unmasked by the landsea mask and holding valid (unmasked, non-NaN) data
+  are used as donors.  Points masked by the landsea mask are masked.
+- Ties (donors equidistant to within a relative tolerance of 1e-12) are
+  resolved in favour of the donor with the lowest row-major index on the
+  grid.
+
+Also provides :class:`DistanceFill`, an alternative to
+:class:`ants.analysis.FillMissingPoints` (the spiral search for missing
+data, without a landsea mask), which resolves the nearest valid point of
+every missing point at once with an exact Euclidean distance transform in
+grid index space (:func:`scipy.ndimage.distance_transform_edt`).
+
+The index maps of both are kept in the on-disk cache (see
+:mod:`ancil_utils.cache`), keyed by the missing data mask, the landsea (or
+target) mask and the grid, so that every application filling against the
+same mask on the same grid computes each map once.
+
+"""
+import os
+
+import ants
+import ants.utils
+import iris
+import numpy as np
+from iris.analysis.cartography import unrotate_pole
+from scipy import ndimage
+from scipy.spatial import cKDTree
+
+from . import cache
+
+# Number of neighbours considered for tie-breaking.  On a lat-lon grid no
+# more than 8 points can be equidistant from a point.
+_TIE_CANDIDATES = 8
+_TIE_TOLERANCE = 1e-12
+
+
+def _horizontal_coords(cube):
+    return cube.coord(axis="y", dim_coords=True), cube.coord(axis="x", dim_coords=True)
+
+
+def unit_vectors(cube):
+    """
+    Return the position of each horizontal grid point on the unit sphere.
+
+    Parameters
+    ----------
+    cube : :class:`~iris.cube.Cube`
+        Cube on a lat-lon or rotated pole grid.
+
+    Returns
+    -------
+    : :class:`numpy.ndarray`
+        Array of shape (ny * nx, 3), in row-major grid order.
+
+    """
+    y_coord, x_coord = _horizontal_coords(cube)
+    lon, lat = np.meshgrid(
+        x_coord.units.convert(x_coord.points, "degrees"),
+        y_coord.units.convert(y_coord.points, "degrees"),
+    )
+    crs = x_coord.coord_system
+    if isinstance(crs, iris.coord_systems.RotatedGeogCS):
+        lon, lat = unrotate_pole(
+            lon, lat, crs.grid_north_pole_longitude, crs.grid_north_pole_latitude
+        )
+    lon = np.deg2rad(lon).ravel()
+    lat = np.deg2rad(lat).ravel()
+    return np.column_stack(
+        [np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)]
+    )
+
+
+def nearest_index_map(points, donors, missing):
+    """
+    Return the nearest donor point for each missing point.
+
+    Parameters
+    ----------
+    points : :class:`numpy.ndarray`
+        Unit vectors of all grid points, see :func:`unit_vectors`.
+    donors : :class:`numpy.ndarray`
+        Flat boolean array, True where a point can be used as a donor.
+    missing : :class:`numpy.ndarray`
+        Flat boolean array, True where a point is to be filled.
+
+    Returns
+    -------
+    : tuple(:class:`numpy.ndarray`, :class:`numpy.ndarray`)
+        Flat indices of the missing points and of their donors respectively.
+
+    """
+    missing_index = np.flatnonzero(missing)
+    donor_index = np.flatnonzero(donors)
+    if missing_index.size == 0:
+        return missing_index, missing_index.copy()
+    if donor_index.size == 0:
+        raise ValueError("No valid points available to fill missing data from.")
+    tree = cKDTree(points[donor_index])
+    k = min(_TIE_CANDIDATES, donor_index.size)
+    distance, nearest = tree.query(points[missing_index], k=k)
+    distance = distance.reshape(missing_index.size, k)
+    nearest = donor_index[nearest.reshape(missing_index.size, k)]
+    # Tie-break on the lowest grid index amongst equidistant donors.
+    tied = distance <= distance[:, :1] * (1 + _TIE_TOLERANCE)
+    nearest = np.where(tied, nearest, np.iinfo(nearest.dtype).max).min(axis=1)
+    return missing_index, nearest
+
+
+def _target_valid(lsm, invert_mask):
+    """Flat boolean array, True where the landsea mask allows data."""
+    valid = np.ma.filled(lsm.data, 0).astype(bool)
+    if not invert_mask:
+        valid = ~valid
+    return valid.ravel()
+
+
+def _cached_map(name, keys, compute, use_cache):
+    cached = cache.load(name, *keys) if use_cache else None
+    if cached is not None:
+        return cached["missing"], cached["donor"]
+    missing_index, donor_index = compute()
+    if use_cache:
+        cache.save(name, *keys, missing=missing_index, donor=donor_index)
+    return missing_index, donor_index
+
+
+class NearestFill(object):
+    """
+    Fill missing data from the nearest valid point, resolved by a KD-tree.
+
+    Index maps are computed once per distinct missing data mask and kept in
+    the on-disk cache.  They can also be saved to, and loaded from, a file
+    for reuse with the same masks.
+
+    """
+
+    def __init__(self, lsm, invert_mask=True, cache_file=None, use_cache=True):
+        """
+        Parameters
+        ----------
+        lsm : :class:`~iris.cube.Cube`
+            Landsea mask on the grid of the fields to be filled.
+        invert_mask : bool, optional
+            When set to True, treat lsm True (1) values as unmasked.  When set
+            to False, treat lsm True (1) values as masked.
+        cache_file : str, optional
+            File holding index maps from a previous run.  It is read if it
+            exists and written with any newly computed maps by :meth:`save`.
+        use_cache : bool, optional
+            Whether to read and write the index maps from the on-disk cache.
+
+        """
+        self._target_valid = _target_valid(lsm, invert_mask)
+        self._use_cache = use_cache
+        self._points = None
+        self._maps = {}
+        self._cache_file = cache_file
+        if cache_file and os.path.exists(cache_file):
+            with np.load(cache_file) as cached:
+                for name in cached.files:
+                    key, kind = name.rsplit("_", 1)
+                    self._maps.setdefault(key, [None, None])
+                    self._maps[key][kind == "donor"] = cached[name]
+        self._new_maps = False
+
+    def _nearest_index_map(self, missing, cube):
+        if self._points is None:
+            self._points = unit_vectors(cube)
+        return nearest_index_map(
+            self._points, ~missing & self._target_valid, missing & self._target_valid
+        )
+
+    def _index_map(self, missing, cube):
+        mask_key = cache.array_hash(missing, self._target_valid)
+        grid_key = cache.grid_hash(cube)
+        key = mask_key + grid_key
+        if key not in self._maps:
+            self._maps[key] = _cached_map(
+                "nearest_fill",
+                (mask_key, grid_key),
+                lambda: self._nearest_index_map(missing, cube),
+                self._use_cache,
+            )
+            self._new_maps = True
+        return self._maps[key]
+
+    def __call__(self, cube):
+        """
+        Fill the cube in place, making it consistent with the landsea mask.
+
+        Parameters
+        ----------
+        cube : :class:`~iris.cube.Cube`
+            Cube with the horizontal grid as its last two dimensions.
+
+        """
+        data = np.ma.array(cube.data, copy=False)
+        values = np.ascontiguousarray(np.ma.getdata(data))
+        mask = np.ma.getmaskarray(data) | np.isnan(values)
+        npoints = values.shape[-2] * values.shape[-1]
+        for field, field_mask in zip(
+            values.reshape(-1, npoints), mask.reshape(-1, npoints)
+        ):
+            missing_index, donor_index = self._index_map(field_mask.copy(), cube)
+            field[missing_index] = field[donor_index]
+            field_mask[missing_index] = False
+            field_mask[~self._target_valid] = True
+        cube.data = np.ma.array(values, mask=mask, copy=False)
+
+    def save(self, cache_file=None):
+        """Write the index maps to the cache file, if any were computed."""
+        cache_file = cache_file or self._cache_file
+        if not cache_file or not self._new_maps:
+            return
+        arrays = {}
+        for key, (missing_index, donor_index) in self._maps.items():
+            arrays[key + "_missing"] = missing_index
+            arrays[key + "_donor"] = donor_index
+        # Write then rename, so that a concurrent reader never sees a partial
+        # file.
+        with open(cache_file + ".tmp", "wb") as fh:
+            np.savez(fh, **arrays)
+        os.replace(cache_file + ".tmp", cache_file)
+        self._new_maps = False
+
+
+def distance_index_map(missing, donors, wrap_x=False):
+    """
+    Return the nearest donor point for each missing point, in index space.
+
+    Parameters
+    ----------
+    missing : :class:`numpy.ndarray`
+        2D boolean array, True where a point is to be filled.
+    donors : :class:`numpy.ndarray`
+        2D boolean array, True where a point can be used as a donor.
+    wrap_x : bool, optional
+        Whether the last dimension is periodic, so that donors across the
+        seam are considered.
+
+    Returns
+    -------
+    : tuple(:class:`numpy.ndarray`, :class:`numpy.ndarray`)
+        Flat indices of the missing points and of their donors respectively.
+
+    """
+    missing_index = np.flatnonzero(missing)
+    if missing_index.size == 0:
+        return missing_index, missing_index.copy()
+    if not donors.any():
+        raise ValueError("No valid points available to fill missing data from.")
+    ny, nx = donors.shape
+    pad = nx // 2 if wrap_x else 0
+    # The transform is to the nearest zero, so donors are the zeros.
+    features = np.pad(~donors, ((0, 0), (pad, pad)), mode="wrap")
+    rows, cols = ndimage.distance_transform_edt(
+        features, return_distances=False, return_indices=True
+    )
+    missing_rows, missing_cols = np.unravel_index(missing_index, (ny, nx))
+    donor_rows = rows[missing_rows, missing_cols + pad]
+    donor_cols = (cols[missing_rows, missing_cols + pad] - pad) % nx
+    return missing_index, np.ravel_multi_index((donor_rows, donor_cols), (ny, nx))
+
+
+class DistanceFill(object):
+    """
+    Fill missing data from the nearest valid point in grid index space.
+
+    A drop-in alternative to :class:`ants.analysis.FillMissingPoints`.  Index
+    maps are computed once per distinct missing data mask and kept in the
+    on-disk cache, so that filling further fields with the same mask is a
+    single gather.
+
+    """
+
+    def __init__(self, source, target_mask=None, wrap_x=None, use_cache=True):
+        """
+        Parameters
+        ----------
+        source : :class:`~iris.cube.Cube`
+            Cube on the grid of the fields to be filled.
+        target_mask : :class:`~iris.cube.Cube`, optional
+            True where points are not to be filled.
+        wrap_x : bool, optional
+            Whether to search for valid points across the x seam.  Defaults
+            to whether the x coordinate of the source is circular.
+        use_cache : bool, optional
+            Whether to read and write the index maps from the on-disk cache.
+
+        """
+        self._shape = source.shape[-2:]
+        self._target_mask = np.zeros(self._shape, dtype=bool)
+        if target_mask is not None:
+            self._target_mask = np.ma.filled(target_mask.data, True).astype(bool)
+        if wrap_x is None:
+            wrap_x = bool(getattr(source.coord(axis="x"), "circular", False))
+        self._wrap_x = wrap_x
+        self._grid_key = cache.grid_hash(source)
+        self._use_cache = use_cache
+        self._maps = {}
+
+    def _index_map(self, invalid):
+        mask_key = cache.array_hash(invalid, self._target_mask, [self._wrap_x])
+        if mask_key not in self._maps:
+            self._maps[mask_key] = _cached_map(
+                "distance_fill",
+                (mask_key, self._grid_key),
+                lambda: distance_index_map(
+                    invalid & ~self._target_mask, ~invalid, self._wrap_x
+                ),
+                self._use_cache,
+            )
+        return self._maps[mask_key]
+
+    def __call__(self, cube):
+        """
+        Fill the missing (masked or NaN) data of the cube in place.
+
+        Parameters
+        ----------
+        cube : :class:`~iris.cube.Cube`
+            Cube with the horizontal grid as its last two dimensions.
+
+        """
+        data = np.ma.array(cube.data, copy=False)
+        values = np.ascontiguousarray(np.ma.getdata(data))
+        mask = np.ma.getmaskarray(data).copy()
+        if values.dtype.kind == "f":
+            mask |= np.isnan(values)
+        npoints = self._shape[0] * self._shape[1]
+        for field, field_mask in zip(
+            values.reshape(-1, npoints), mask.reshape(-1, npoints)
+        ):
+            invalid = field_mask.reshape(self._shape).copy()
+            missing_index, donor_index = self._index_map(invalid)
+            field[missing_index] = field[donor_index]
+            field_mask[missing_index] = False
+        cube.data = np.ma.array(values, mask=mask, copy=False)
+
+
+def missing_point_filler(source, target_mask=None, engine="spiral"):
+    """
+    Return a filler of missing data for the engine.
+
+    Parameters
+    ----------
+    source : :class:`~iris.cube.Cube`
+    target_mask : :class:`~iris.cube.Cube`, optional
+        See :class:`ants.analysis.FillMissingPoints`.
+    engine : str, optional
+        "spiral" for :class:`ants.analysis.FillMissingPoints` or "edt" for
+        :class:`DistanceFill`.
+
+    Returns
+    -------
+    : callable
+
+    """
+    if engine == "edt":
+        return DistanceFill(source, target_mask=target_mask)
+    return ants.analysis.FillMissingPoints(source, target_mask=target_mask)
+
+
+def make_consistent_with_lsm(cubes, lsm, invert_mask, cache_file=None):
+    """
+    KD-tree equivalent of :func:`ants.analysis.make_consistent_with_lsm`.
+
+    Parameters
+    ----------
+    cubes : :class:`~iris.cube.Cube` or :class:`~iris.cube.CubeList`
+        Cube(s) to fill in place.
+    lsm : :class:`~iris.cube.Cube`
+        Landsea mask on the grid of the cubes.
+    invert_mask : bool
+        When set to True, treat lsm True (1) values as unmasked.  When set to
+        False, treat lsm True (1) values as masked.
+    cache_file : str, optional
+        File to reuse the index maps from, and save them to.
+
+    """
+    filler = NearestFill(lsm, invert_mask, cache_file)
+    for cube in ants.utils.cube.as_cubelist(cubes):
+        filler(cube)
+    filler.save()
@@ -0,0 +1,261 @@
+# (C) Crown Copyright, Met Office. All rights reserved.
+#
+# This file is part of ANTS and is released under the BSD 3-Clause license.
+# See LICENSE.txt in the root of the repository for full licensing details.
+"""
+Batched lake fill
+*****************
+
+Batched alternative to calling :func:`proc_ants.lakes.fill_lakes` once per
+lake, for reclassifying water bodies of a land cover class source.
+
+Rather than flood filling from each seed in turn, the water body classes are
+labelled once with connected component labelling (4-connected, as a flood
+fill), the component holding each seed is looked up and all selected
+components are reclassified in a single vectorised pass.
+
+Lakes constrained by their Natural Earth geometry are filled within that
+geometry only, rasterised (see :func:`ancil_utils.raster.rasterise`) over the
+window of the source covering it, so that they are labelled over that window
+rather than globally.
+
+The source can also be labelled in bands of rows, for sources too large to
+hold in memory (e.g. a :class:`numpy.memmap`).  Each band is labelled in
+turn, components continuing across band boundaries are joined by a global
+connected components pass over the (small) graph of band labels, and the
+bands are labelled again to reassign the selected components.  The result is
+identical to labelling the whole source at once.
+
+"""
+import numpy as np
+import shapely.geometry
+from proc_ants.lakes import get_lake_geoms
+import scipy.sparse
+from scipy import ndimage
+from scipy.sparse.csgraph import connected_components
+
+from . import raster
+
+
+def flag_value(cube, meaning):
+    """Return the flag value of a flag meaning of a land cover class cube."""
+    flag_meanings = cube.attributes["flag_meanings"].split()
+    return cube.attributes["flag_values"][flag_meanings.index(meaning)]
+
+
+def _lake_spec(lake):
+    try:
+        name, seed, use_geom = lake
+    except ValueError:
+        name, seed = lake
+        use_geom = True
+    return name, seed, use_geom
+
+
+def _horizontal_points(cube):
+    y_coord = cube.coord(axis="y", dim_coords=True)
+    x_coord = cube.coord(axis="x", dim_coords=True)
+    return (
+        y_coord.units.convert(y_coord.points, "degrees"),
+        x_coord.units.convert(x_coord.points, "degrees"),
+    )
+
+
+def seed_index(seed, y_points, x_points):
+    """Return the (row, column) of the grid point nearest a (lat, lon) seed."""
+    lat, lon = seed
+    row = np.abs(y_points - lat).argmin()
+    column = np.abs((x_points - lon + 180.0) % 360.0 - 180.0).argmin()
+    return row, column
+
+
+def _window(points, lower, upper):
+    inside = np.flatnonzero((points >= lower) & (points <= upper))
+    if inside.size == 0:
+        return slice(0, 0)
+    return slice(inside[0], inside[-1] + 1)
+
+
+def lake_geometry(name, seed, records=None):
+    """
+    Return the Natural Earth geometry of a lake, or None if not found.
+
+    Lakes are matched on their name containing `name`.  Where several match,
+    those containing the seed are preferred.
+
+    Parameters
+    ----------
+    name : str
+    seed : tuple(float, float)
+        (lat, lon) of a point of the lake.
+    records : list, optional
+        Lake records, as returned by :func:`proc_ants.lakes.get_lake_geoms`.
+
+    """
+    if records is None:
+        records = get_lake_geoms()
+    matches = [
+        record.geometry.buffer(0)
+        for record in records
+        if name in str(record.attributes.get("name", "")).lower()
+    ]
+    point = shapely.geometry.Point(seed[1], seed[0])
+    containing = [geometry for geometry in matches if geometry.contains(point)]
+    matches = containing or matches
+    if not matches:
+        return None
+    geometry = matches[0]
+    for other in matches[1:]:
+        geometry = geometry.union(other)
+    return geometry
+
+
+def _fill_constrained(data, y_points, x_points, seed, geometry, fill_values, flag):
+    lon_min, lat_min, lon_max, lat_max = geometry.bounds
+    rows = _window(y_points, lat_min, lat_max)
+    wrapped = (x_points + 180.0) % 360.0 - 180.0
+    columns = _window(wrapped, lon_min, lon_max)
+    window = data[rows, columns]
+    if window.size == 0:
+        return False
+    water = np.isin(window, fill_values)
+    water &= raster.rasterise(geometry, x_points[columns], y_points[rows])
+    labels, _ = ndimage.label(water)
+    row, column = seed_index(seed, y_points[rows], x_points[columns])
+    if labels[row, column] == 0:
+        return False
+    window[labels == labels[row, column]] = flag
+    return True
+
+
+def _select_components(data, seeds, fill_values, flag):
+    labels, nlabels = ndimage.label(np.isin(data, fill_values))
+    seed_labels = np.array([labels[seed] for seed in seeds], dtype=int)
+    selected = np.zeros(nlabels + 1, dtype=bool)
+    selected[seed_labels] = True
+    selected[0] = False
+    data[selected[labels]] = flag
+    return seed_labels > 0
+
+
+def _bands(nrows, band_rows):
+    for start in range(0, nrows, band_rows):
+        yield slice(start, min(start + band_rows, nrows))
+
+
+def _band_labels(data, band, fill_values, offset):
+    labels, nlabels = ndimage.label(np.isin(data[band], fill_values))
+    labels[labels > 0] += offset
+    return labels, nlabels
+
+
+def _select_components_banded(data, seeds, fill_values, flag, band_rows):
+    # First pass: label each band, recording the labels of the seeds and the
+    # labels joined across each band boundary (4-connected, so vertically).
+    offsets = []
+    joins = []
+    seed_labels = np.zeros(len(seeds), dtype=np.int64)
+    nlabels = 0
+    previous_row = None
+    for band in _bands(data.shape[0], band_rows):
+        labels, band_nlabels = _band_labels(data, band, fill_values, nlabels)
+        for index, (row, column) in enumerate(seeds):
+            if band.start <= row < band.stop:
+                seed_labels[index] = labels[row - band.start, column]
+        if previous_row is not None:
+            joined = (previous_row > 0) & (labels[0] > 0)
+            joins.append((previous_row[joined], labels[0][joined]))
+        previous_row = labels[-1].copy()
+        offsets.append(nlabels)
+        nlabels += band_nlabels
+
+    rows = np.concatenate([np.zeros(0, dtype=np.int64)] + [a for a, _ in joins])
+    cols = np.concatenate([np.zeros(0, dtype=np.int64)] + [b for _, b in joins])
+    graph = scipy.sparse.coo_matrix(
+        (np.ones(rows.size, dtype=np.int8), (rows, cols)),
+        shape=(nlabels + 1, nlabels + 1),
+    )
+    _, component = connected_components(graph, directed=False)
+    selected = np.isin(component, component[seed_labels[seed_labels > 0]])
+    selected[0] = False
+
+    # Second pass: label each band again and reassign the selected components.
+    for band, offset in zip(_bands(data.shape[0], band_rows), offsets):
+        labels, _ = _band_labels(data, band, fill_values, offset)
+        band_data = data[band]
+        band_data[selected[labels]] = flag
+        data[band] = band_data
+    return seed_labels > 0
+
+
+def fill_lakes(
+    cube, lakes, fill_types, fill_flag, constrain=False, data=None, band_rows=None
+):
+    """
+    Reclassify the water bodies holding each of the lake seeds, in place.
+
+    Parameters
+    ----------
+    cube : :class:`~iris.cube.Cube`
+        Land cover classes with 'flag_values' and 'flag_meanings' attributes,
+        on a regular lat-lon grid.
+    lakes : list of tuple
+        (name, (lat, lon)) or (name, (lat, lon), use_geom) for each lake.
+    fill_types : str or list of str
+        Flag meanings of the classes the lakes are made of.
+    fill_flag : str
+        Flag meaning to reclassify the lakes to.
+    constrain : bool, optional
+        Whether to fill the lakes within their Natural Earth geometry only,
+        for those with use_geom True.  The others are filled unconstrained.
+    data : array-like, optional
+        The land cover classes to fill in place, if not the data of the cube
+        (e.g. a :class:`numpy.memmap` holding them).
+    band_rows : int, optional
+        Label unconstrained lakes in bands of this many rows, rather than
+        all at once.
+
+    Returns
+    -------
+    : list of str
+        The names of the lakes which were not filled, as their seed is not
+        of a fill type (e.g. already of the fill flag type) or their geometry
+        was not found.
+
+    """
+    if isinstance(fill_types, str):
+        fill_types = [fill_types]
+    fill_values = [flag_value(cube, meaning) for meaning in fill_types]
+    flag = flag_value(cube, fill_flag)
+    if data is None:
+        data = cube.data
+    y_points, x_points = _horizontal_points(cube)
+
+    unfilled = []
+    unconstrained = []
+    records = None
+    for lake in lakes:
+        name, seed, use_geom = _lake_spec(lake)
+        if not (constrain and use_geom):
+            unconstrained.append((name, seed))
+            continue
+        if records is None:
+            records = list(get_lake_geoms())
+        geometry = lake_geometry(name, seed, records)
+        if geometry is None or not _fill_constrained(
+            data, y_points, x_points, seed, geometry, fill_values, flag
+        ):
+            unfilled.append(name)
+
+    if unconstrained:
+        seeds = [seed_index(seed, y_points, x_points) for _, seed in unconstrained]
+        if band_rows is None:
+            filled = _select_components(data, seeds, fill_values, flag)
+        else:
+            filled = _select_components_banded(
+                data, seeds, fill_values, flag, band_rows
+            )
+        for (name, _), lake_filled in zip(unconstrained, filled):
+            if not lake_filled:
+                unfilled.append(name)
+    return unfilled
@@ -0,0 +1,365 @@
+# (C) Crown Copyright, Met Office. All rights reserved.
+#
+# This file is part of ANTS and is released under the BSD 3-Clause license.
+# See LICENSE.txt in the root of the repository for full licensing details.
+"""
+Land cover type fractions
+*************************
+
+Lookup table engine for deriving land cover type fractions from a source of
+land cover classes, an alternative to :class:`ants.analysis.SCTTransformer`.
+
+The crosswalk table is encoded as a dense (n_source_classes, n_target_types)
+matrix of fractions.  Each source cell is assigned to the target cell holding
+its centre, so a block of the source becomes a flat index of target cells and
+a flat index of source classes.  One weighted :func:`numpy.bincount` over the
+pair gives the area of each source class in each target cell, and one matrix
+product with the crosswalk gives all target type fractions at once, rather
+than a regrid per class.
+
+The source is assumed to be of (much) higher resolution than the target, as
+for the CCI and IGBP sources, and source cells are weighted by their area.
+Source points of classes absent from the crosswalk, or masked, are ignored.
+Target cells with no source points are masked.
+
+Also provides a connected component labelling engine for removing
+non-glacial ice, see :func:`remove_non_glacial_ice`.
+
+"""
+import iris
+import numpy as np
+import scipy.sparse
+from scipy import ndimage
+from scipy.sparse.csgraph import connected_components
+
+# Number of source rows processed at a time, to bound the memory of the
+# index arrays.
+_ROWS_PER_BLOCK = 256
+
+
+def crosswalk_matrix(transform):
+    """
+    Return the crosswalk table as a dense matrix.
+
+    Parameters
+    ----------
+    transform : :class:`ants.fileformats.cover_mapping.CoverMapper`
+        Crosswalk table, with one (source id, target id, fraction) entry per
+        row in its `source_ids`, `target_ids` and `fractions`.
+
+    Returns
+    -------
+    : tuple(:class:`numpy.ndarray`, :class:`numpy.ndarray`, \
+:class:`numpy.ndarray`)
+        Sorted source class ids, sorted target type ids and the
+        (n_source_classes, n_target_types) matrix of fractions respectively.
+
+    """
+    source_ids = np.asarray(transform.source_ids, dtype=np.int64)
+    target_ids = np.asarray(transform.target_ids, dtype=np.int64)
+    fractions = np.asarray(transform.fractions, dtype=np.float64)
+    source_classes, source_index = np.unique(source_ids, return_inverse=True)
+    target_types, target_index = np.unique(target_ids, return_inverse=True)
+    matrix = np.zeros((source_classes.size, target_types.size))
+    np.add.at(matrix, (source_index, target_index), fractions)
+    return source_classes, target_types, matrix
+
+
+def _bounds(coord):
+    if not coord.has_bounds():
+        coord = coord.copy()
+        coord.guess_bounds()
+    return coord.units.convert(coord.bounds, "degrees")
+
+
+def _source_coords(source):
+    if source.ndim != 2:
+        raise ValueError(
+            "Expecting a 2D source of land cover classes, got {} "
+            "dimensions.".format(source.ndim)
+        )
+    return source.coord(axis="y", dim_coords=True), source.coord(
+        axis="x", dim_coords=True
+    )
+
+
+def cell_index(points, bounds, circular=False):
+    """
+    Return the index of the cell holding each point, or -1 if none does.
+
+    Parameters
+    ----------
+    points : :class:`numpy.ndarray`
+        Points to locate.
+    bounds : :class:`numpy.ndarray`
+        Contiguous cell bounds of shape (n, 2), in ascending or descending
+        order.
+    circular : bool, optional
+        Whether the cells are longitudes, in which case points are compared
+        modulo 360.
+
+    Returns
+    -------
+    : :class:`numpy.ndarray`
+
+    """
+    lower = bounds.min(axis=1)
+    upper = bounds.max(axis=1)
+    order = np.argsort(lower)
+    lower = lower[order]
+    upper = upper[order]
+    if circular:
+        points = (points - lower[0]) % 360.0 + lower[0]
+    index = np.searchsorted(lower, points, side="right") - 1
+    inside = (index >= 0) & (points < upper[np.clip(index, 0, None)])
+    return np.where(inside, order[np.clip(index, 0, None)], -1)
+
+
+class LookupTransformer(object):
+    """
+    Land cover type fractions by crosswalk lookup and bincount aggregation.
+
+    Callable as ``operation(source, target)`` like
+    :class:`ants.analysis.SCTTransformer`, and so usable with
+    :func:`ants.decomposition.decompose`.
+
+    """
+
+    def __init__(self, transform):
+        """
+        Parameters
+        ----------
+        transform : :class:`ants.fileformats.cover_mapping.CoverMapper`
+            Crosswalk table mapping source classes to target types.
+
+        """
+        source_classes, self.target_types, self.matrix = crosswalk_matrix(transform)
+        # Dense lookup from source class value to crosswalk row (-1 if absent).
+        self._lookup = np.full(source_classes.max() + 1, -1, dtype=np.int64)
+        self._lookup[source_classes] = np.arange(source_classes.size)
+
+    def _class_index(self, values):
+        values = np.ma.filled(values.astype(np.int64, copy=False), -1)
+        outside = (values < 0) | (values >= self._lookup.size)
+        lookup = self._lookup[np.clip(values, 0, self._lookup.size - 1)]
+        return np.where(outside, -1, lookup)
+
+    def __call__(self, source, target):
+        """
+        Return the target type fractions of the source on the target grid.
+
+        Parameters
+        ----------
+        source : :class:`~iris.cube.Cube`
+            Land cover classes on a regular lat-lon grid.
+        target : :class:`~iris.cube.Cube`
+            Cube defining the target regular lat-lon grid.
+
+        Returns
+        -------
+        : :class:`~iris.cube.Cube`
+            Fraction of each target type, with a leading 'pseudo_level'
+            dimension of the target type ids.
+
+        """
+        src_y, src_x = _source_coords(source)
+        tgt_y = target.coord(axis="y", dim_coords=True)
+        tgt_x = target.coord(axis="x", dim_coords=True)
+        y_bounds = _bounds(tgt_y)
+        x_bounds = _bounds(tgt_x)
+        ny, nx = tgt_y.shape[0], tgt_x.shape[0]
+
+        src_lat = src_y.units.convert(src_y.points, "degrees")
+        src_lon = src_x.units.convert(src_x.points, "degrees")
+        rows = cell_index(src_lat, y_bounds)
+        cols = cell_index(src_lon, x_bounds, circular=True)
+        row_weight = np.cos(np.deg2rad(src_lat))
+
+        nclasses = self.matrix.shape[0]
+        area = np.zeros(ny * nx * nclasses)
+        y_dim = source.coord_dims(src_y)[0]
+        used_rows = np.flatnonzero(rows >= 0)
+        used_cols = np.flatnonzero(cols >= 0)
+        if used_rows.size and used_cols.size:
+            col_slice = slice(used_cols[0], used_cols[-1] + 1)
+            cols = cols[col_slice]
+            for start in range(used_rows[0], used_rows[-1] + 1, _ROWS_PER_BLOCK):
+                stop = min(start + _ROWS_PER_BLOCK, used_rows[-1] + 1)
+                index = [slice(None)] * source.ndim
+                index[y_dim] = slice(start, stop)
+                index[1 - y_dim] = col_slice
+                values = source[tuple(index)].data
+                if y_dim == 1:
+                    values = values.T
+                classes = self._class_index(values)
+                cells = rows[start:stop, None] * nx + cols[None, :]
+                valid = (
+                    (classes >= 0)
+                    & (rows[start:stop, None] >= 0)
+                    & (cols[None, :] >= 0)
+                )
+                weights = np.broadcast_to(row_weight[start:stop, None], valid.shape)
+                bins = (cells * nclasses + classes)[valid]
+                if not bins.size:
+                    continue
+                # Only the target cells spanned by the block.
+                first, last = bins.min(), bins.max() + 1
+                area[first:last] += np.bincount(
+                    bins - first, weights=weights[valid], minlength=last - first
+                )
+
+        area = area.reshape(ny * nx, nclasses)
+        total = area.sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            fractions = (area @ self.matrix) / total[:, None]
+        fractions = np.ma.masked_invalid(fractions.T.reshape(-1, ny, nx))
+        return self._result_cube(fractions, source, tgt_y, tgt_x)
+
+    def _result_cube(self, fractions, source, y_coord, x_coord):
+        cube = iris.cube.Cube(fractions)
+        cube.metadata = source.metadata
+        cube.units = "1"
+        pseudo_level = iris.coords.DimCoord(
+            self.target_types.astype("int32"), long_name="pseudo_level", units="1"
+        )
+        cube.add_dim_coord(pseudo_level, 0)
+        cube.add_dim_coord(y_coord.copy(), 1)
+        cube.add_dim_coord(x_coord.copy(), 2)
+        return cube
+
+
+def _seam_components(labels, nlabels):
+    """
+    Return the component of each label once joined across the x seam.
+
+    Labels of regions 8-connected across the first and last columns are
+    joined.
+
+    """
+    first = labels[:, 0]
+    pairs = [(first, labels[:, -1])]
+    pairs.append((first[1:], labels[:-1, -1]))
+    pairs.append((first[:-1], labels[1:, -1]))
+    rows = np.concatenate([left for left, _ in pairs])
+    cols = np.concatenate([right for _, right in pairs])
+    joined = (rows > 0) & (cols > 0)
+    graph = scipy.sparse.coo_matrix(
+        (np.ones(joined.sum()), (rows[joined], cols[joined])),
+        shape=(nlabels + 1, nlabels + 1),
+    )
+    _, component = connected_components(graph, directed=False)
+    return component
+
+
+def glacial_ice(ice, seed_size=5, wrap_x=False):
+    """
+    Return the ice points belonging to regions containing a seed point.
+
+    Seed points are ice points surrounded by a `seed_size` square of ice, and
+    regions are 8-connected (diagonals included).
+
+    Parameters
+    ----------
+    ice : :class:`numpy.ndarray`
+        2D boolean array, True where there is ice.
+    seed_size : int, optional
+        Size of the square of ice surrounding a seed point.
+    wrap_x : bool, optional
+        Whether the last dimension is periodic (a global longitude), so that
+        squares and regions extend across the seam.
+
+    Returns
+    -------
+    : :class:`numpy.ndarray`
+        2D boolean array, True where the ice is glacial.
+
+    """
+    ny, nx = ice.shape
+    halo = seed_size // 2
+    padded = np.pad(ice, ((halo, halo), (0, 0)), mode="constant")
+    x_mode = "wrap" if wrap_x else "constant"
+    padded = np.pad(padded, ((0, 0), (halo, halo)), mode=x_mode)
+    seeds = ndimage.binary_erosion(
+        padded, structure=np.ones((seed_size, seed_size), dtype=bool)
+    )
+    seeds = seeds[halo : halo + ny, halo : halo + nx]
+
+    labels, nlabels = ndimage.label(ice, structure=np.ones((3, 3), dtype=bool))
+    seeded = np.zeros(nlabels + 1, dtype=bool)
+    seeded[labels[seeds]] = True
+    if wrap_x and nlabels:
+        component = _seam_components(labels, nlabels)
+        seeded = np.isin(component, component[seeded])
+    seeded[0] = False
+    return seeded[labels]
+
+
+def pseudo_level_index(cube, pseudo_level):
+    """
+    Return the index of a pseudo level along the leading dimension.
+
+    Unlike :func:`ants.analysis.cover_mapping.fetch_lct_slices`, the index is
+    a plain integer, so that indexing the data with it gives a view which
+    can be written in place.
+
+    Parameters
+    ----------
+    cube : :class:`~iris.cube.Cube`
+        Cube with a leading 'pseudo_level' dimension.
+    pseudo_level : int
+        Pseudo level to find.
+
+    Returns
+    -------
+    : int
+
+    """
+    coord = cube.coord("pseudo_level")
+    if cube.coord_dims(coord) != (0,):
+        raise ValueError("Expecting a leading 'pseudo_level' dimension.")
+    index = np.flatnonzero(coord.points == pseudo_level)
+    if index.size != 1:
+        raise ValueError(
+            "Expecting a single pseudo level {}, found {}.".format(
+                pseudo_level, index.size
+            )
+        )
+    return int(index[0])
+
+
+def remove_non_glacial_ice(lct_cube, ice_id=9, soil_id=8, seed_size=5, wrap_x=None):
+    """
+    Replace ice with soil where it is not part of a glacial region, in place.
+
+    A vectorised equivalent of the neighbour search in
+    :func:`proc_ants.lct.remove_non_glacial_ice`: seed points are found by
+    erosion, all ice regions are labelled in a single pass and the regions
+    containing a seed are kept (see :func:`glacial_ice`).
+
+    Parameters
+    ----------
+    lct_cube : :class:`~iris.cube.Cube`
+        Land cover type fractions, with a leading 'pseudo_level' dimension.
+    ice_id : int, optional
+        Pseudo level of ice.
+    soil_id : int, optional
+        Pseudo level of bare soil.
+    seed_size : int, optional
+        Size of the square of ice surrounding a seed point.
+    wrap_x : bool, optional
+        Whether regions extend across the longitude seam.  Defaults to whether
+        the x coordinate is circular.
+
+    """
+    if wrap_x is None:
+        wrap_x = bool(getattr(lct_cube.coord(axis="x"), "circular", False))
+    ice_level = pseudo_level_index(lct_cube, ice_id)
+    soil_level = pseudo_level_index(lct_cube, soil_id)
+    data = lct_cube.data
+    ice_fraction = np.ma.filled(data[ice_level], 0)
+    with np.errstate(invalid="ignore"):
+        ice = ice_fraction > 0
+    non_glacial = ice & ~glacial_ice(ice, seed_size, wrap_x)
+    if non_glacial.any():
+        data[soil_level, non_glacial] += ice_fraction[non_glacial]
+        data[ice_level, non_glacial] = 0
@@ -0,0 +1,120 @@
+# (C) Crown Copyright, Met Office. All rights reserved.
+#
+# This file is part of ANTS and is released under the BSD 3-Clause license.
+# See LICENSE.txt in the root of the repository for full licensing details.
+"""
+Mask products
+*************
+
+Derivation and writing of the mask products shared by ``ancil_lct.py`` and
+``ancil_generate_masks.py``: the land mask (qrparm.mask), the sea mask
+(qrparm.mask_sea) and the land fraction (qrparm.landfrac).
+
+The masks are derived from the land fraction in a single pass, by comparisons
+whose boolean results are viewed as int8 rather than copied, and the three
+files are written from those same arrays, one after the other.
+
+"""
+import os
+
+import ants
+import iris
+import numpy as np
+
+MASK_FILENAME = "qrparm.mask"
+SEA_MASK_FILENAME = "qrparm.mask_sea"
+LAND_FRACTION_FILENAME = "qrparm.landfrac"
+
+
+def prepare_mask_cube(cube):
+    """
+    Set the metadata needed for mask files and convert the data to int8.
+
+    Operates in place.  Attributes 'valid_min' and 'valid_max' are set to
+    ensure the netCDF result is correct for boolean data, the name is set to
+    'land_binary_mask', the STASH code is set to m01s00i030 and the data is
+    only copied if not already int8.
+
+    Parameters
+    ----------
+    cube : :class:`iris.cube.Cube`
+        Mask cube to prepare.
+
+    """
+    cube.rename("land_binary_mask")
+    cube.attributes["valid_min"] = 0
+    cube.attributes["valid_max"] = 1
+    cube.attributes["STASH"] = iris.fileformats.pp.STASH.from_msi("m01s00i030")
+    cube.data = cube.data.astype("int8", copy=False)
+
+
+def _as_int8(condition, missing):
+    values = condition.view(np.int8)
+    if missing is not None:
+        values = np.ma.array(values, mask=missing, copy=False)
+    return values
+
+
+def derive_masks(land_fraction, land_mask=None):
+    """
+    Return land and sea masks derived from the land fraction.
+
+    Any land fraction > 0 is land in the land mask and any land fraction < 1
+    is sea in the sea mask, so that coastal points are land in the former and
+    sea in the latter.  Masked land fractions are masked in both.
+
+    Parameters
+    ----------
+    land_fraction : :class:`iris.cube.Cube`
+        Land cover fraction cube.
+    land_mask : :class:`iris.cube.Cube`, optional
+        Land mask already derived by other means (e.g. from land cover type
+        fractions), to be prepared rather than derived.
+
+    Returns
+    -------
+    : tuple(:class:`iris.cube.Cube`, :class:`iris.cube.Cube`)
+        The land mask and sea mask cubes, in that order, with int8 data.
+
+    """
+    data = land_fraction.data
+    values = np.ma.getdata(data)
+    missing = np.ma.getmaskarray(data) if np.ma.is_masked(data) else None
+    with np.errstate(invalid="ignore"):
+        if land_mask is None:
+            land_mask = land_fraction.copy(
+                data=_as_int8(np.greater(values, 0), missing)
+            )
+        sea = np.less(values, 1)
+    np.logical_not(sea, out=sea)
+    sea_mask = land_fraction.copy(data=_as_int8(sea, missing))
+    prepare_mask_cube(land_mask)
+    prepare_mask_cube(sea_mask)
+    return land_mask, sea_mask
+
+
+def save_masks(output_dirpath, land_mask, sea_mask, land_fraction):
+    """
+    Write the land mask, sea mask and land fraction files.
+
+    The files are written in turn, in this process, as the netCDF library is
+    not thread safe and handing the cubes to other processes would copy their
+    data.
+
+    Parameters
+    ----------
+    output_dirpath : str
+        Directory to write qrparm.mask, qrparm.mask_sea and qrparm.landfrac to.
+    land_mask : :class:`iris.cube.Cube`
+    sea_mask : :class:`iris.cube.Cube`
+    land_fraction : :class:`iris.cube.Cube`
+
+    """
+    ants.config.dirpath_writeable(output_dirpath)
+    products = [
+        (land_mask, MASK_FILENAME, {"fill_value": -1}),
+        (sea_mask, SEA_MASK_FILENAME, {"fill_value": -1}),
+        (land_fraction, LAND_FRACTION_FILENAME, {}),
+    ]
+    for cube, filename, kwargs in products:
+        ants.save(cube, os.path.join(output_dirpath, filename), **kwargs)
@@ -0,0 +1,328 @@
+# (C) Crown Copyright, Met Office. All rights reserved.
+#
+# This file is part of ANTS and is released under the BSD 3-Clause license.
+# See LICENSE.txt in the root of the repository for full licensing details.
+"""
+PP header rewriting
+*******************
+
+Rewrites the lookup headers of a PP file without decoding its data.
+
+A PP file is a sequence of Fortran unformatted records, a 64 word header (45
+integers and 19 reals, 32 bit big-endian) followed by the (possibly packed)
+data of the field, each record framed by its length in bytes.  The file is
+memory mapped, the headers are read as small arrays, patched, and written to
+a new file followed by the data records copied byte for byte, so that the
+cost is that of copying the file.
+
+The headers are presented as :class:`PPHeader`, with the attribute names of
+:class:`iris.fileformats.pp.PPField3` (including the ``lbtim`` split into
+``ia``, ``ib`` and ``ic``), so that functions correcting the metadata of
+loaded PP fields apply to them unchanged.
+
+Also provides a persistent lookup index of a PP file (see :func:`index`),
+recording the STASH code, validity time, level and extent of each field in a
+``.idx`` sidecar file, so that a few fields can be extracted from a large
+archive by direct seeks rather than by parsing every header (see
+:func:`subset`).  The index is rebuilt whenever the size or modification time
+of the file changes.  Where the sidecar cannot be written (e.g. a read only
+archive), the index is kept in the on-disk cache instead (see
+:mod:`ancil_utils.cache`).  UM fieldsfiles need no such index, their lookup
+table already being held at the start of the file.
+
+"""
+import contextlib
+import mmap
+import os
+import tempfile
+
+import iris.fileformats.pp as ipp
+import numpy as np
+
+from . import cache
+
+_NUM_INTS = 45
+_NUM_REALS = 19
+_HEADER_BYTES = (_NUM_INTS + _NUM_REALS) * 4
+_OFFSETS = dict(ipp.PPField3.HEADER_DEFN)
+_LBTIM = _OFFSETS["lbtim"][0]
+
+INDEX_DTYPE = np.dtype(
+    [
+        ("model", "i4"),
+        ("section", "i4"),
+        ("item", "i4"),
+        ("lbyr", "i4"),
+        ("lbmon", "i4"),
+        ("lbdat", "i4"),
+        ("lbhr", "i4"),
+        ("lbmin", "i4"),
+        ("lblev", "i4"),
+        ("blev", "f8"),
+        ("offset", "i8"),
+        ("length", "i8"),
+    ]
+)
+
+
+def _record_length(buffer, offset):
+    return int.from_bytes(buffer[offset : offset + 4], "big")
+
+
+def _lbtim(value):
+    return ipp.SplittableInt(int(value), {"ia": slice(2, None), "ib": 1, "ic": 0})
+
+
+class PPHeader(object):
+    """The lookup header of a PP field, held as integer and real words."""
+
+    def __init__(self, ints, reals):
+        object.__setattr__(self, "ints", ints)
+        object.__setattr__(self, "reals", reals)
+        object.__setattr__(self, "lbtim", _lbtim(ints[_LBTIM]))
+
+    def _word(self, offset):
+        if offset < _NUM_INTS:
+            return self.ints[offset]
+        return self.reals[offset - _NUM_INTS]
+
+    def __getattr__(self, name):
+        try:
+            offsets = _OFFSETS[name]
+        except KeyError:
+            raise AttributeError(name)
+        if len(offsets) == 1:
+            return self._word(offsets[0])
+        return tuple(self._word(offset) for offset in offsets)
+
+    def __setattr__(self, name, value):
+        if name == "lbtim":
+            object.__setattr__(self, "lbtim", _lbtim(value))
+            return
+        try:
+            offsets = _OFFSETS[name]
+        except KeyError:
+            raise AttributeError(name)
+        values = [value] if len(offsets) == 1 else value
+        for offset, item in zip(offsets, values):
+            if offset < _NUM_INTS:
+                self.ints[offset] = item
+            else:
+                self.reals[offset - _NUM_INTS] = item
+
+    @property
+    def stash(self):
+        lbuser = self.lbuser
+        return ipp.STASH(lbuser[6], lbuser[3] // 1000, lbuser[3] % 1000)
+
+    def tobytes(self):
+        self.ints[_LBTIM] = int(self.lbtim)
+        return self.ints.astype(">i4").tobytes() + self.reals.astype(">f4").tobytes()
+
+
+def records(buffer):
+    """
+    Yield the header and data record extents of each field of a PP file.
+
+    Parameters
+    ----------
+    buffer : buffer
+        Contents of the PP file, e.g. a :class:`mmap.mmap`.
+
+    Yields
+    ------
+    : tuple(int, int, int)
+        Offset of the header words, offset of the data record (including its
+        length framing) and length in bytes of the data record.
+
+    """
+    offset = 0
+    size = len(buffer)
+    while offset < size:
+        header_length = _record_length(buffer, offset)
+        if header_length != _HEADER_BYTES:
+            raise ValueError(
+                "Unexpected PP header length {} at byte {}, only 32 bit PP "
+                "files are supported.".format(header_length, offset)
+            )
+        data_offset = offset + header_length + 8
+        data_length = _record_length(buffer, data_offset)
+        yield offset + 4, data_offset, data_length + 8
+        offset = data_offset + data_length + 8
+
+
+def read_header(buffer, offset):
+    """Return the :class:`PPHeader` of the header words at the offset."""
+    ints = np.frombuffer(buffer, ">i4", _NUM_INTS, offset).astype(np.int64)
+    reals = np.frombuffer(buffer, ">f4", _NUM_REALS, offset + _NUM_INTS * 4)
+    return PPHeader(ints, reals.astype(np.float64))
+
+
+def headers(filepath):
+    """Return the :class:`PPHeader` of each field of a PP file."""
+    with open(filepath, "rb") as fh, mmap.mmap(
+        fh.fileno(), 0, access=mmap.ACCESS_READ
+    ) as buffer:
+        return [read_header(buffer, offset) for offset, _, _ in records(buffer)]
+
+
+def rewrite(source_filepath, output_filepath, patch=None, select=None):
+    """
+    Copy a PP file with patched headers, without decoding the field data.
+
+    Parameters
+    ----------
+    source_filepath : str
+        PP file to copy.
+    output_filepath : str
+        PP file to write.
+    patch : callable, optional
+        Called with the :class:`PPHeader` of each selected field, to modify
+        it in place.
+    select : callable, optional
+        Called with the :class:`PPHeader` of each field, returning whether
+        the field is copied.  Defaults to all fields.
+
+    Returns
+    -------
+    : list of :class:`PPHeader`
+        The (patched) headers of the fields written.
+
+    """
+    written = []
+    tmp_filepath = "{}.{}.tmp".format(output_filepath, os.getpid())
+    with open(source_filepath, "rb") as fh, mmap.mmap(
+        fh.fileno(), 0, access=mmap.ACCESS_READ
+    ) as buffer, open(tmp_filepath, "wb") as out:
+        framing = _HEADER_BYTES.to_bytes(4, "big")
+        for offset, data_offset, data_length in records(buffer):
+            header = read_header(buffer, offset)
+            if select is not None and not select(header):
+                continue
+            if patch is not None:
+                patch(header)
+            out.write(framing + header.tobytes() + framing)
+            out.write(buffer[data_offset : data_offset + data_length])
+            written.append(header)
+    os.replace(tmp_filepath, output_filepath)
+    return written
+
+
+def _stamp(filepath):
+    status = os.stat(filepath)
+    return np.array([status.st_size, status.st_mtime_ns], dtype=np.int64)
+
+
+def _build_index(filepath):
+    with open(filepath, "rb") as fh, mmap.mmap(
+        fh.fileno(), 0, access=mmap.ACCESS_READ
+    ) as buffer:
+        extents = list(records(buffer))
+        result = np.empty(len(extents), dtype=INDEX_DTYPE)
+        for entry, (offset, data_offset, data_length) in zip(result, extents):
+            header = read_header(buffer, offset)
+            stash = header.stash
+            entry["model"] = stash.model
+            entry["section"] = stash.section
+            entry["item"] = stash.item
+            for name in ["lbyr", "lbmon", "lbdat", "lbhr", "lbmin", "lblev", "blev"]:
+                entry[name] = getattr(header, name)
+            # The whole field, from the framing of its header record to the
+            # end of its data record.
+            entry["offset"] = offset - 4
+            entry["length"] = data_offset + data_length - offset + 4
+    return result
+
+
+def index(filepath):
+    """
+    Return the lookup index of a PP file, building it if needed.
+
+    Parameters
+    ----------
+    filepath : str
+        PP file.
+
+    Returns
+    -------
+    : :class:`numpy.ndarray`
+        Structured array of :data:`INDEX_DTYPE`, one entry per field in file
+        order.
+
+    """
+    stamp = _stamp(filepath)
+    sidecar = filepath + ".idx"
+    try:
+        with np.load(sidecar) as cached:
+            if np.array_equal(cached["stamp"], stamp):
+                return cached["index"]
+    except (OSError, ValueError, KeyError):
+        pass
+    cached = cache.load("pp_index", cache.file_stamp(filepath))
+    if cached is not None:
+        return cached["index"]
+
+    result = _build_index(filepath)
+    tmp_sidecar = "{}.{}.tmp".format(sidecar, os.getpid())
+    try:
+        with open(tmp_sidecar, "wb") as fh:
+            np.savez(fh, index=result, stamp=stamp)
+        os.replace(tmp_sidecar, sidecar)
+    except OSError:
+        cache.save("pp_index", cache.file_stamp(filepath), index=result)
+    return result
+
+
+def find(filepath, stash_codes):
+    """
+    Return the index entries of the fields of a PP file with the STASH codes.
+
+    Parameters
+    ----------
+    filepath : str
+        PP file.
+    stash_codes : list of :class:`iris.fileformats.pp.STASH`
+
+    Returns
+    -------
+    : :class:`numpy.ndarray`
+        Entries of the :func:`index`, in file order.
+
+    """
+    entries = index(filepath)
+    selected = np.zeros(entries.size, dtype=bool)
+    for stash in stash_codes:
+        selected |= (
+            (entries["model"] == stash.model)
+            & (entries["section"] == stash.section)
+            & (entries["item"] == stash.item)
+        )
+    return entries[selected]
+
+
+@contextlib.contextmanager
+def subset(filepath, stash_codes):
+    """
+    Yield a temporary PP file holding only the fields with the STASH codes.
+
+    The fields are found from the :func:`index` and copied byte for byte by
+    direct seeks.  The temporary file is removed on exit, so any fields
+    loaded from it must have their data realised within the context.
+
+    Parameters
+    ----------
+    filepath : str
+        PP file.
+    stash_codes : list of :class:`iris.fileformats.pp.STASH`
+
+    """
+    entries = find(filepath, stash_codes)
+    fd, subset_filepath = tempfile.mkstemp(suffix=".pp")
+    try:
+        with os.fdopen(fd, "wb") as out, open(filepath, "rb") as fh:
+            for entry in entries:
+                fh.seek(int(entry["offset"]))
+                out.write(fh.read(int(entry["length"])))
+        yield subset_filepath
+    finally:
+        os.remove(subset_filepath)
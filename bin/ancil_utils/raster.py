@@ -0,0 +1,166 @@
+# (C) Crown Copyright, Met Office. All rights reserved.
+#
+# This file is part of ANTS and is released under the BSD 3-Clause license.
+# See LICENSE.txt in the root of the repository for full licensing details.
+"""
+Polygon rasterisation
+*********************
+
+Rasterise shapely (multi)polygons to a boolean mask on a regular lat-lon grid
+with a vectorised scanline algorithm, rather than testing every grid cell
+against the geometry.
+
+A grid cell is inside the polygon when its centre is, by the even-odd rule
+(so holes are honoured).  Every polygon edge is intersected with the grid rows
+it spans, the crossings are sorted along each row and the cells between
+alternate pairs of crossings are filled, as a boolean parity accumulated along
+each row.  Longitudes are compared in the -180 to 180 range of the polygon.
+
+"""
+import ants.utils
+import iris
+import numpy as np
+
+from . import cache
+
+
+def _rings(geometry):
+    polygons = getattr(geometry, "geoms", [geometry])
+    for polygon in polygons:
+        yield polygon.exterior
+        for interior in polygon.interiors:
+            yield interior
+
+
+def _edges(geometry):
+    starts = []
+    ends = []
+    for ring in _rings(geometry):
+        xy = np.asarray(ring.coords)[:, :2]
+        starts.append(xy[:-1])
+        ends.append(xy[1:])
+    return np.concatenate(starts), np.concatenate(ends)
+
+
+def rasterise(geometry, x_points, y_points):
+    """
+    Return the mask of grid cell centres inside a polygon.
+
+    Parameters
+    ----------
+    geometry : :class:`shapely.geometry.Polygon` or \
+:class:`shapely.geometry.MultiPolygon`
+        Polygon in longitude/latitude.
+    x_points : :class:`numpy.ndarray`
+        Longitudes of the grid columns, in any range or order.
+    y_points : :class:`numpy.ndarray`
+        Latitudes of the grid rows, in any order.
+
+    Returns
+    -------
+    : :class:`numpy.ndarray`
+        Boolean mask of shape (len(y_points), len(x_points)).
+
+    """
+    x_wrapped = ((np.asarray(x_points) + 180.0) % 360.0) - 180.0
+    x_order = np.argsort(x_wrapped, kind="stable")
+    x_sorted = x_wrapped[x_order]
+    y_points = np.asarray(y_points)
+    y_order = np.argsort(y_points, kind="stable")
+    y_sorted = y_points[y_order]
+
+    start, end = _edges(geometry)
+    lo = np.minimum(start[:, 1], end[:, 1])
+    hi = np.maximum(start[:, 1], end[:, 1])
+    # Rows crossed by each edge, half open in y so vertices count once.
+    row_start = np.searchsorted(y_sorted, lo, side="left")
+    row_end = np.searchsorted(y_sorted, hi, side="left")
+    counts = row_end - row_start
+    edge = np.repeat(np.arange(start.shape[0]), counts)
+    rows = np.repeat(row_start - np.cumsum(counts) + counts, counts) + np.arange(
+        counts.sum()
+    )
+    x0, y0 = start[edge, 0], start[edge, 1]
+    x1, y1 = end[edge, 0], end[edge, 1]
+    crossing = x0 + (y_sorted[rows] - y0) * (x1 - x0) / (y1 - y0)
+
+    # Sort the crossings by row then longitude and fill between pairs.
+    order = np.lexsort((crossing, rows))
+    rows = rows[order]
+    cols = np.searchsorted(x_sorted, crossing[order], side="left")
+    # Each crossing toggles the even-odd parity from its column on, held as
+    # one byte per cell and accumulated in place.
+    parity = np.zeros((y_sorted.size, x_sorted.size + 1), dtype=bool)
+    np.logical_xor.at(parity, (rows, cols), True)
+    np.logical_xor.accumulate(parity, axis=1, out=parity)
+    inside_sorted = parity[:, :-1]
+
+    inside = np.empty_like(inside_sorted)
+    inside[np.ix_(y_order, x_order)] = inside_sorted
+    return inside
+
+
+def polygon_mask(geometry, polygon_filepath, cube):
+    """
+    Return the rasterised polygon on the grid of the cube, cached on disk.
+
+    The cache is keyed by the hash of the polygon file and of the grid.
+
+    Parameters
+    ----------
+    geometry : :class:`shapely.geometry.Polygon` or \
+:class:`shapely.geometry.MultiPolygon`
+        Polygon read from `polygon_filepath`.
+    polygon_filepath : str
+        Shapefile the polygon was read from.
+    cube : :class:`~iris.cube.Cube`
+        Cube on a regular lat-lon grid.
+
+    Returns
+    -------
+    : :class:`numpy.ndarray`
+        Boolean mask over the horizontal grid, True inside the polygon.
+
+    """
+    keys = (cache.file_hash(polygon_filepath), cache.grid_hash(cube))
+    cached = cache.load("polygon_mask", *keys)
+    if cached is not None:
+        return cached["mask"]
+    x_coord = cube.coord(axis="x", dim_coords=True)
+    y_coord = cube.coord(axis="y", dim_coords=True)
+    mask = rasterise(
+        geometry,
+        x_coord.units.convert(x_coord.points, "degrees"),
+        y_coord.units.convert(y_coord.points, "degrees"),
+    )
+    cache.save("polygon_mask", *keys, mask=mask)
+    return mask
+
+
+def is_lat_lon(cube):
+    """Whether the cube is on a grid :func:`polygon_mask` supports."""
+    x_coord = cube.coord(axis="x", dim_coords=True)
+    return not isinstance(x_coord.coord_system, iris.coord_systems.RotatedGeogCS)
+
+
+def mask_outside(cubes, geometry, polygon_filepath):
+    """
+    Mask the cubes outside the polygon, in place.
+
+    Parameters
+    ----------
+    cubes : :class:`~iris.cube.Cube` or :class:`~iris.cube.CubeList`
+        Cubes with the horizontal grid as their last two dimensions.
+    geometry : :class:`shapely.geometry.Polygon` or \
+:class:`shapely.geometry.MultiPolygon`
+        Polygon read from `polygon_filepath`.
+    polygon_filepath : str
+        Shapefile the polygon was read from.
+
+    """
+    for cube in ants.utils.cube.as_cubelist(cubes):
+        inside = polygon_mask(geometry, polygon_filepath, cube)
+        data = np.ma.array(cube.data, copy=False)
+        cube.data = np.ma.array(
+            np.ma.getdata(data), mask=np.ma.getmaskarray(data) | ~inside, copy=False
+        )
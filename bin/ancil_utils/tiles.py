@@ -0,0 +1,138 @@
+# (C) Crown Copyright, Met Office. All rights reserved.
+#
+# This file is part of ANTS and is released under the BSD 3-Clause license.
+# See LICENSE.txt in the root of the repository for full licensing details.
+"""
+Missing data tiles
+******************
+
+Restrict an operation patching missing data (e.g. merging an alternate
+source) to the tiles of the grid which actually have missing data.
+
+The grid is divided into tiles of a fixed shape, and a boolean tile index
+records which tiles have any missing (masked) data.  The index is computed in
+one streaming pass over bands of rows, so that lazy data is never held in
+memory whole, and can be cached on disk keyed by the source file (see
+:mod:`ancil_utils.cache`).  Fully valid tiles are then skipped entirely.
+
+"""
+import numpy as np
+
+from . import cache
+
+TILE_SHAPE = (1024, 1024)
+
+
+def _tile_any(mask, tile_shape):
+    """Return whether each tile of a 2D boolean array has any True value."""
+    ny, nx = mask.shape
+    ty, tx = tile_shape
+    nty = -(-ny // ty)
+    ntx = -(-nx // tx)
+    padded = np.zeros((nty * ty, ntx * tx), dtype=bool)
+    padded[:ny, :nx] = mask
+    return padded.reshape(nty, ty, ntx, tx).any(axis=(1, 3))
+
+
+def missing_tile_index(cube, tile_shape=TILE_SHAPE, source_filepath=None):
+    """
+    Return which tiles of a 2D cube have missing data.
+
+    Parameters
+    ----------
+    cube : :class:`~iris.cube.Cube`
+        2D cube, with 'y' as its first dimension.  Lazy data is read a band
+        of tile rows at a time.
+    tile_shape : tuple(int, int), optional
+        Shape of the tiles.
+    source_filepath : str, optional
+        File the cube was loaded from, to cache the index on disk.
+
+    Returns
+    -------
+    : :class:`numpy.ndarray`
+        Boolean array of shape (ceil(ny / tile rows), ceil(nx / tile
+        columns)), True for tiles with missing data.
+
+    """
+    keys = None
+    if source_filepath is not None:
+        keys = (cache.file_stamp(source_filepath), "{}x{}".format(*tile_shape))
+        cached = cache.load("missing_tiles", *keys)
+        if cached is not None:
+            return cached["index"]
+
+    tile_rows = tile_shape[0]
+    bands = []
+    for start in range(0, cube.shape[0], tile_rows):
+        data = cube[start : start + tile_rows].data
+        bands.append(_tile_any(np.ma.getmaskarray(data), tile_shape))
+    index = np.concatenate(bands, axis=0)
+
+    if keys is not None:
+        cache.save("missing_tiles", *keys, index=index)
+    return index
+
+
+def missing_tiles(tile_index, tile_shape, rows):
+    """
+    Yield the (rows, columns) slices of the tiles with missing data in a band.
+
+    Parameters
+    ----------
+    tile_index : :class:`numpy.ndarray`
+        See :func:`missing_tile_index`.
+    tile_shape : tuple(int, int)
+        Shape of the tiles of the index.
+    rows : slice
+        Band of rows of the grid (with a start and stop).  The slices yielded
+        are relative to the band, and clipped to it.
+
+    """
+    ty, tx = tile_shape
+    first = rows.start // ty
+    last = -(-rows.stop // ty)
+    for tile_row, tile_col in zip(*np.nonzero(tile_index[first:last])):
+        tile_row += first
+        start = max(tile_row * ty, rows.start)
+        stop = min((tile_row + 1) * ty, rows.stop)
+        yield (
+            slice(start - rows.start, stop - rows.start),
+            slice(tile_col * tx, (tile_col + 1) * tx),
+        )
+
+
+def merge_missing_tiles(cube, alternate, merge, tile_index, tile_shape, rows=None):
+    """
+    Merge an alternate source into the tiles of a cube with missing data.
+
+    Parameters
+    ----------
+    cube : :class:`~iris.cube.Cube`
+        2D cube, with 'y' as its first dimension.  Its data is realised.
+    alternate : :class:`~iris.cube.Cube`
+        Alternate source.
+    merge : callable
+        ``merge(cube, alternate)`` returning `cube` with missing data merged
+        from `alternate`, e.g. :func:`proc_ants.lct_preproc_cci.merge_igbp`.
+    tile_index : :class:`numpy.ndarray`
+        See :func:`missing_tile_index`.
+    tile_shape : tuple(int, int)
+        Shape of the tiles of the index.
+    rows : slice, optional
+        Rows of the indexed grid which `cube` covers, if only a band of it.
+
+    Returns
+    -------
+    : :class:`~iris.cube.Cube`
+        The cube, with its data merged in place.
+
+    """
+    if rows is None:
+        rows = slice(0, cube.shape[0])
+    data = cube.data
+    for tile in missing_tiles(tile_index, tile_shape, rows):
+        merged = merge(cube[tile], alternate)
+        data[tile] = merged.data
+    cube.data = data
+    return cube
@@ -0,0 +1,341 @@
+# (C) Crown Copyright, Met Office. All rights reserved.
+#
+# This file is part of ANTS and is released under the BSD 3-Clause license.
+# See LICENSE.txt in the root of the repository for full licensing details.
+"""
+Cached area weights
+*******************
+
+Area weighted mean regridding between regular lat-lon grids, with the
+weights computed once per pair of grids and cached on disk (see
+:mod:`ancil_utils.cache`).
+
+The area of overlap between a source and a target cell on the sphere is
+separable into a latitude term (the overlap in the sine of latitude) and a
+longitude term (the overlap in longitude, modulo 360, so that regional grids
+on different longitude conventions overlap as they should).  The weights are
+therefore held as two sparse matrices, of shape (target rows, source rows)
+and (target columns, source columns), and a field is regridded with two
+sparse matrix products::
+
+    mean = (Wy @ (field * valid) @ Wx.T) / (Wy @ valid @ Wx.T)
+
+where `valid` is 1 at unmasked source points.  Target cells overlapping no
+valid source point are masked.  A stack of fields (e.g. the months of a
+climatology) is regridded with the same two products, applied to the whole
+stack at once.
+
+"""
+import iris
+import numpy as np
+import scipy.sparse
+
+from . import cache
+
+# Number of target cells for which overlaps are computed at a time.
+_CHUNK = 64
+
+
+def _bounds(coord):
+    if not coord.has_bounds():
+        coord = coord.copy()
+        coord.guess_bounds()
+    bounds = coord.units.convert(coord.bounds, "degrees")
+    return np.sort(bounds, axis=1)
+
+
+def overlap_matrix(target_bounds, source_bounds, circular=False):
+    """
+    Return the overlap lengths of target and source intervals.
+
+    Longitudes are always to be compared `circular`, whatever their extent,
+    as source and target may be on different conventions (e.g. 0 to 360 and
+    -180 to 180).
+
+    Parameters
+    ----------
+    target_bounds : :class:`numpy.ndarray`
+        Target interval bounds, of shape (n, 2).
+    source_bounds : :class:`numpy.ndarray`
+        Source interval bounds, of shape (m, 2).
+    circular : bool, optional
+        Whether the intervals are longitudes, overlapping modulo 360.
+
+    Returns
+    -------
+    : :class:`scipy.sparse.csr_matrix`
+        Matrix of shape (n, m).
+
+    """
+    shifts = [-360.0, 0.0, 360.0] if circular else [0.0]
+    if circular:
+        # Bring the source into the range of the target, so that single
+        # shifts either way cover all overlaps.
+        offset = np.floor((source_bounds[:, :1] - target_bounds[0, 0]) / 360.0)
+        source_bounds = source_bounds - offset * 360.0
+    blocks = []
+    for start in range(0, target_bounds.shape[0], _CHUNK):
+        lower = target_bounds[start : start + _CHUNK, :1]
+        upper = target_bounds[start : start + _CHUNK, 1:]
+        overlap = 0
+        for shift in shifts:
+            overlap = overlap + np.clip(
+                np.minimum(upper, source_bounds[:, 1] + shift)
+                - np.maximum(lower, source_bounds[:, 0] + shift),
+                0,
+                None,
+            )
+        blocks.append(scipy.sparse.csr_matrix(overlap))
+    return scipy.sparse.vstack(blocks).tocsr()
+
+
+def _horizontal_coords(cube):
+    y_coord = cube.coord(axis="y", dim_coords=True)
+    x_coord = cube.coord(axis="x", dim_coords=True)
+    if cube.coord_dims(y_coord)[0] != cube.ndim - 2:
+        raise ValueError("Expecting the horizontal grid as the last two dimensions.")
+    return y_coord, x_coord
+
+
+def _to_arrays(matrix):
+    return {
+        "data": matrix.data,
+        "indices": matrix.indices,
+        "indptr": matrix.indptr,
+        "shape": np.array(matrix.shape),
+    }
+
+
+def _from_arrays(arrays, prefix):
+    return scipy.sparse.csr_matrix(
+        (
+            arrays[prefix + "data"],
+            arrays[prefix + "indices"],
+            arrays[prefix + "indptr"],
+        ),
+        shape=tuple(arrays[prefix + "shape"]),
+    )
+
+
+class AreaWeights(object):
+    """
+    Area weights between a source and a target regular lat-lon grid.
+
+    """
+
+    def __init__(self, source, target, use_cache=True):
+        """
+        Parameters
+        ----------
+        source : :class:`~iris.cube.Cube`
+            Cube on the source grid.
+        target : :class:`~iris.cube.Cube`
+            Cube on the target grid.
+        use_cache : bool, optional
+            Whether to read and write the weights from the on-disk cache.
+
+        """
+        src_y, src_x = _horizontal_coords(source)
+        tgt_y, tgt_x = _horizontal_coords(target)
+        self._target_coords = (tgt_y, tgt_x)
+        keys = (cache.grid_hash(source), cache.grid_hash(target))
+        cached = cache.load("area_weights", *keys) if use_cache else None
+        if cached is not None:
+            self.y_weights = _from_arrays(cached, "y_")
+            self.x_weights = _from_arrays(cached, "x_")
+            return
+
+        sine = np.sin(np.deg2rad(np.clip(_bounds(src_y), -90, 90)))
+        target_sine = np.sin(np.deg2rad(np.clip(_bounds(tgt_y), -90, 90)))
+        self.y_weights = overlap_matrix(target_sine, sine)
+        self.x_weights = overlap_matrix(_bounds(tgt_x), _bounds(src_x), circular=True)
+        if src_x.circular:
+            # A global source covers every target column.
+            uncovered = np.flatnonzero(self.x_weights.getnnz(axis=1) == 0)
+            if uncovered.size:
+                raise ValueError(
+                    "{} target columns overlap no column of the global source, "
+                    "e.g. at longitude {}.".format(
+                        uncovered.size, tgt_x.points[uncovered[0]]
+                    )
+                )
+        if use_cache:
+            arrays = {}
+            for prefix, matrix in [("y_", self.y_weights), ("x_", self.x_weights)]:
+                for name, array in _to_arrays(matrix).items():
+                    arrays[prefix + name] = array
+            cache.save("area_weights", *keys, **arrays)
+
+    def _apply(self, fields):
+        # Apply the weights to a stack of fields of shape (n, y, x), as one
+        # sparse product along each of x and y.
+        nfields, ny, nx = fields.shape
+        result = (self.x_weights @ fields.reshape(nfields * ny, nx).T).T
+        result = result.reshape(nfields, ny, -1).transpose(1, 0, 2)
+        result = self.y_weights @ result.reshape(ny, -1)
+        return result.reshape(result.shape[0], nfields, -1).transpose(1, 0, 2)
+
+    def _fields(self, data):
+        # Stack of fields of shape (n, y, x) with invalid points set to 0,
+        # and the stack of their valid points (a single field if shared).
+        values = np.ma.getdata(data).astype(np.float64)
+        invalid = np.ma.getmaskarray(data) | np.isnan(values)
+        values[invalid] = 0
+        valid = (~invalid).astype(np.float64)
+        fields = values.reshape((-1,) + values.shape[-2:])
+        valids = valid.reshape(fields.shape)
+        # The valid points are shared by all fields in the common case (e.g.
+        # the months of a climatology), so are only regridded once.
+        if (valids == valids[:1]).all():
+            valids = valids[:1]
+        return fields, valids
+
+    def _result_data(self, result, total, shape):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            result = result / total
+        result = np.ma.masked_where(np.broadcast_to(total <= 0, result.shape), result)
+        return result.reshape(shape[:-2] + result.shape[-2:])
+
+    def regrid_data(self, data):
+        """
+        Return the area weighted mean of source data on the target grid.
+
+        Parameters
+        ----------
+        data : :class:`numpy.ndarray`
+            Source data, with the horizontal grid as its last two dimensions.
+            Masked and NaN points are ignored.
+
+        Returns
+        -------
+        : :class:`numpy.ma.MaskedArray`
+
+        """
+        fields, valids = self._fields(data)
+        result = self._apply(fields)
+        total = self._apply(valids)
+        return self._result_data(result, total, data.shape)
+
+    def moments_data(self, data):
+        """
+        Return the area weighted mean and standard deviation of source data.
+
+        Both are derived from a single pass over the source, accumulating the
+        weight totals, weighted sums and weighted sums of squares together.
+        The sums are of the data less a shift (the mean of the valid source
+        points), so that the variance does not suffer from cancellation where
+        the spread of the data is small relative to its magnitude.
+
+        Parameters
+        ----------
+        data : :class:`numpy.ndarray`
+            Source data, with the horizontal grid as its last two dimensions.
+            Masked and NaN points are ignored.
+
+        Returns
+        -------
+        : tuple(:class:`numpy.ma.MaskedArray`, :class:`numpy.ma.MaskedArray`)
+            The mean and (population) standard deviation on the target grid.
+
+        """
+        fields, valids = self._fields(data)
+        nfields = fields.shape[0]
+        counts = valids.sum(axis=(1, 2))
+        shift = fields.sum(axis=(1, 2)) / np.maximum(counts, 1)
+        shift = shift[:, np.newaxis, np.newaxis]
+        shifted = (fields - shift) * valids
+        sums = self._apply(np.concatenate([valids, shifted, shifted * shifted]))
+        nvalids = valids.shape[0]
+        total = sums[:nvalids]
+        first = sums[nvalids : nvalids + nfields]
+        second = sums[nvalids + nfields :]
+        mean = self._result_data(first + shift * total, total, data.shape)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            offset = first / total
+            variance = np.maximum(second / total - offset * offset, 0)
+        stdev = np.ma.array(
+            np.sqrt(variance).reshape(mean.shape), mask=np.ma.getmaskarray(mean)
+        )
+        return mean, stdev
+
+    def _result_cube(self, cube, data):
+        if data.dtype != cube.dtype and cube.dtype.kind == "f":
+            data = data.astype(cube.dtype)
+        result = iris.cube.Cube(data)
+        result.metadata = cube.metadata
+        # Coordinates not spanning the horizontal grid (e.g. time) are kept.
+        horizontal = {cube.ndim - 2, cube.ndim - 1}
+        for coord in cube.dim_coords:
+            dims = cube.coord_dims(coord)
+            if not horizontal.intersection(dims):
+                result.add_dim_coord(coord.copy(), dims)
+        for coord in cube.aux_coords:
+            dims = cube.coord_dims(coord)
+            if not horizontal.intersection(dims):
+                result.add_aux_coord(coord.copy(), dims)
+        y_coord, x_coord = self._target_coords
+        result.add_dim_coord(y_coord.copy(), cube.ndim - 2)
+        result.add_dim_coord(x_coord.copy(), cube.ndim - 1)
+        return result
+
+    def regrid(self, cube):
+        """
+        Return the area weighted mean of a source cube on the target grid.
+
+        Parameters
+        ----------
+        cube : :class:`~iris.cube.Cube`
+            Source cube, with the horizontal grid as its last two dimensions.
+
+        Returns
+        -------
+        : :class:`~iris.cube.Cube`
+
+        """
+        return self._result_cube(cube, self.regrid_data(cube.data))
+
+    def moments(self, cube):
+        """
+        Return the area weighted mean and standard deviation of a source cube.
+
+        See :meth:`moments_data`.
+
+        Parameters
+        ----------
+        cube : :class:`~iris.cube.Cube`
+            Source cube, with the horizontal grid as its last two dimensions.
+
+        Returns
+        -------
+        : tuple(:class:`~iris.cube.Cube`, :class:`~iris.cube.Cube`)
+            The mean and standard deviation cubes on the target grid, with
+            the metadata of the source.
+
+        """
+        mean, stdev = self.moments_data(cube.data)
+        return self._result_cube(cube, mean), self._result_cube(cube, stdev)
+
+
+def is_lat_lon(cube):
+    """Whether the cube is on a grid :class:`AreaWeights` supports."""
+    x_coord = cube.coord(axis="x", dim_coords=True)
+    return not isinstance(x_coord.coord_system, iris.coord_systems.RotatedGeogCS)
+
+
+def area_weighted_mean(source, target):
+    """
+    Cached equivalent of :func:`ants.analysis.mean` for regular lat-lon grids.
+
+    Parameters
+    ----------
+    source : :class:`~iris.cube.Cube`
+        Source cube, with the horizontal grid as its last two dimensions.
+    target : :class:`~iris.cube.Cube`
+        Cube defining the target grid.
+
+    Returns
+    -------
+    : :class:`~iris.cube.Cube`
+
+    """
+    return AreaWeights(source, target).regrid(source)
@@ -1,13 +1,24 @@
-# code to produce initial SM ancillaries 
+# code to produce initial SM ancillaries
 # In the METUM, soil moisture content is converted into SM STRESS.
 # SM stress is then linearly-interpolated. Then regridded SM STRESS is converted back to SMC.
 # After conversion back to SMC, there are additional checks including is SM below 0.1*SMwilt.
+#
+# Several target domains (e.g. nested 4.4km and 1.5km) can be regridded from the same source in one run:
+#   python generate_weights_landsea_gridding.py SM_stress_infile land_mask_1 outfile_1 [land_mask_2 outfile_2 ...]
+# The source SM stress is only read once and shared between all targets. The next land mask is read and the
+# previous result written in the background while the current target is regridded.
+# Targets may be on rotated-pole (LAM) grids. The true lat/lon of each target grid, its bounding box (used to only
+# regrid the covering part of the source) and the bilinear weights are computed once and cached (see smc_grid.py).
+import hashlib
+import os
 import iris
 import xarray as xr
 import matplotlib.pyplot as plt
 import numpy as np
-import xesmf as xe 
+import xesmf as xe
 import sys
+from smc_io import prefetch, BackgroundWriter, io_lock
+import smc_grid
 
 def find_nearest_index(array, value):
     array = np.asarray(array)
@@ -16,63 +27,120 @@ def find_nearest_index(array, value):
 
 main_directory = '/gws/nopw/j04/nzplus/3C/task_2/jostal/TJ_idealised_study/MO_SM_start_files/'
 
-SM_stress_infile = sys.argv[1]
-land_mask_infile = sys.argv[2]
-regridded_SM_stress_outfile = sys.argv[3]
-
-SM_stress_n1280 = xr.open_dataset(SM_stress_infile)["moisture_content_of_soil_layer"]
-land_mask_4p4km = xr.DataArray.from_iris(iris.load_cube(land_mask_infile))
-
-# get surface field
-SM_stress_n1280_sfc = SM_stress_n1280[0]
-
-# compute non-masked regridder
-regridder = xe.Regridder(SM_stress_n1280_sfc, land_mask_4p4km,"bilinear")
-SM_regrid = regridder(SM_stress_n1280_sfc)
-
-# find where value is extremely high. greater than 1000.0
-# loop through regridder, take max weight until no more np.nans.
-# first set weights to be indexed (500000,4)
-initial_regridded_weights_reshaped = regridder.weights.data.data.reshape(regridder.weights['out_dim'].shape[0],4)
-
-# loop though field
-# loop four times - each time taking next highest weight
-# initialise a new regridded_weights field
-regridded_weights_reshaped = initial_regridded_weights_reshaped.copy()
-for max_i in np.arange(4):
-    # flatten SM values
-    SM_regrid_flattened = SM_regrid.data.flatten()
-    # find points where regridded SM is exceptionally large
-    mask_above_1000 = SM_regrid_flattened>1000.0
-    print (np.count_nonzero(mask_above_1000))    
-
-    # loop through these points and make maximum value = 1.0
-    for gp in np.arange(regridder.weights['out_dim'].shape[0]):
-        if mask_above_1000[gp] == True:
-            
-            regrid_weights = initial_regridded_weights_reshaped[gp]
-            # find maximum of attempt, i.e. on second attempt find second maximum
-            max_index = find_nearest_index(regrid_weights,np.sort(regrid_weights)[::-1][max_i])
-            # only set largest index to 1.0
-            new_regrid_weights = np.zeros(4)
-            new_regrid_weights[max_index] = 1.0
-            regridded_weights_reshaped[gp] = new_regrid_weights
-            if gp == 499709:
-                print (regrid_weights)
-                print (max_index)
-                print (new_regrid_weights)
-                print (regridded_weights_reshaped[gp])
-    # flatten new regridded weights and replace regrider values
-    new_regridder_weights = regridded_weights_reshaped.flatten()
-    regridder.weights.data.data = new_regridder_weights
-    SM_regrid = regridder(SM_stress_n1280_sfc)
-
-# loop through four depths than combine and save
-SM_list = []
-for depth in np.arange(4):
-    SM_list.append(regridder(SM_stress_n1280[depth]))
-
-SM_regridded_4p4km_cadj = xr.concat(SM_list,dim='depth')
-SM_regridded_4p4km_cadj.name = 'moisture_content_of_soil_layer'
-
-iris.save(SM_regridded_4p4km_cadj.to_iris(),regridded_SM_stress_outfile)
+def load_SM_stress(SM_stress_infile):
+    ''' load SM stress into memory once so it can be shared between all target grids'''
+    SM_stress = xr.open_dataset(SM_stress_infile)["moisture_content_of_soil_layer"]
+    return SM_stress.load()
+
+def load_land_mask(land_mask_infile):
+    land_mask = iris.load_cube(land_mask_infile)
+    land_mask.data
+    return land_mask
+
+def source_region(SM_stress, land_mask):
+    ''' part of the source covering the target grid, plus two source grid lengths for the bilinear stencil'''
+    lat, lon, bbox = smc_grid.cached_grid(land_mask)
+    margin = 2.0*max(np.abs(np.diff(SM_stress.latitude.values[:2]))[0], np.abs(np.diff(SM_stress.longitude.values[:2]))[0])
+    lat_min, lat_max, lon_min, lon_max = smc_grid.lat_lon_bounds(lat, lon, margin)
+    in_region = (SM_stress.latitude >= lat_min) & (SM_stress.latitude <= lat_max)
+    SM_stress = SM_stress.isel(latitude=in_region.values)
+    # keep all longitudes if the target crosses the dateline, rather than splitting the source in two
+    if lon_min <= lon_max:
+        # put the source on -180 to 180 longitudes first, so that the kept columns are contiguous and monotonic
+        # (a 0 to 360 source cropped to a target spanning Greenwich would otherwise keep two separate pieces)
+        longitude = ((SM_stress.longitude + 180.0) % 360.0) - 180.0
+        SM_stress = SM_stress.assign_coords(longitude=longitude).sortby('longitude')
+        in_region = (SM_stress.longitude >= lon_min) & (SM_stress.longitude <= lon_max)
+        SM_stress = SM_stress.isel(longitude=in_region.values)
+    return SM_stress
+
+def target_grid(land_mask):
+    ''' xesmf target: the land mask itself on lat/lon grids, 2-D true lat/lon on rotated-pole grids'''
+    if not smc_grid.is_rotated(land_mask):
+        return xr.DataArray.from_iris(land_mask)
+    lat, lon, bbox = smc_grid.cached_grid(land_mask)
+    return xr.Dataset(coords={'lat': (('y','x'), lat), 'lon': (('y','x'), lon)})
+
+def weights_file(SM_stress_sfc, land_mask):
+    source_key = hashlib.sha1(np.ascontiguousarray(SM_stress_sfc.latitude.values, dtype='f8').tobytes()+np.ascontiguousarray(SM_stress_sfc.longitude.values, dtype='f8').tobytes()).hexdigest()[:16]
+    return os.path.join(smc_grid.cache_directory, source_key+'_'+smc_grid.grid_key(land_mask)+'_bilinear.nc')
+
+def coastal_regridder(SM_stress_sfc, land_mask):
+    ''' bilinear regridder where fine land points interpolated from coarse ocean points take the nearest land weight'''
+    # compute non-masked regridder, reusing cached weights for this source/target grid pair
+    weights_filename = weights_file(SM_stress_sfc, land_mask)
+    os.makedirs(smc_grid.cache_directory, exist_ok=True)
+    # the weights file is netCDF, read and written under the lock shared with the background writer
+    with io_lock:
+        reuse_weights = os.path.exists(weights_filename)
+        regridder = xe.Regridder(SM_stress_sfc, target_grid(land_mask),"bilinear",filename=weights_filename,reuse_weights=reuse_weights)
+        if not reuse_weights:
+            # xesmf only writes the weights when asked to; write then rename (before they are modified below),
+            # so a concurrent job never reads a partial file
+            regridder.to_netcdf(weights_filename+'.tmp')
+            os.replace(weights_filename+'.tmp', weights_filename)
+    SM_regrid = regridder(SM_stress_sfc)
+
+    # find where value is extremely high. greater than 1000.0
+    # loop through regridder, take max weight until no more np.nans.
+    # first set weights to be indexed (500000,4)
+    initial_regridded_weights_reshaped = regridder.weights.data.data.reshape(regridder.weights['out_dim'].shape[0],4)
+
+    # loop though field
+    # loop four times - each time taking next highest weight
+    # initialise a new regridded_weights field
+    regridded_weights_reshaped = initial_regridded_weights_reshaped.copy()
+    for max_i in np.arange(4):
+        # flatten SM values
+        SM_regrid_flattened = SM_regrid.data.flatten()
+        # find points where regridded SM is exceptionally large
+        mask_above_1000 = SM_regrid_flattened>1000.0
+        print (np.count_nonzero(mask_above_1000))
+
+        # loop through these points and make maximum value = 1.0
+        for gp in np.arange(regridder.weights['out_dim'].shape[0]):
+            if mask_above_1000[gp] == True:
+
+                regrid_weights = initial_regridded_weights_reshaped[gp]
+                # find maximum of attempt, i.e. on second attempt find second maximum
+                max_index = find_nearest_index(regrid_weights,np.sort(regrid_weights)[::-1][max_i])
+                # only set largest index to 1.0
+                new_regrid_weights = np.zeros(4)
+                new_regrid_weights[max_index] = 1.0
+                regridded_weights_reshaped[gp] = new_regrid_weights
+        # flatten new regridded weights and replace regrider values
+        new_regridder_weights = regridded_weights_reshaped.flatten()
+        regridder.weights.data.data = new_regridder_weights
+        SM_regrid = regridder(SM_stress_sfc)
+    return regridder
+
+def regrid_SM_stress(SM_stress, regridder, land_mask):
+    # loop through four depths than combine
+    SM_list = []
+    for depth in np.arange(4):
+        SM_list.append(regridder(SM_stress[depth]))
+
+    SM_regridded_cadj = xr.concat(SM_list,dim='depth')
+    SM_regridded_cadj.name = 'moisture_content_of_soil_layer'
+    SM_regridded_cadj = SM_regridded_cadj.to_iris()
+    # on rotated grids, put the result on the land mask's own coordinates rather than 2-D true lat/lon
+    if smc_grid.is_rotated(land_mask):
+        smc_grid.set_horizontal_grid(SM_regridded_cadj, land_mask)
+    return SM_regridded_cadj
+
+if __name__ == '__main__':
+    SM_stress_infile = sys.argv[1]
+    targets = sys.argv[2:]
+    if len(targets) == 0 or len(targets) % 2 != 0:
+        sys.exit('usage: generate_weights_landsea_gridding.py SM_stress_infile land_mask outfile [land_mask outfile ...]')
+
+    # read source SM stress once, shared by every target grid
+    SM_stress_n1280 = load_SM_stress(SM_stress_infile)
+
+    targets = list(zip(targets[0::2], targets[1::2]))
+    with BackgroundWriter() as writer:
+        for (land_mask_infile, regridded_SM_stress_outfile), land_mask in prefetch(lambda target: load_land_mask(target[0]), targets):
+            print ('regridding to '+land_mask_infile)
+            SM_stress_region = source_region(SM_stress_n1280, land_mask)
+            regridder = coastal_regridder(SM_stress_region[0], land_mask)
+            writer.submit(iris.save,regrid_SM_stress(SM_stress_region, regridder, land_mask),regridded_SM_stress_outfile)
@@ -0,0 +1,89 @@
+# grid helpers for the soil moisture regridding scripts, with native support for rotated-pole (LAM) grids.
+# The true latitude/longitude of every point of a grid, and its bounding box, are computed once per grid and
+# cached on disk (alongside the regridding weights), so later runs on the same domain skip the transform.
+import hashlib
+import os
+import iris
+import numpy as np
+from iris.analysis.cartography import unrotate_pole
+
+# cached grids and regridding weights. Override with the SMC_REGRID_CACHE environment variable.
+cache_directory = os.environ.get('SMC_REGRID_CACHE', 'smc_regrid_cache')
+
+def horizontal_coords(cube):
+    return cube.coord(axis='y', dim_coords=True), cube.coord(axis='x', dim_coords=True)
+
+def is_rotated(cube):
+    return isinstance(horizontal_coords(cube)[1].coord_system, iris.coord_systems.RotatedGeogCS)
+
+def grid_key(cube):
+    ''' short hash identifying a horizontal grid, including its coordinate system'''
+    key = hashlib.sha1()
+    for coord in horizontal_coords(cube):
+        key.update(np.ascontiguousarray(coord.points, dtype='f8').tobytes())
+    key.update(repr(horizontal_coords(cube)[1].coord_system).encode())
+    return key.hexdigest()[:16]
+
+def true_lat_lon(cube):
+    ''' 2-D true latitude and longitude (-180 to 180) of every point of the cube's horizontal grid'''
+    y, x = horizontal_coords(cube)
+    grid_lon, grid_lat = np.meshgrid(x.points, y.points)
+    if is_rotated(cube):
+        cs = x.coord_system
+        lon, lat = unrotate_pole(grid_lon, grid_lat, cs.grid_north_pole_longitude, cs.grid_north_pole_latitude)
+    else:
+        lon, lat = grid_lon, grid_lat
+    lon = ((lon + 180.0) % 360.0) - 180.0
+    return lat, lon
+
+def lat_lon_bounds(lat, lon, margin=0.0):
+    ''' (lat_min, lat_max, lon_min, lon_max) around true lat/lon points, widened by margin degrees.
+    lon_min > lon_max when the region crosses the dateline.'''
+    lat_min = max(np.min(lat) - margin, -90.0)
+    lat_max = min(np.max(lat) + margin, 90.0)
+    lon = np.asarray(lon)
+    lon_360 = lon % 360.0
+    # a region is taken to cross the dateline if it is narrower in 0 to 360 longitudes
+    if np.ptp(lon_360) < np.ptp(lon):
+        lon_min, lon_max = np.min(lon_360), np.max(lon_360)
+    else:
+        lon_min, lon_max = np.min(lon), np.max(lon)
+    if lon_max - lon_min + 2*margin >= 360.0:
+        return lat_min, lat_max, -180.0, 180.0
+    lon_min = ((lon_min - margin + 180.0) % 360.0) - 180.0
+    lon_max = ((lon_max + margin + 180.0) % 360.0) - 180.0
+    return lat_min, lat_max, lon_min, lon_max
+
+def cached_grid(cube):
+    ''' true lat/lon and bounding box of the cube's horizontal grid, computed once per grid and cached'''
+    cache_file = os.path.join(cache_directory, grid_key(cube)+'_grid.npz')
+    if os.path.exists(cache_file):
+        with np.load(cache_file) as cached:
+            return cached['lat'], cached['lon'], tuple(cached['bbox'])
+    lat, lon = true_lat_lon(cube)
+    bbox = lat_lon_bounds(lat, lon)
+    os.makedirs(cache_directory, exist_ok=True)
+    # write then rename, so a concurrent job never reads a partial file
+    with open(cache_file+'.tmp', 'wb') as tmp:
+        np.savez(tmp, lat=lat, lon=lon, bbox=np.asarray(bbox))
+    os.replace(cache_file+'.tmp', cache_file)
+    return lat, lon, bbox
+
+def set_horizontal_grid(cube, template):
+    ''' replace the horizontal coordinates spanning the last two dimensions of cube with those of template'''
+    y_dim, x_dim = cube.ndim-2, cube.ndim-1
+    for coord in cube.coords():
+        if set(cube.coord_dims(coord)) & {y_dim, x_dim}:
+            cube.remove_coord(coord)
+    y, x = horizontal_coords(template)
+    cube.add_dim_coord(y.copy(), y_dim)
+    cube.add_dim_coord(x.copy(), x_dim)
+    return cube
+
+def extract_lat_lon_init_SM_region(cube,SM_init_cube):
+    ''' extract the region of a regular lat/lon cube covering SM_init_cube, which may be on a rotated-pole grid'''
+    lat_min, lat_max, lon_min, lon_max = cached_grid(SM_init_cube)[2]
+    cube = cube.extract(iris.Constraint(latitude=lambda cell: lat_min <= cell <= lat_max))
+    if lon_min <= lon_max:
+        return cube.extract(iris.Constraint(longitude=lambda cell: lon_min <= cell <= lon_max))
+    return cube.extract(iris.Constraint(longitude=lambda cell: cell >= lon_min or cell <= lon_max))
@@ -0,0 +1,93 @@
+# background file I/O for the soil moisture regridding scripts.
+# In multi-file runs (several dates or several target domains) the next input is read and the previous
+# result is written on background threads while the current file is converted/regridded, hiding most
+# of the (Lustre) filesystem latency behind compute.
+# NetCDF/HDF5 is not thread safe, so all background reads and writes share one lock. I/O therefore
+# overlaps with compute but never with other I/O. Loaders must realise data (e.g. cube.data or
+# DataArray.load()) so no lazy reads are left for the compute thread.
+import queue
+import threading
+
+io_lock = threading.Lock()
+
+_DONE = object()
+
+def prefetch(load, items, depth=1):
+    ''' yield (item, load(item)) for each item in turn, loading at most depth items ahead on a background thread'''
+    loaded = queue.Queue()
+    slots = threading.Semaphore(depth)
+    stop = threading.Event()
+
+    def worker():
+        try:
+            for item in items:
+                slots.acquire()
+                if stop.is_set():
+                    return
+                with io_lock:
+                    result = load(item)
+                loaded.put((item, result))
+        except BaseException as err:
+            loaded.put(err)
+        loaded.put(_DONE)
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    try:
+        while True:
+            result = loaded.get()
+            if result is _DONE:
+                break
+            if isinstance(result, BaseException):
+                raise result
+            # free the slot before handing over, so the next item loads while this one is processed
+            slots.release()
+            yield result
+    finally:
+        # unblock the worker if the caller stops early
+        stop.set()
+        slots.release()
+
+class BackgroundWriter:
+    ''' run save calls in submission order on a background thread, with at most depth saves waiting'''
+
+    def __init__(self, depth=1):
+        self._pending = queue.Queue(maxsize=depth)
+        self._error = None
+        self._thread = threading.Thread(target=self._worker, daemon=True)
+        self._thread.start()
+
+    def _worker(self):
+        while True:
+            job = self._pending.get()
+            if job is _DONE:
+                return
+            if self._error is not None:
+                continue
+            save, args, kwargs = job
+            try:
+                with io_lock:
+                    save(*args, **kwargs)
+            except BaseException as err:
+                self._error = err
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def submit(self, save, *args, **kwargs):
+        ''' queue save(*args, **kwargs); blocks while depth saves are already waiting'''
+        self._raise_error()
+        self._pending.put((save, args, kwargs))
+
+    def close(self):
+        ''' wait for all queued saves to finish, re-raising the first error'''
+        self._pending.put(_DONE)
+        self._thread.join()
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
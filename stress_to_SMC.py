@@ -2,13 +2,20 @@ import iris
 import xarray as xr
 import numpy as np
 import sys
+from smc_io import prefetch, BackgroundWriter
 
+# usage: stress_to_SMC.py SMstress regridded_dump SMC_outfile glm_start_dump snow_file smow_outfile [SMstress_2 SMC_outfile_2 smow_outfile_2 ...]
+# extra (SM stress, SMC outfile, smow outfile) triples, e.g. further dates on the same grid, reuse the soil properties.
+# The next SM stress file is read and the previous SMC written in the background while the current date is converted.
+# If a smow outfile does not end in '.nc', SMC and snow are written straight to a UM ancillary file instead of a NetCDF
+# smow file (no xancil needed). The grid headers are taken from regridded_dump, which must be a UM ancillary (qrparm.soil).
 SMstress_filename = sys.argv[1]
 regridded_dump_filename = sys.argv[2]
 regridded_SMC_outfile = sys.argv[3]
 glm_start_dump_filename = sys.argv[4]
 snow_file = sys.argv[5]
 regridded_smow_outfile = sys.argv[6]
+extra_dates = sys.argv[7:]
 
 def find_nearest_index(array, value):
     array = np.asarray(array)
@@ -24,69 +31,139 @@ def load_dump_file(dumpfile,stash_code):
     cube = xr_cube.to_iris()
     return cube
 
-def extract_lat_lon_init_SM_region(cube,SM_init_cube):
-    return cube.extract(iris.Constraint(latitude=lambda cell: np.min(SM_init_cube.coord('latitude').points) <= cell <= np.max(SM_init_cube.coord('latitude').points))).extract(iris.Constraint(longitude=lambda cell: np.min(SM_init_cube.coord('longitude').points) <= cell <= np.max(SM_init_cube.coord('longitude').points)))
+def load_SM_stress(SMstress_filename):
+    ''' load SM stress and read its data, so the read happens on the prefetch thread'''
+    cube = iris.load_cube(SMstress_filename)
+    cube.data
+    return cube
+
+class MaskedFieldProvider(object):
+    ''' mule data provider for one 2-D field, only filling missing data with mdi as the field is written'''
+    def __init__(self, data, mdi):
+        self.data = data
+        self.mdi = mdi
+
+    def _data_array(self):
+        return np.ma.filled(self.data, self.mdi)
+
+def save_ancillary(SM_regrid,snow,template_ancil_filename,ancil_outfile):
+    ''' write SMC soil layers and snow straight to a UM ancillary, streaming field by field.
+    Headers (grid, staggering, times) are copied from an ancillary on the same grid, as done by xancil.'''
+    import mule
+    template = mule.AncilFile.from_file(template_ancil_filename)
+    template_field = template.fields[0]
+    ancil = template.copy()
+    ancil.integer_constants.num_times = 1
+    ancil.integer_constants.num_levels = SM_regrid.shape[0]
+    ancil.integer_constants.num_field_types = 2
+
+    def new_field(stash, field_code, data):
+        field = template_field.copy()
+        field.lbuser4 = stash
+        field.lbfc = field_code
+        field.lbuser1 = 1 # real data
+        field.lbpack = 0
+        field.lbproc = 0
+        field.set_data_provider(MaskedFieldProvider(data, field.bmdi))
+        return field
+
+    # SMC on soil levels, with depth points and layer top/bottom held as in UM dumps
+    depth = SM_start_4km.coord('depth')
+    for depth_i in np.arange(SM_regrid.shape[0]):
+        field = new_field(9, 122, SM_regrid.data[depth_i])
+        field.lbvc = 6
+        field.lblev = depth_i+1
+        field.blev = depth.points[depth_i]
+        field.brsvd1 = depth.bounds[depth_i,0]
+        field.brlev = depth.bounds[depth_i,1]
+        ancil.fields.append(field)
+
+    field = new_field(23, 93, snow.data)
+    field.lbvc = 129 # surface
+    field.lblev = 9999
+    field.blev = 0.0
+    ancil.fields.append(field)
+
+    # fields are only filled and written one at a time here
+    ancil.to_file(ancil_outfile)
+
+def save_SMC(SM_regrid,regridded_SMC_outfile,regridded_smow_outfile):
+    iris.save(SM_regrid,regridded_SMC_outfile,fill_value=SM_regrid.data.fill_value)
+
+    if not regridded_smow_outfile.endswith('.nc'):
+        save_ancillary(SM_regrid,snow,regridded_dump_filename,regridded_smow_outfile)
+        return
+    smow = iris.cube.CubeList([SM_regrid,snow])
+    # combine files to create a smow file
+    iris.save(smow,regridded_smow_outfile,fill_value=SM_regrid.data.fill_value)
 
 rho_water = 997.77
 
+if len(extra_dates) % 3 != 0:
+    sys.exit('usage: stress_to_SMC.py SMstress regridded_dump SMC_outfile glm_start_dump snow_file smow_outfile [SMstress SMC_outfile smow_outfile ...]')
+SMstress_dates = list(zip([SMstress_filename] + extra_dates[0::3], [regridded_SMC_outfile] + extra_dates[1::3], [regridded_smow_outfile] + extra_dates[2::3]))
+
 # convert back to SMC using 4km ancil. Land ancillary created during previous run. May need to be done for other domains and resolution.
 SM_wilt_4km = iris.load_cube(regridded_dump_filename,'m01s00i040')
 SM_crit_4km = iris.load_cube(regridded_dump_filename,'m01s00i041')
 SM_sat_4km = iris.load_cube(regridded_dump_filename,'m01s00i043')
 SM_start_4km = iris.load_cube(glm_start_dump_filename,'moisture_content_of_soil_layer') # downloaded for depths
-
-SM_stress_regrid = iris.load_cube(SMstress_filename)
+# read soil properties now, rather than lazily while the next date is being prefetched
+for cube in [SM_wilt_4km,SM_crit_4km,SM_sat_4km]:
+    cube.data
 
 snow = iris.load_cube(snow_file,'m01s00i023')[0] # download snow from previous simulation (essentially all zero) to make xancil file (combines smc and smow together. Also use first timestep
+snow.data
 
 # work out SM depths, i.e. 0.1-0.0, 0.35-0.1
 SM_depths = SM_start_4km.coord('depth').bounds[:,1]-SM_start_4km.coord('depth').bounds[:,0]
 
-## convert from SM stress to SM volume
-# copy 4km SM stress regridded cube
-SM_volume_regrid = SM_stress_regrid.copy()
-SM_regrid = SM_stress_regrid.copy()
-
-# work out SM volume - (SMstress*(SMcrit-SMwilt))+SMwilt, then check SMV is below SM_saturation, i.e. model can't be above saturation.
-# then convert SM volume to actual SM content (SM = SMvolume*rho_water*SMdepths
-for depth_i in np.arange(SM_start_4km.coord('depth').shape[0]):
-    SM_volume_regrid.data[depth_i] = SM_stress_regrid.data[depth_i]*(SM_crit_4km.data-SM_wilt_4km.data)+SM_wilt_4km.data
-    SM_volume_regrid.data[depth_i] = np.min(np.ma.asarray([SM_volume_regrid.data[depth_i].data,SM_sat_4km.data.data]),axis=0)
-    SM_regrid.data[depth_i] = SM_volume_regrid.data[depth_i]*rho_water*SM_depths[depth_i]
-
-##
-# Final checks made by UM, in units of soil moisture content
-# Is SMC greater than 0.1*SM wilting value
-# another check, is SMC less than saturation.
-for depth_i in np.arange(SM_start_4km.coord('depth').shape[0]):
-    smc_min = 0.1*SM_wilt_4km.data*SM_depths[depth_i]*rho_water
-    SM_regrid.data[depth_i] = np.max(np.ma.asarray([smc_min,SM_regrid.data[depth_i].data]),axis=0)
-    smc_max = SM_sat_4km.data*SM_depths[depth_i]*rho_water
-    SM_regrid.data[depth_i] = np.min(np.ma.asarray([smc_max,SM_regrid.data[depth_i].data]),axis=0)
-
-# at the very end, mask negative value
-#SM_regrid.data = np.ma.masked_less(SM_regrid.data,0.0)
-
-#for depth_i in np.arange(SM_stress_regrid.coord('depth').shape[0]):
-#    SM_regrid.data[depth_i].mask = SM_wilt_4km.data.mask
-
-# if file contains 'soil_model_level_number' aux coord, need to add a depth coord.
-aux_coord_names = []
-for coord in SM_stress_regrid.aux_coords:
-    aux_coord_names.append(coord.var_name)
-
-if (np.asarray(aux_coord_names) == 'soil_model_level_number').any():
-    SM_regrid.add_dim_coord(SM_start_4km.coord('depth'),0)
-
-# mask all negative values in SM_regrid
-SM_regrid.data = np.ma.masked_less(SM_regrid.data,0.0)
-#SM_regrid.data = np.ma.masked_greater(SM_regrid.data,5000.0)
-#SM_regrid.data.fill_value = np.nan
-# fill snow with 0.0
-#snow.data = snow.data.fill(0.0)
-
-iris.save(SM_regrid,regridded_SMC_outfile,fill_value=SM_regrid.data.fill_value)
-
-smow = iris.cube.CubeList([SM_regrid,snow])
-# combine files to create a smow file
-iris.save(smow,regridded_smow_outfile,fill_value=SM_regrid.data.fill_value)
+def stress_to_SMC(SM_stress_regrid):
+    ## convert from SM stress to SM volume
+    # copy 4km SM stress regridded cube
+    SM_volume_regrid = SM_stress_regrid.copy()
+    SM_regrid = SM_stress_regrid.copy()
+
+    # work out SM volume - (SMstress*(SMcrit-SMwilt))+SMwilt, then check SMV is below SM_saturation, i.e. model can't be above saturation.
+    # then convert SM volume to actual SM content (SM = SMvolume*rho_water*SMdepths
+    for depth_i in np.arange(SM_start_4km.coord('depth').shape[0]):
+        SM_volume_regrid.data[depth_i] = SM_stress_regrid.data[depth_i]*(SM_crit_4km.data-SM_wilt_4km.data)+SM_wilt_4km.data
+        SM_volume_regrid.data[depth_i] = np.min(np.ma.asarray([SM_volume_regrid.data[depth_i].data,SM_sat_4km.data.data]),axis=0)
+        SM_regrid.data[depth_i] = SM_volume_regrid.data[depth_i]*rho_water*SM_depths[depth_i]
+
+    ##
+    # Final checks made by UM, in units of soil moisture content
+    # Is SMC greater than 0.1*SM wilting value
+    # another check, is SMC less than saturation.
+    for depth_i in np.arange(SM_start_4km.coord('depth').shape[0]):
+        smc_min = 0.1*SM_wilt_4km.data*SM_depths[depth_i]*rho_water
+        SM_regrid.data[depth_i] = np.max(np.ma.asarray([smc_min,SM_regrid.data[depth_i].data]),axis=0)
+        smc_max = SM_sat_4km.data*SM_depths[depth_i]*rho_water
+        SM_regrid.data[depth_i] = np.min(np.ma.asarray([smc_max,SM_regrid.data[depth_i].data]),axis=0)
+
+    # at the very end, mask negative value
+    #SM_regrid.data = np.ma.masked_less(SM_regrid.data,0.0)
+
+    #for depth_i in np.arange(SM_stress_regrid.coord('depth').shape[0]):
+    #    SM_regrid.data[depth_i].mask = SM_wilt_4km.data.mask
+
+    # if file contains 'soil_model_level_number' aux coord, need to add a depth coord.
+    aux_coord_names = []
+    for coord in SM_stress_regrid.aux_coords:
+        aux_coord_names.append(coord.var_name)
+
+    if (np.asarray(aux_coord_names) == 'soil_model_level_number').any():
+        SM_regrid.add_dim_coord(SM_start_4km.coord('depth'),0)
+
+    # mask all negative values in SM_regrid
+    SM_regrid.data = np.ma.masked_less(SM_regrid.data,0.0)
+    #SM_regrid.data = np.ma.masked_greater(SM_regrid.data,5000.0)
+    #SM_regrid.data.fill_value = np.nan
+    # fill snow with 0.0
+    #snow.data = snow.data.fill(0.0)
+    return SM_regrid
+
+# convert every date, all sharing the soil properties above
+with BackgroundWriter() as writer:
+    for (_, regridded_SMC_outfile, regridded_smow_outfile), SM_stress_regrid in prefetch(lambda date: load_SM_stress(date[0]), SMstress_dates):
+        writer.submit(save_SMC,stress_to_SMC(SM_stress_regrid),regridded_SMC_outfile,regridded_smow_outfile)